@@ -30,7 +30,7 @@ def predict(product_id: str = Query(..., description="The product ID to predict"
                 product_id=product_id,
                 # these are read from the config file
                 # the end user doesn't have to provide them
-                ohlc_window_sec=config.ohlcv_window_sec,
+                ohlc_window_ms=config.ohlcv_window_ms,
                 forecast_steps=config.forecast_steps,
                 status=config.ml_model_status,
             )
@@ -1,3 +1,4 @@
+from pydantic import model_validator
 from pydantic_settings import BaseSettings
 
 
@@ -8,7 +9,9 @@ class Config(BaseSettings):
     feature_view_version: int
     feature_group_name: str
     feature_group_version: int
-    ohlcv_window_sec: int
+    # the size of the candle windows, either in milliseconds (e.g. 250) or in seconds
+    ohlcv_window_ms: int | None = None
+    ohlcv_window_sec: int | None = None
     product_id: str
     last_n_days: int
     forecast_steps: int
@@ -18,6 +21,17 @@ class Config(BaseSettings):
     ml_model_status: str
     api_supported_product_ids: list[str]
 
+    @model_validator(mode="after")
+    def window_in_ms(self) -> "Config":
+        """
+        Fills the window in milliseconds from the one in seconds.
+        """
+        if self.ohlcv_window_ms is None:
+            if self.ohlcv_window_sec is None:
+                raise ValueError("Set OHLCV_WINDOW_MS or OHLCV_WINDOW_SEC")
+            self.ohlcv_window_ms = self.ohlcv_window_sec * 1000
+        return self
+
 
 class HopsworksConfig(BaseSettings):
     model_config = {"env_file": "hopsworks.credentials.env"}
@@ -1,6 +1,28 @@
 import pandas as pd
 import talib
 
+# The columns `add_technical_indicators` adds
+TECHNICAL_INDICATORS = [
+    "SMA_7",
+    "SMA_14",
+    "SMA_28",
+    "EMA_7",
+    "EMA_14",
+    "EMA_28",
+    "RSI_14",
+    "MACD",
+    "MACD_Signal",
+    "BB_Upper",
+    "BB_Middle",
+    "BB_Lower",
+    "Stoch_K",
+    "Stoch_D",
+    "OBV",
+    "ATR",
+    "CCI",
+    "CMF",
+]
+
 
 def add_temporal_features(df: pd.DataFrame) -> pd.DataFrame:
     """
@@ -27,6 +49,22 @@ def add_temporal_features(df: pd.DataFrame) -> pd.DataFrame:
     return df
 
 
+def has_technical_indicators(df: pd.DataFrame) -> bool:
+    """
+    Whether the most recent candle already has all the technical indicators, i.e.
+    the trade_to_ohlcv service computed them (OHLCV_INDICATORS=true).
+
+    Args:
+        df (pd.DataFrame): The candles, sorted by 'timestamp_ms'.
+
+    Returns:
+        bool: True if the technical indicators don't need to be computed.
+    """
+    if df.empty or not set(TECHNICAL_INDICATORS).issubset(df.columns):
+        return False
+    return bool(df[TECHNICAL_INDICATORS].iloc[-1].notna().all())
+
+
 def add_technical_indicators(df: pd.DataFrame) -> pd.DataFrame:
     """
     Add technical indicators to the features.
@@ -1,10 +1,15 @@
-def get_model_name(product_id: str, ohlc_window_sec: int, forecast_steps: int) -> str:
+from src.utils import window_name
+
+
+def get_model_name(product_id: str, ohlc_window_ms: int, forecast_steps: int) -> str:
     """
     Returns the name of the model in the model registry given the
     - product_id
-    - ohlc_window_sec
+    - ohlc_window_ms
     - forecast_steps
 
-    The model name is used to identify the model in the model registry.
+    The model name is used to identify the model in the model registry. Windows of
+    whole seconds keep their names in seconds, e.g. "60s", the others are in
+    milliseconds, e.g. "250ms".
     """
-    return f"price_predictor_{product_id.replace('/', '_')}_{ohlc_window_sec}s_{forecast_steps}steps"
+    return f"price_predictor_{product_id.replace('/', '_')}_{window_name(ohlc_window_ms)}_{forecast_steps}steps"
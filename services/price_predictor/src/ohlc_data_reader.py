@@ -9,6 +9,7 @@ from hsfs.feature_view import FeatureView
 from loguru import logger
 
 from src.config import HopsworksConfig
+from src.utils import get_candle_timestamps
 
 
 class OhlcDataReader:
@@ -22,14 +23,14 @@ class OhlcDataReader:
 
     def __init__(
         self,
-        ohlc_window_sec: int,
+        ohlc_window_ms: int,
         hopsworks_config: HopsworksConfig,
         feature_view_name: str,
         feature_view_version: int,
         feature_group_name: Optional[str] = None,
         feature_group_version: Optional[int] = None,
     ):
-        self.ohlc_window_sec = ohlc_window_sec
+        self.ohlc_window_ms = ohlc_window_ms
         self.feature_view_name = feature_view_name
         self.feature_view_version = feature_view_version
         self.feature_group_name = feature_group_name
@@ -74,7 +75,7 @@ class OhlcDataReader:
     ) -> pd.DataFrame:
         """
         Reads OHLC data from the online feature store for the given `product_ids`
-        and the time range `[from_timestamp_ms, to_timestamp_ms]` in `self.ohlc_window_sec`
+        and the time range `[from_timestamp_ms, to_timestamp_ms]` in `self.ohlc_window_ms`
         steps
 
         Args:
@@ -120,17 +121,11 @@ class OhlcDataReader:
         Returns:
             List[int]: The list of timestamps we will use to read the OHLC data.
         """
-        to_timestamp_ms = int(time.time() * 1000)
-        to_timestamp_ms -= to_timestamp_ms % 60000
-
-        n_candles_per_minutes = 60 // self.ohlc_window_sec
-
-        timestamps = [
-            to_timestamp_ms - i * self.ohlc_window_sec * 1000
-            for i in range(last_n_minutes * n_candles_per_minutes)
-        ]
-
-        return timestamps
+        return get_candle_timestamps(
+            now_ms=int(time.time() * 1000),
+            ohlc_window_ms=self.ohlc_window_ms,
+            last_n_minutes=last_n_minutes,
+        )
 
     def _get_feature_view(self) -> FeatureView:
         """
@@ -221,7 +216,7 @@ if __name__ == "__main__":
     from src.config import hopsworks_config
 
     ohlc_data_reader = OhlcDataReader(
-        ohlc_window_sec=60,
+        ohlc_window_ms=60_000,
         hopsworks_config=hopsworks_config,
         feature_view_name="ohlcv_feature_view_two",
         feature_view_version=1,
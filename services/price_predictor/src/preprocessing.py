@@ -3,13 +3,29 @@ from datetime import datetime, timezone
 from loguru import logger
 import pandas as pd
 
+from src.feature_engineering import TECHNICAL_INDICATORS
+
 
 def keep_only_numeric_columns(df: pd.DataFrame) -> pd.DataFrame:
     """
     Keep only the numeric columns from the OHLCV data we read from
-    the feature store.
+    the feature store, including the technical indicators if the candles have them.
+
+    The feature store lowercases the names of the features (e.g. "sma_7"), so the
+    indicators get back the names `add_technical_indicators` gives them, and the
+    values of the first candles, which have none yet, become NaN.
     """
-    return df[["open", "high", "low", "close", "volume", "timestamp_ms"]]
+    columns = {column.lower(): column for column in df.columns}
+    indicators = {
+        columns[name.lower()]: name
+        for name in TECHNICAL_INDICATORS
+        if name.lower() in columns
+    }
+    df = df[["open", "high", "low", "close", "volume", "timestamp_ms", *indicators]]
+    if not indicators:
+        return df
+    df = df.rename(columns=indicators)
+    return df.astype({name: "float64" for name in indicators.values()})
 
 
 def get_and_check_most_recent_row(df: pd.DataFrame) -> pd.DataFrame:
@@ -6,7 +6,11 @@ from loguru import logger
 from pydantic import BaseModel
 
 from src.config import comet_config, hopsworks_config
-from src.feature_engineering import add_technical_indicators, add_temporal_features
+from src.feature_engineering import (
+    add_technical_indicators,
+    add_temporal_features,
+    has_technical_indicators,
+)
 from src.model_registry import get_model_name
 from src.ohlc_data_reader import OhlcDataReader
 from src.preprocessing import keep_only_numeric_columns, get_and_check_most_recent_row
@@ -32,7 +36,7 @@ class PricePredictor:
     def __init__(
         self,
         product_id: str,
-        ohlc_window_sec: int,
+        ohlc_window_ms: int,
         forecast_steps: int,
         feature_view_name: str,
         feature_view_version: int,
@@ -41,7 +45,7 @@ class PricePredictor:
         model_path: str,
     ):
         self.product_id = product_id
-        self.ohlc_window_sec = ohlc_window_sec
+        self.ohlc_window_ms = ohlc_window_ms
         self.forecast_steps = forecast_steps
         self.feature_view_name = feature_view_name
         self.feature_view_version = feature_view_version
@@ -56,7 +60,7 @@ class PricePredictor:
             f"Creating OHLC data reader and establishing connection to feature store"
         )
         self.ohlc_data_reader = OhlcDataReader(
-            ohlc_window_sec=self.ohlc_window_sec,
+            ohlc_window_ms=self.ohlc_window_ms,
             hopsworks_config=hopsworks_config,
             feature_view_name=self.feature_view_name,
             feature_view_version=self.feature_view_version,
@@ -70,7 +74,7 @@ class PricePredictor:
     def from_model_registry(
         cls,
         product_id: str,
-        ohlc_window_sec: int,
+        ohlc_window_ms: int,
         forecast_steps: int,
         status: str,
     ):
@@ -86,7 +90,7 @@ class PricePredictor:
 
         Args:
             - product_id: the product_id of the model we want to fetch
-            - ohlc_window_sec: the ohlc_window_sec of the model we want to fetch
+            - ohlc_window_ms: the ohlc_window_ms of the model we want to fetch
             - forecast_steps: the forecast_steps of the model we want to fetch
             - status: the status of the model we want to fetch, for example "production"
 
@@ -99,7 +103,7 @@ class PricePredictor:
         # Step 1: Download the model artifact from the model registry
         model = comet_api.get_model(
             workspace=comet_config.comet_workspace,
-            model_name=get_model_name(product_id, ohlc_window_sec, forecast_steps),
+            model_name=get_model_name(product_id, ohlc_window_ms, forecast_steps),
         )
         logger.debug(f"Found model: {model}")
         # find the version for the current model with the given `status`
@@ -122,7 +126,7 @@ class PricePredictor:
         # download the model artifact for this `model_version`
         model.download(version=model_version, output_folder="./")
         model_path = (
-            f"./{get_model_name(product_id, ohlc_window_sec, forecast_steps)}.joblib"
+            f"./{get_model_name(product_id, ohlc_window_ms, forecast_steps)}.joblib"
         )
 
         # Step 2: Fetch the relevant metadata from the model registry
@@ -156,7 +160,7 @@ class PricePredictor:
         return cls(
             model_path=model_path,
             product_id=product_id,
-            ohlc_window_sec=ohlc_window_sec,
+            ohlc_window_ms=ohlc_window_ms,
             forecast_steps=forecast_steps,
             feature_view_name=feature_view_name,
             feature_view_version=feature_view_version,
@@ -176,15 +180,21 @@ class PricePredictor:
         )
         num_candles = len(raw_ohlcv_data)
         logger.debug(f"Read {num_candles} OHLCV candles from the online feature group")
-        if num_candles < self.last_n_minutes:
+        expected_num_candles = self.last_n_minutes * 60_000 // self.ohlc_window_ms
+        if num_candles < expected_num_candles:
             logger.warning(
-                f"The number of OHLCV candles read from the online feature group is less than last_n_minutes ({num_candles}/{self.last_n_minutes})"
+                f"The number of OHLCV candles read from the online feature group is less than expected for last_n_minutes ({num_candles}/{expected_num_candles})"
             )
 
         # Preprocess the data and add necessary features
         logger.debug(f"Preprocessing the data and adding necessary features")
         ohlcv_data = keep_only_numeric_columns(raw_ohlcv_data)
-        ohlcv_data = add_technical_indicators(ohlcv_data)
+        if has_technical_indicators(ohlcv_data):
+            # the candles come with the indicators, updated in the streaming layer
+            # from the full history of the product, so there is nothing to compute
+            logger.debug("Using the technical indicators of the candles")
+        else:
+            ohlcv_data = add_technical_indicators(ohlcv_data)
         ohlcv_data = add_temporal_features(ohlcv_data)
         most_recent_row = get_and_check_most_recent_row(ohlcv_data)
 
@@ -194,7 +204,7 @@ class PricePredictor:
         # get the timestamp_ms that corresponds to the predicted_price
         predicted_timestamp_ms = (
             int(most_recent_row["timestamp_ms"].values[0])
-            + self.forecast_steps * self.ohlc_window_sec * 1000
+            + self.forecast_steps * self.ohlc_window_ms
         )
 
         # calculate the predicted percentage change
@@ -224,7 +234,7 @@ if __name__ == "__main__":
 
     predictor = PricePredictor.from_model_registry(
         product_id="BTC/USD",
-        ohlc_window_sec=60,
+        ohlc_window_ms=60_000,
         forecast_steps=5,
         status="production",
     )
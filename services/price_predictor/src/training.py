@@ -24,7 +24,7 @@ def train_model(
     feature_view_version: int,
     feature_group_name: str,
     feature_group_version: int,
-    ohlcv_window_sec: int,
+    ohlcv_window_ms: int,
     product_id: str,
     last_n_days: int,
     forecast_steps: int,
@@ -45,7 +45,7 @@ def train_model(
         feature_view_version: The version of the feature view.
         feature_group_name: The name of the feature group.
         feature_group_version: The version of the feature group.
-        ohlcv_window_sec: The window size of the OHLCV data.
+        ohlcv_window_ms: The window size of the OHLCV data, in milliseconds.
         product_id: The product ID.
         last_n_days: The number of days to look back.
         forecast_steps: The number of steps to forecast.
@@ -76,7 +76,7 @@ def train_model(
 
     # Load (sorted) feature data from the feature store
     ohlcv_data_reader = OhlcDataReader(
-        ohlc_window_sec=ohlcv_window_sec,
+        ohlc_window_ms=ohlcv_window_ms,
         hopsworks_config=hopsworks_config,
         feature_view_name=feature_view_name,
         feature_view_version=feature_view_version,
@@ -165,7 +165,7 @@ def train_model(
     experiment.log_metric("mae_train", mae_train)
 
     # Save the model locally
-    model_name = get_model_name(product_id, ohlcv_window_sec, forecast_steps)
+    model_name = get_model_name(product_id, ohlcv_window_ms, forecast_steps)
     local_model_path = f"{model_name}.joblib"
     joblib.dump(xgb_model.get_model_obj(), local_model_path)
 
@@ -204,7 +204,7 @@ if __name__ == "__main__":
         feature_view_version=config.feature_view_version,
         feature_group_name=config.feature_group_name,
         feature_group_version=config.feature_group_version,
-        ohlcv_window_sec=config.ohlcv_window_sec,
+        ohlcv_window_ms=config.ohlcv_window_ms,
         product_id=config.product_id,
         last_n_days=config.last_n_days,
         forecast_steps=config.forecast_steps,
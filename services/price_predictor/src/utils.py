@@ -1,5 +1,6 @@
 from datetime import datetime, timezone
 import subprocess
+from typing import List
 
 import pandas as pd
 
@@ -23,6 +24,40 @@ def timestamp_ms_to_human_readable_utc(timestamp_ms: int) -> str:
     return utc_datetime.strftime("%Y-%m-%d %H:%M:%S UTC")
 
 
+def window_name(ohlc_window_ms: int) -> str:
+    """
+    Returns a short name of a window size, e.g. "60s" or "250ms".
+    """
+    if ohlc_window_ms % 1000 == 0:
+        return f"{ohlc_window_ms // 1000}s"
+    return f"{ohlc_window_ms}ms"
+
+
+def get_candle_timestamps(
+    now_ms: int, ohlc_window_ms: int, last_n_minutes: int
+) -> List[int]:
+    """
+    Returns the timestamps of the candles of the last `last_n_minutes` minutes, from
+    the most recent one.
+
+    The candles are timestamped with the end of their window, and the windows are
+    aligned on multiples of their size since the epoch, not on the minutes, so the
+    most recent candle ends at the last multiple of the window size, and a window of
+    e.g. 90s or 250ms works as well as one that divides a minute.
+
+    Args:
+        now_ms (int): The current time in milliseconds.
+        ohlc_window_ms (int): The size of the windows in milliseconds.
+        last_n_minutes (int): The number of minutes to go back in time.
+
+    Returns:
+        List[int]: The timestamps of the candles, from the most recent one.
+    """
+    to_timestamp_ms = now_ms - now_ms % ohlc_window_ms
+    n_candles = last_n_minutes * 60_000 // ohlc_window_ms
+    return [to_timestamp_ms - i * ohlc_window_ms for i in range(n_candles)]
+
+
 def get_git_commit_hash() -> str:
     """
     Get the git commit hash.
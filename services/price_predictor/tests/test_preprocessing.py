@@ -0,0 +1,68 @@
+import numpy as np
+import pandas as pd
+
+from src.feature_engineering import TECHNICAL_INDICATORS, has_technical_indicators
+from src.preprocessing import keep_only_numeric_columns
+
+
+def feature_view_output(n_candles: int, n_warm_up: int) -> pd.DataFrame:
+    """
+    The candles like `get_feature_vectors` returns them: the lowercased names of
+    the feature group, and None for the indicators of the first candles.
+    """
+    candles = []
+    for i in range(n_candles):
+        candle = {
+            "product_id": "BTC/USD",
+            "timestamp_ms": 60_000 * (i + 1),
+            "open": 100.0,
+            "high": 101.0,
+            "low": 99.0,
+            "close": 100.5,
+            "volume": 1.0,
+        }
+        for name in TECHNICAL_INDICATORS:
+            candle[name.lower()] = None if i < n_warm_up else float(i)
+        candles.append(candle)
+    return pd.DataFrame(candles)
+
+
+def test_indicators_of_the_feature_view_are_used():
+    df = keep_only_numeric_columns(feature_view_output(n_candles=5, n_warm_up=3))
+
+    assert list(df.columns) == [
+        "open",
+        "high",
+        "low",
+        "close",
+        "volume",
+        "timestamp_ms",
+        *TECHNICAL_INDICATORS,
+    ]
+    assert (df[TECHNICAL_INDICATORS].dtypes == np.float64).all()
+    assert df[TECHNICAL_INDICATORS].iloc[:3].isna().all().all()
+    assert has_technical_indicators(df)
+
+
+def test_indicators_still_warming_up_are_computed():
+    df = keep_only_numeric_columns(feature_view_output(n_candles=3, n_warm_up=3))
+
+    assert not has_technical_indicators(df)
+
+
+def test_candles_without_indicators_are_kept_as_they_are():
+    raw = feature_view_output(n_candles=3, n_warm_up=0).drop(
+        columns=[name.lower() for name in TECHNICAL_INDICATORS]
+    )
+
+    df = keep_only_numeric_columns(raw)
+
+    assert list(df.columns) == [
+        "open",
+        "high",
+        "low",
+        "close",
+        "volume",
+        "timestamp_ms",
+    ]
+    assert not has_technical_indicators(df)
@@ -1,6 +1,10 @@
 import pytest
 from datetime import datetime, timezone
-from src.utils import timestamp_ms_to_human_readable_utc
+from src.utils import (
+    get_candle_timestamps,
+    timestamp_ms_to_human_readable_utc,
+    window_name,
+)
 
 
 def test_timestamp_ms_to_human_readable_utc():
@@ -18,3 +22,28 @@ def test_timestamp_ms_to_human_readable_utc():
     leap_year_ms = 1582934400000  # 2020-02-29 00:00:00 UTC
     expected_leap_output = "2020-02-29 00:00:00 UTC"
     assert timestamp_ms_to_human_readable_utc(leap_year_ms) == expected_leap_output
+
+
+def test_get_candle_timestamps():
+    now_ms = 1609459200000 + 95_123  # 2021-01-01 00:01:35.123 UTC
+
+    # 1 minute of 250ms candles, from the one that ended at 00:01:35.000
+    timestamps = get_candle_timestamps(now_ms, 250, last_n_minutes=1)
+    assert len(timestamps) == 240
+    assert timestamps[:2] == [1609459200000 + 95_000, 1609459200000 + 94_750]
+
+    # 90s windows are aligned on the epoch, not on the minutes
+    timestamps = get_candle_timestamps(now_ms, 90_000, last_n_minutes=3)
+    assert timestamps == [1609459200000 + 90_000, 1609459200000]
+
+    # whole minutes still end on the minute
+    assert get_candle_timestamps(now_ms, 60_000, last_n_minutes=2) == [
+        1609459200000 + 60_000,
+        1609459200000,
+    ]
+
+
+def test_window_name():
+    assert window_name(60_000) == "60s"
+    assert window_name(100) == "100ms"
+    assert window_name(1_500) == "1500ms"
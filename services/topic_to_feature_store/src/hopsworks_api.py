@@ -52,6 +52,11 @@ class HopsworksAPI:
 
         # Convert the value to a pandas DataFrame
         value_df = pd.DataFrame(value)
+        # The technical indicators of the first candles of a product are null. A
+        # column with only nulls would be an object column, which the feature
+        # group rejects, or gives the wrong type if it creates the feature group
+        null_columns = value_df.columns[value_df.isna().all()]
+        value_df = value_df.astype({column: "float64" for column in null_columns})
 
         # Insert the value into the feature group
         result = feature_group.insert(
@@ -0,0 +1,95 @@
+"""
+Measures how many trades per second we can replay from a warm trade cache into
+Kafka messages, before and after the columnar fast path.
+
+- before: read the trades as Trade objects, and serialize them one by one with
+  `topic.serialize(value=trade.model_dump())`, like `produce_trades` used to do.
+- after: read the trades as a TradeBatch, and serialize the whole batch at once
+  with `serialize_trade_batch`.
+
+Both paths stop right before `producer.produce`, so we don't need a Kafka broker.
+
+Usage:
+    poetry run python -m benchmarks.bench_cached_replay --n-days 3 --trades-per-day 500000
+"""
+
+import argparse
+import random
+import tempfile
+import time
+
+from quixstreams.models import Topic
+
+from src.trade_data_source.trade import Trade
+from src.trade_data_source.trade_cache import DAY_MS, TradeCache
+from src.trade_serializer import serialize_trade_batch
+
+PRODUCT_ID = "BTC/USD"
+# 2024-10-01 00:00:00 UTC
+FROM_MS = 1727740800000
+
+
+def fill_cache(cache: TradeCache, n_days: int, trades_per_day: int) -> None:
+    for day in range(n_days):
+        day_ms = FROM_MS + day * DAY_MS
+        timestamps = sorted(
+            random.randrange(day_ms, day_ms + DAY_MS) for _ in range(trades_per_day)
+        )
+        trades = [
+            Trade(
+                product_id=PRODUCT_ID,
+                quantity=round(random.uniform(0.0001, 2.0), 8),
+                price=round(random.uniform(60_000, 70_000), 1),
+                timestamp_ms=ts,
+            )
+            for ts in timestamps
+        ]
+        cache.write(PRODUCT_ID, trades, day_ms, day_ms + DAY_MS - 1)
+
+
+def replay_objects(cache: TradeCache, topic: Topic, n_days: int) -> int:
+    n_trades = 0
+    for day in range(n_days):
+        day_ms = FROM_MS + day * DAY_MS
+        for trade in cache.read(PRODUCT_ID, day_ms, day_ms + DAY_MS - 1):
+            message = topic.serialize(
+                key=trade.product_id.replace("/", "-"), value=trade.model_dump()
+            )
+            n_trades += message.value is not None
+    return n_trades
+
+
+def replay_columnar(cache: TradeCache, topic: Topic, n_days: int) -> int:
+    n_trades = 0
+    for day in range(n_days):
+        day_ms = FROM_MS + day * DAY_MS
+        trades = cache.read_batch(PRODUCT_ID, day_ms, day_ms + DAY_MS - 1)
+        _, values = serialize_trade_batch(trades)
+        n_trades += len(values)
+    return n_trades
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n-days", type=int, default=3)
+    parser.add_argument("--trades-per-day", type=int, default=200_000)
+    args = parser.parse_args()
+
+    topic = Topic(name="trades", value_serializer="json")
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = TradeCache(cache_dir)
+        fill_cache(cache, args.n_days, args.trades_per_day)
+
+        for name, replay in [("before", replay_objects), ("after", replay_columnar)]:
+            start = time.perf_counter()
+            n_trades = replay(cache, topic, args.n_days)
+            elapsed = time.perf_counter() - start
+            print(
+                f"{name:>6}: {n_trades} trades in {elapsed:.2f}s "
+                f"({n_trades / elapsed:,.0f} trades/sec)"
+            )
+
+
+if __name__ == "__main__":
+    main()
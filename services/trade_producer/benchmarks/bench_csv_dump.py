@@ -0,0 +1,76 @@
+"""
+Measures how many trades per second we can read from a Kraken trade history CSV
+file with `KrakenCSVDump`, with and without filling the trade cache.
+
+The CSV file is generated with the same layout as the Kraken dumps (timestamp in
+seconds, price, volume, without a header).
+
+Usage:
+    poetry run python -m benchmarks.bench_csv_dump --n-trades 5000000
+"""
+
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+
+from src.trade_data_source.kraken_csv_dump import KrakenCSVDump
+from src.trade_data_source.trade_cache import TradeCache
+
+# 2024-01-01 00:00:00 UTC
+FROM_SEC = 1704067200
+YEAR_SEC = 365 * 24 * 60 * 60
+
+
+def write_dump(path: Path, n_trades: int) -> None:
+    rng = np.random.default_rng(42)
+    timestamps = np.sort(rng.uniform(FROM_SEC, FROM_SEC + YEAR_SEC, n_trades))
+    table = pa.table(
+        {
+            "timestamp": np.round(timestamps, 4),
+            "price": np.round(rng.uniform(40_000, 70_000, n_trades), 1),
+            "volume": np.round(rng.uniform(0.00001, 2.0, n_trades), 8),
+        }
+    )
+    pa_csv.write_csv(
+        table, path, write_options=pa_csv.WriteOptions(include_header=False)
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n-trades", type=int, default=2_000_000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        dump_path = Path(tmp_dir) / "XBTUSD.csv"
+        write_dump(dump_path, args.n_trades)
+        size_mb = dump_path.stat().st_size / 1024**2
+
+        for name, cache_dir in [
+            ("read", None),
+            ("read + cache", str(Path(tmp_dir) / "cache")),
+        ]:
+            start = time.perf_counter()
+            dump = KrakenCSVDump(
+                tmp_dir,
+                ["BTC/USD"],
+                cache=TradeCache(cache_dir) if cache_dir else None,
+            )
+            n_trades = 0
+            while not dump.is_done():
+                n_trades += len(dump.get_trades())
+            elapsed = time.perf_counter() - start
+
+            print(
+                f"{name:>12}: {n_trades} trades ({size_mb:.0f}MB) in {elapsed:.2f}s "
+                f"({n_trades / elapsed:,.0f} trades/sec)"
+            )
+
+
+if __name__ == "__main__":
+    main()
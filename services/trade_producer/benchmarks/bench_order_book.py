@@ -0,0 +1,108 @@
+"""
+Measures how many Kraken `book` messages per second we can handle, from the raw
+message to the updated (and checksum-verified) OrderBook, for several products.
+
+The messages are generated like the ones of a busy book: each one changes a couple
+of levels near the top, sometimes adding or removing a level.
+
+Usage:
+    poetry run python -m benchmarks.bench_order_book --n-products 10 --depth 25
+"""
+
+import argparse
+import time
+
+import numpy as np
+import orjson
+
+from src.trade_data_source.order_book import OrderBook
+
+
+def make_messages(
+    product_ids: list[str], depth: int, n_messages: int
+) -> tuple[list[bytes], list[bytes]]:
+    """
+    Returns a snapshot message per product, and `n_messages` update messages
+    spread over the products, with the checksums Kraken would send.
+    """
+    rng = np.random.default_rng(42)
+    books = {
+        product_id: OrderBook(product_id, depth, price_precision=1, qty_precision=8)
+        for product_id in product_ids
+    }
+    snapshots = []
+    for product_id, book in books.items():
+        bids = [{"price": 50_000.0 - i, "qty": 1.0} for i in range(depth)]
+        asks = [{"price": 50_001.0 + i, "qty": 1.0} for i in range(depth)]
+        book.apply_snapshot(bids, asks)
+        data = {"symbol": product_id, "bids": bids, "asks": asks}
+        data["checksum"] = book.checksum()
+        snapshots.append(
+            orjson.dumps({"channel": "book", "type": "snapshot", "data": [data]})
+        )
+
+    updates = []
+    for i in range(n_messages):
+        product_id = product_ids[i % len(product_ids)]
+        book = books[product_id]
+        side = "bids" if rng.random() < 0.5 else "asks"
+        sign = -1 if side == "bids" else 1
+        levels = []
+        for _ in range(2):
+            price = float(
+                (50_000 if side == "bids" else 50_001) + sign * rng.integers(depth)
+            )
+            # a few updates remove their level
+            qty = 0.0 if rng.random() < 0.1 else round(float(rng.uniform(0.01, 5)), 8)
+            levels.append({"price": price, "qty": qty})
+        data = {"symbol": product_id, "bids": [], "asks": []}
+        data[side] = levels
+        book.apply_update(data["bids"], data["asks"])
+        data["checksum"] = book.checksum()
+        data["timestamp"] = "2024-06-17T09:36:39.467866Z"
+        updates.append(
+            orjson.dumps({"channel": "book", "type": "update", "data": [data]})
+        )
+    return snapshots, updates
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n-products", type=int, default=10)
+    parser.add_argument("--depth", type=int, default=25)
+    parser.add_argument("--n-messages", type=int, default=200_000)
+    args = parser.parse_args()
+
+    product_ids = [f"P{i}/USD" for i in range(args.n_products)]
+    snapshots, updates = make_messages(product_ids, args.depth, args.n_messages)
+
+    for verify in [False, True]:
+        books = {
+            product_id: OrderBook(
+                product_id, args.depth, price_precision=1, qty_precision=8
+            )
+            for product_id in product_ids
+        }
+        for message in snapshots:
+            data = orjson.loads(message)["data"][0]
+            books[data["symbol"]].apply_snapshot(data["bids"], data["asks"])
+
+        start = time.perf_counter()
+        for message in updates:
+            for data in orjson.loads(message)["data"]:
+                book = books[data["symbol"]]
+                book.apply_update(data["bids"], data["asks"])
+                if verify and book.checksum() != data["checksum"]:
+                    raise ValueError(f"Checksum mismatch for {book.product_id}")
+        elapsed = time.perf_counter() - start
+
+        name = "update + checksum" if verify else "update"
+        print(
+            f"{name:>17}: {len(updates) / elapsed:,.0f} messages/sec "
+            f"({elapsed / len(updates) * 1e6:.1f}us per message, "
+            f"{args.n_products} products, depth {args.depth})"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+Measures how many trades per second we can parse from raw Kraken websocket frames,
+before and after the fast decoding path of KrakenWebsocketAPI.
+
+- before: `json.loads` and `datetime.fromisoformat` for every trade, like
+  `KrakenWebsocketAPI.get_trades` used to do.
+- after: `KrakenWebsocketAPI.parse_trades`, which uses orjson and the cached
+  RFC3339 parser.
+
+By default the frames are generated in the Kraken v2 `trade` channel format, with
+bursts of up to `--max-trades-per-frame` trades. You can also replay frames you
+recorded from the real API, one raw frame per line, with `--frames`.
+
+Usage:
+    poetry run python -m benchmarks.bench_websocket_parsing
+    poetry run python -m benchmarks.bench_websocket_parsing --frames frames.jsonl
+"""
+
+import argparse
+import json
+import random
+import time
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+
+from src.trade_data_source.kraken_websocket_api import KrakenWebsocketAPI
+from src.trade_data_source.trade import Trade
+
+PRODUCT_IDS = ["BTC/USD", "ETH/USD", "SOL/USD"]
+
+
+def generate_frames(n_frames: int, max_trades_per_frame: int) -> List[str]:
+    random.seed(42)
+    now = datetime(2024, 6, 17, 9, 36, 39, tzinfo=timezone.utc)
+    trade_id = 70_000_000
+    frames = []
+    for _ in range(n_frames):
+        product_id = random.choice(PRODUCT_IDS)
+        data = []
+        for _ in range(random.randint(1, max_trades_per_frame)):
+            now += timedelta(microseconds=random.randint(0, 200_000))
+            trade_id += 1
+            data.append(
+                {
+                    "symbol": product_id,
+                    "side": random.choice(["buy", "sell"]),
+                    "price": round(random.uniform(60_000, 70_000), 1),
+                    "qty": round(random.uniform(0.00001, 2.0), 8),
+                    "ord_type": random.choice(["market", "limit"]),
+                    "trade_id": trade_id,
+                    "timestamp": now.strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+                }
+            )
+        frames.append(json.dumps({"channel": "trade", "type": "update", "data": data}))
+    return frames
+
+
+def parse_frame_before(message: str) -> List[Trade]:
+    message = json.loads(message)
+    trades = []
+    for trade in message["data"]:
+        timestamp = datetime.fromisoformat(trade["timestamp"][:-1]).replace(
+            tzinfo=timezone.utc
+        )
+        trades.append(
+            Trade(
+                product_id=trade["symbol"],
+                quantity=float(trade["qty"]),
+                price=float(trade["price"]),
+                timestamp_ms=int(timestamp.timestamp() * 1000),
+            )
+        )
+    return trades
+
+
+def load_frames(path: Optional[str], n_frames: int, max_trades: int) -> List[str]:
+    if path is None:
+        return generate_frames(n_frames, max_trades)
+    with open(path) as f:
+        frames = [line.strip() for line in f if line.strip()]
+    # we only benchmark the frames that hold trades
+    return [frame for frame in frames if '"channel":"trade"' in frame.replace(" ", "")]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--frames", type=str, default=None)
+    parser.add_argument("--n-frames", type=int, default=20_000)
+    parser.add_argument("--max-trades-per-frame", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    frames = load_frames(args.frames, args.n_frames, args.max_trades_per_frame)
+
+    for name, parse in [
+        ("before", parse_frame_before),
+        ("after", KrakenWebsocketAPI.parse_trades),
+    ]:
+        best_sec = float("inf")
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            n_trades = sum(len(parse(frame)) for frame in frames)
+            best_sec = min(best_sec, time.perf_counter() - start)
+        print(
+            f"{name:>6}: {n_trades} trades in {best_sec:.3f}s "
+            f"({n_trades / best_sec:,.0f} trades/sec)"
+        )
+
+
+if __name__ == "__main__":
+    main()
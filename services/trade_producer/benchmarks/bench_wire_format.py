@@ -0,0 +1,104 @@
+"""
+Compares the JSON and the binary wire formats of the trades topic: how many bytes
+each trade takes, and how fast we can encode and decode them.
+
+- encode (per trade): the Quix Streams "json" serializer vs `TradeSerializer`, for
+  every `trade.model_dump()`.
+- encode (batch): `serialize_trade_batch` with the "json" vs the "binary" format,
+  which is what `produce_batches` uses.
+- decode: the Quix Streams "json" deserializer vs `TradeDeserializer`, which is
+  what trade_to_ohlcv uses.
+
+Usage:
+    poetry run python -m benchmarks.bench_wire_format --n-trades 500000
+"""
+
+import argparse
+import random
+import time
+from typing import Callable, List
+
+from quixstreams.models.serializers import (
+    JSONDeserializer,
+    JSONSerializer,
+    MessageField,
+    SerializationContext,
+)
+
+from src.trade_codec import TradeDeserializer, TradeSerializer
+from src.trade_data_source.trade import Trade, TradeBatch
+from src.trade_serializer import serialize_trade_batch
+
+PRODUCT_IDS = ["BTC/USD", "ETH/USD", "SOL/USD"]
+# 2024-10-01 00:00:00 UTC
+FROM_MS = 1727740800000
+
+
+def generate_trades(n_trades: int) -> List[Trade]:
+    random.seed(42)
+    return [
+        Trade(
+            product_id=random.choice(PRODUCT_IDS),
+            quantity=round(random.uniform(0.0001, 2.0), 8),
+            price=round(random.uniform(60_000, 70_000), 1),
+            timestamp_ms=FROM_MS + i * 10,
+        )
+        for i in range(n_trades)
+    ]
+
+
+def best_time(run: Callable[[], object], repeat: int) -> float:
+    best_sec = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        best_sec = min(best_sec, time.perf_counter() - start)
+    return best_sec
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n-trades", type=int, default=200_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    trades = generate_trades(args.n_trades)
+    dicts = [trade.model_dump() for trade in trades]
+    batch = TradeBatch.from_trades(trades)
+    ctx = SerializationContext(topic="trades", field=MessageField.VALUE)
+
+    serializers = {"json": JSONSerializer(), "binary": TradeSerializer()}
+    deserializers = {"json": JSONDeserializer(), "binary": TradeDeserializer()}
+
+    for wire_format in ["json", "binary"]:
+        serialize = serializers[wire_format]
+        deserialize = deserializers[wire_format]
+        _, values = serialize_trade_batch(batch, wire_format)
+
+        encode_sec = best_time(
+            lambda serialize=serialize: [serialize(value, ctx=ctx) for value in dicts],
+            args.repeat,
+        )
+        batch_sec = best_time(
+            lambda wire_format=wire_format: serialize_trade_batch(batch, wire_format),
+            args.repeat,
+        )
+        decode_sec = best_time(
+            lambda deserialize=deserialize, values=values: [
+                deserialize(value, ctx=ctx) for value in values
+            ],
+            args.repeat,
+        )
+
+        n = len(values)
+        print(
+            f"{wire_format:>6}: "
+            f"{sum(len(value) for value in values) / n:.1f} bytes/trade, "
+            f"encode {encode_sec / n * 1e9:,.0f} ns/trade, "
+            f"batch encode {batch_sec / n * 1e9:,.0f} ns/trade, "
+            f"decode {decode_sec / n * 1e9:,.0f} ns/trade"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+import json
+import os
+from collections import deque
+from pathlib import Path
+from typing import Deque, Optional
+
+from confluent_kafka import KafkaError, Message
+from loguru import logger
+
+
+class CheckpointStore:
+    """
+    Stores on local disk where each product of a backfill is, so a new run can
+    resume from there instead of starting again from the beginning.
+
+    The checkpoint is whatever `TradeSource.checkpoint` returns, e.g.
+
+        {"BTC/USD": {"from_ms": 1727740800000, "next_ms": 1727827200000}}
+
+    and it is merged into the stored one, product by product.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = Path(path)
+
+    def load(self) -> dict:
+        if not self.path.exists():
+            return {}
+        with open(self.path) as f:
+            return json.load(f)
+
+    def save(self, checkpoint: dict) -> None:
+        merged = {**self.load(), **checkpoint}
+
+        # write to a temporary file first, so a crash never leaves a broken file
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(merged, f)
+        os.replace(tmp_path, self.path)
+
+
+class PendingCheckpoint:
+    """
+    The checkpoint reached after a batch of trades, and how many messages of that
+    batch Kafka did not confirm yet.
+    """
+
+    def __init__(self, checkpoint: dict, n_messages: int) -> None:
+        self.checkpoint = checkpoint
+        self.n_in_flight = n_messages
+        self.failed = False
+
+    def on_delivery(self, error: Optional[KafkaError], message: Message) -> None:
+        self.n_in_flight -= 1
+        if error is not None:
+            self.failed = True
+
+
+class CheckpointTracker:
+    """
+    Saves the checkpoint of a batch of trades only once Kafka has confirmed every
+    message of that batch and of all the batches before it. A crash can then repeat
+    the trades produced after the last checkpoint, but it never skips any.
+
+    If a message is not delivered, we stop saving checkpoints, so the next run starts
+    again from the last batch that was fully delivered.
+    """
+
+    def __init__(self, store: CheckpointStore) -> None:
+        self.store = store
+        self._pending: Deque[PendingCheckpoint] = deque()
+        self._failed = False
+
+    def add(self, checkpoint: dict, n_messages: int) -> PendingCheckpoint:
+        """
+        Adds the checkpoint of the next batch, which has `n_messages` messages. They
+        must report their delivery to the returned object.
+        """
+        pending = PendingCheckpoint(checkpoint, n_messages)
+        self._pending.append(pending)
+        return pending
+
+    def commit(self) -> None:
+        """
+        Saves the latest checkpoint whose batch, and every batch before it, were
+        delivered. The delivery callbacks are served by `producer.poll`, so call
+        this after polling.
+        """
+        checkpoint = None
+        while (
+            not self._failed
+            and self._pending
+            and self._pending[0].n_in_flight == 0
+        ):
+            pending = self._pending.popleft()
+            if pending.failed:
+                logger.error(
+                    "Some trades were not delivered to Kafka, so we stop saving "
+                    "checkpoints. The next run resumes from the last one."
+                )
+                self._failed = True
+                self._pending.clear()
+                break
+            checkpoint = pending.checkpoint
+
+        if checkpoint is not None:
+            self.store.save(checkpoint)
@@ -7,9 +7,67 @@ class Config(BaseSettings):
     kafka_broker_address: str | None = None
     kafka_topic: str
     product_ids: list[str]
+    # the topic gets one partition per product when it is created. Whether to add
+    # the missing ones to an existing topic with fewer, which can't be undone
+    kafka_topic_add_partitions: bool = False
+    # format of the messages in the trades topic, "json", "binary" or "batch".
+    # "batch" sends one message per product and batch of trades, for backfills
+    trade_wire_format: str = "json"
+
+    # librdkafka settings of the producer. Unset values use DEFAULT_PRODUCER_CONFIG
+    kafka_producer_linger_ms: int | None = None
+    kafka_producer_batch_size: int | None = None
+    kafka_producer_compression_type: str | None = None
+    # how many batches of trades can wait between the reader and the producer
+    pipeline_max_queue_size: int = 1000
 
     live_or_historical: str | None = None
     last_n_days: int | None = None
 
+    # Kraken websocket API settings for the live trades
+    websocket_num_connections: int = 1
+    websocket_max_queue_size: int = 10_000
+
+    # Kraken websocket `book` channel settings, for the order book records
+    book_depth: int = 10
+    # how often we produce a record of each book, or after every update if None
+    book_record_interval_ms: int | None = 1000
+    book_imbalance_levels: int = 10
+    # levels of each side included in the records, besides the top of the book
+    book_snapshot_levels: int = 0
+
+    # Kraken REST API settings for the historical backfill
+    rest_api_max_workers: int | None = None
+    rest_api_requests_per_sec: float = 1.0
+    # the rate the backfill speeds up to while Kraken does not throttle it, 2 req/s
+    # if None
+    rest_api_max_requests_per_sec: float | None = None
+    rest_api_burst: int = 1
+    rest_api_num_shards: int = 1
+
+    # Where the historical backfill saves its progress, to resume after a crash
+    checkpoint_path: str | None = None
+
+    # Trade history CSV files downloaded from Kraken, a directory or a ZIP archive
+    csv_dump_path: str | None = None
+    csv_dump_from_ms: int | None = None
+    csv_dump_to_ms: int | None = None
+
+    # Replay of trades from local parquet or Arrow files, e.g. the cache_dir
+    replay_path: str | None = None
+    replay_from_ms: int | None = None
+    replay_to_ms: int | None = None
+    # how many times faster than real time, or as fast as possible if None
+    replay_speed: float | None = None
+
+    # Port of the Prometheus metrics endpoint (http://host:port/metrics). The
+    # metrics are not collected at all if it is not set
+    metrics_port: int | None = None
+
+    # Local cache of historical trades, to speed up re-runs of the backfill
+    cache_dir: str | None = None
+    cache_max_size_gb: float | None = None
+    cache_max_age_days: float | None = None
+
 
 config = Config()
@@ -1,8 +1,117 @@
+from queue import Queue
+from typing import Dict, List, Optional
+
+from confluent_kafka import Consumer, TopicPartition
+from confluent_kafka.admin import AdminClient, NewPartitions
 from loguru import logger
 from quixstreams import Application
 from quixstreams.models import TopicConfig
 
-from src.trade_data_source import Trade, TradeSource
+from src.checkpoints import CheckpointStore, CheckpointTracker
+from src.metrics import REGISTRY
+from src.trade_codec import TradeSerializer
+from src.trade_data_source import KrakenBookWebsocketAPI, TradeSource
+from src.trade_pipeline import (
+    DEFAULT_PRODUCER_CONFIG,
+    DeliveryReport,
+    TradeReader,
+    produce_batches,
+    product_partitions,
+)
+
+
+def ensure_num_partitions(
+    kafka_broker_address: str,
+    topic_name: str,
+    num_partitions: int,
+    add_partitions: bool = False,
+) -> int:
+    """
+    Checks that an existing topic has at least `num_partitions`, and adds the
+    missing ones if `add_partitions`, e.g. after adding products to the config,
+    since the topic config only applies when the topic is created.
+
+    Adding partitions changes the topic for all its producers and consumers, and
+    Kafka can't remove them, so it is never done by default: the products then
+    share the partitions the topic has.
+
+    Args:
+        kafka_broker_address: The address of the Kafka broker.
+        topic_name: The name of the topic, which must exist.
+        num_partitions: The number of partitions we want.
+        add_partitions: Whether to add the missing partitions to the topic.
+
+    Returns:
+        int: The number of partitions of the topic.
+    """
+    admin = AdminClient({"bootstrap.servers": kafka_broker_address})
+    topic = admin.list_topics(topic_name, timeout=10).topics[topic_name]
+    if len(topic.partitions) >= num_partitions:
+        return len(topic.partitions)
+
+    if not add_partitions:
+        logger.warning(
+            f"{topic_name} has {len(topic.partitions)} partitions for "
+            f"{num_partitions} products, so some products share a partition. Set "
+            "KAFKA_TOPIC_ADD_PARTITIONS=true to add the missing partitions (for "
+            "good, Kafka can't remove them)"
+        )
+        return len(topic.partitions)
+
+    # the products that shared a partition can move to the ones we add, so their
+    # windows in progress in the consumers are split between two partitions once
+    logger.warning(
+        f"Increasing the partitions of {topic_name} from {len(topic.partitions)} "
+        f"to {num_partitions}, for good: Kafka can't remove them. The products "
+        "that shared a partition may move to the new ones, and see their windows "
+        "in progress split in two in the consumers"
+    )
+    admin.create_partitions([NewPartitions(topic_name, num_partitions)])[
+        topic_name
+    ].result()
+    return num_partitions
+
+
+def current_product_partitions(
+    kafka_broker_address: str, topic_name: str, num_partitions: int
+) -> Dict[str, int]:
+    """
+    Returns the partition of the products already in the topic, from the key of
+    the last message of each partition, so a new run keeps them there even if the
+    products of the config were reordered or new ones were inserted.
+
+    Args:
+        kafka_broker_address: The address of the Kafka broker.
+        topic_name: The name of the topic.
+        num_partitions: The number of partitions of the topic.
+
+    Returns:
+        Dict[str, int]: The partition of each message key, e.g. {"BTC-USD": 0},
+            for the partitions that have messages.
+    """
+    consumer = Consumer(
+        {
+            "bootstrap.servers": kafka_broker_address,
+            "group.id": f"{topic_name}-partitions",
+            "enable.auto.commit": False,
+        }
+    )
+    partitions = {}
+    try:
+        for partition in range(num_partitions):
+            low, high = consumer.get_watermark_offsets(
+                TopicPartition(topic_name, partition), timeout=10
+            )
+            if high <= low:
+                continue
+            consumer.assign([TopicPartition(topic_name, partition, high - 1)])
+            message = consumer.poll(timeout=10)
+            if message is None or message.error() or message.key() is None:
+                continue
+            partitions[message.key().decode()] = partition
+    finally:
+        consumer.close()
+    return partitions
 
 
 def produce_trades(
@@ -10,68 +119,237 @@ def produce_trades(
     kafka_topic: str,
     trade_data_source: TradeSource,
     num_partitions: int,
+    max_queue_size: int = 1000,
+    producer_extra_config: Optional[dict] = None,
+    wire_format: str = "json",
+    checkpoint_store: Optional[CheckpointStore] = None,
+    product_ids: Optional[List[str]] = None,
+    add_partitions: bool = False,
 ):
     """
     Reads trades from the Kraken websocket API and saves them in the given Kafka topic.
 
+    The trades are read by a TradeReader thread, and produced to Kafka by this
+    thread. The two are joined by a bounded queue, so a slow broker does not stall
+    the reads from the source until the queue is full.
+
     Args:
         kafka_broker_address: The address of the Kafka broker.
         kafka_topic: The name of the Kafka topic to save the trades.
         trade_data_source: The data source to get the trades from.
         num_partitions: The number of partitions for the Kafka topic.
+        max_queue_size: The maximum number of batches of trades waiting to be
+            produced.
+        producer_extra_config: librdkafka settings for the producer. Defaults to
+            DEFAULT_PRODUCER_CONFIG.
+        wire_format: The format of the messages: "json", the compact "binary"
+            format of `src.trade_codec`, or "batch", which packs the trades of each
+            product in a batch into a single message. The consumers must be able to
+            read it.
+        checkpoint_store: Where we save the checkpoint of the source once Kafka has
+            delivered the trades before it, so a new run can resume from there.
+        product_ids: The products of the source. If given, each product gets its
+            own partition (see `product_partitions`), so the consumers can process
+            the products in parallel, one partition each. The products already in
+            the topic keep their partition.
+        add_partitions: Whether to add partitions to an existing topic that has
+            fewer than `num_partitions` (see `ensure_num_partitions`).
 
     Returns:
         None
     """
     # Create an Application instance with Kafka config
-    app = Application(broker_address=kafka_broker_address)
+    app = Application(
+        broker_address=kafka_broker_address,
+        producer_extra_config=producer_extra_config or DEFAULT_PRODUCER_CONFIG,
+    )
     topic = app.topic(
         name=kafka_topic,
-        value_serializer="json",
+        value_serializer=TradeSerializer() if wire_format != "json" else "json",
         config=TopicConfig(
             num_partitions=num_partitions,
             replication_factor=1,
         ),
     )
 
+    batches: Queue = Queue(maxsize=max_queue_size)
+    reader = TradeReader(trade_data_source, batches)
+    report = DeliveryReport()
+    checkpoints = CheckpointTracker(checkpoint_store) if checkpoint_store else None
+
     # Create a Producer instance
     with app.get_producer() as producer:
+        partitions = None
+        if product_ids:
+            # the producer created the topic if needed
+            topic_num_partitions = ensure_num_partitions(
+                kafka_broker_address, topic.name, num_partitions, add_partitions
+            )
+            current = current_product_partitions(
+                kafka_broker_address, topic.name, topic_num_partitions
+            )
+            partitions = product_partitions(product_ids, topic_num_partitions, current)
+            logger.info(f"Partitions of the products: {partitions}")
+
+        reader.start()
+        try:
+            produce_batches(
+                producer,
+                topic.name,
+                batches,
+                report,
+                wire_format,
+                checkpoints,
+                partitions,
+            )
+        finally:
+            reader.stop()
+            # the producer flushes the messages still in flight on exit
+
+    if checkpoints is not None:
+        # the last batches were only delivered by the final flush
+        checkpoints.commit()
+
+    reader.join()
+    if reader.error is not None:
+        raise reader.error
+
+    if report.n_failed > 0:
+        logger.error(
+            f"{report.n_failed} messages could not be delivered to Kafka. "
+            f"Last error: {report.last_error}"
+        )
+    logger.info(f"Finished producing trades. {report}")
+
+
+def produce_book_records(
+    kafka_broker_address: str,
+    kafka_topic: str,
+    book_api: KrakenBookWebsocketAPI,
+    num_partitions: int,
+    producer_extra_config: Optional[dict] = None,
+):
+    """
+    Reads the order book records (top of the book and imbalance) of the Kraken
+    websocket `book` channel and saves them in the given Kafka topic, keyed by
+    product.
 
-        while not trade_data_source.is_done():
-            trades: list[Trade] = trade_data_source.get_trades()
+    The records are a sample of the books (at most one per product every
+    `book_api.record_interval_ms`), so their rate is low enough to produce them
+    one by one from this thread.
+
+    Args:
+        kafka_broker_address: The address of the Kafka broker.
+        kafka_topic: The name of the Kafka topic to save the records.
+        book_api: The source of the records.
+        num_partitions: The number of partitions for the Kafka topic.
+        producer_extra_config: librdkafka settings for the producer. Defaults to
+            DEFAULT_PRODUCER_CONFIG.
 
-            for trade in trades:
-                # Serialize the event using the defined Topic
-                message = topic.serialize(
-                    key=trade.product_id.replace("/", "-"), value=trade.model_dump()
-                )
-                # Produce the message into the Kafka topic
-                producer.produce(topic=topic.name, value=message.value, key=message.key)
+    Returns:
+        None
+    """
+    app = Application(
+        broker_address=kafka_broker_address,
+        producer_extra_config=producer_extra_config or DEFAULT_PRODUCER_CONFIG,
+    )
+    topic = app.topic(
+        name=kafka_topic,
+        value_serializer="json",
+        config=TopicConfig(
+            num_partitions=num_partitions,
+            replication_factor=1,
+        ),
+    )
+    report = DeliveryReport()
 
-                logger.debug(f"Pushed trade to Kafka: {trade}")
+    with app.get_producer() as producer:
+        try:
+            while not book_api.is_done():
+                for record in book_api.get_records():
+                    message = topic.serialize(
+                        key=record["product_id"].replace("/", "-"), value=record
+                    )
+                    producer.produce(
+                        topic=topic.name,
+                        value=message.value,
+                        key=message.key,
+                        on_delivery=report.on_delivery,
+                    )
+                    report.n_produced += 1
+                producer.poll(0)
+        finally:
+            book_api.close()
 
-    logger.info("Finished producing trades")
+    logger.info(f"Finished producing order book records. {report}")
 
 
 if __name__ == "__main__":
     from src.config import config
 
+    if config.metrics_port is not None:
+        # before creating the sources, which get their metrics when they are created
+        REGISTRY.enable()
+        REGISTRY.start_http_server(config.metrics_port)
+
+    # librdkafka settings, with the ones set in the config taking precedence
+    producer_extra_config = {
+        **DEFAULT_PRODUCER_CONFIG,
+        **{
+            key: value
+            for key, value in {
+                "linger.ms": config.kafka_producer_linger_ms,
+                "batch.size": config.kafka_producer_batch_size,
+                "compression.type": config.kafka_producer_compression_type,
+            }.items()
+            if value is not None
+        },
+    }
+
     if config.live_or_historical == "live":
         from src.trade_data_source import KrakenWebsocketAPI
 
-        kraken_api = KrakenWebsocketAPI(product_ids=config.product_ids)
+        kraken_api = KrakenWebsocketAPI(
+            product_ids=config.product_ids,
+            num_connections=config.websocket_num_connections,
+            max_queue_size=config.websocket_max_queue_size,
+        )
         produce_trades(
             kafka_broker_address=config.kafka_broker_address,
             kafka_topic=config.kafka_topic,
             trade_data_source=kraken_api,
-            num_partitions=1,  # TODO: This might need to increase for multiple currencies
+            # one partition per product, so trade_to_ohlcv can use one worker
+            # process per product
+            num_partitions=len(config.product_ids),
+            max_queue_size=config.pipeline_max_queue_size,
+            producer_extra_config=producer_extra_config,
+            wire_format=config.trade_wire_format,
+            product_ids=config.product_ids,
+            add_partitions=config.kafka_topic_add_partitions,
         )
     elif config.live_or_historical == "historical":
         from src.trade_data_source import KrakenRestAPI
 
         logger.debug(f"Fetching trades for the last {config.last_n_days} days")
+        checkpoint_store = (
+            CheckpointStore(config.checkpoint_path) if config.checkpoint_path else None
+        )
         kraken_api = KrakenRestAPI(
-            product_ids=config.product_ids, last_n_days=config.last_n_days
+            product_ids=config.product_ids,
+            last_n_days=config.last_n_days,
+            cache_dir=config.cache_dir,
+            cache_max_size_bytes=(
+                int(config.cache_max_size_gb * 1024**3)
+                if config.cache_max_size_gb is not None
+                else None
+            ),
+            cache_max_age_days=config.cache_max_age_days,
+            max_workers=config.rest_api_max_workers,
+            requests_per_sec=config.rest_api_requests_per_sec,
+            max_requests_per_sec=config.rest_api_max_requests_per_sec,
+            burst=config.rest_api_burst,
+            num_shards=config.rest_api_num_shards,
+            checkpoint=checkpoint_store.load() if checkpoint_store else None,
         )
         num_partitions = len(config.product_ids)
         logger.debug(f"Number of partitions: {num_partitions}")
@@ -80,6 +358,73 @@ if __name__ == "__main__":
             kafka_topic=config.kafka_topic,
             trade_data_source=kraken_api,
             num_partitions=num_partitions,
+            max_queue_size=config.pipeline_max_queue_size,
+            producer_extra_config=producer_extra_config,
+            wire_format=config.trade_wire_format,
+            checkpoint_store=checkpoint_store,
+            product_ids=config.product_ids,
+            add_partitions=config.kafka_topic_add_partitions,
+        )
+    elif config.live_or_historical == "csv_dump":
+        from src.trade_data_source import KrakenCSVDump
+        from src.trade_data_source.trade_cache import TradeCache
+
+        logger.debug(f"Reading the Kraken trade history from {config.csv_dump_path}")
+        dump = KrakenCSVDump(
+            path=config.csv_dump_path,
+            product_ids=config.product_ids,
+            from_ms=config.csv_dump_from_ms,
+            to_ms=config.csv_dump_to_ms,
+            # fill the cache on the way, for the REST API backfills
+            cache=TradeCache(config.cache_dir) if config.cache_dir else None,
+        )
+        produce_trades(
+            kafka_broker_address=config.kafka_broker_address,
+            kafka_topic=config.kafka_topic,
+            trade_data_source=dump,
+            num_partitions=len(config.product_ids),
+            max_queue_size=config.pipeline_max_queue_size,
+            producer_extra_config=producer_extra_config,
+            wire_format=config.trade_wire_format,
+            product_ids=config.product_ids,
+            add_partitions=config.kafka_topic_add_partitions,
+        )
+    elif config.live_or_historical == "replay":
+        from src.trade_data_source import ReplayTradeSource
+
+        logger.debug(f"Replaying trades from {config.replay_path}")
+        replay = ReplayTradeSource(
+            path=config.replay_path,
+            product_ids=config.product_ids,
+            from_ms=config.replay_from_ms,
+            to_ms=config.replay_to_ms,
+            speed=config.replay_speed,
+        )
+        produce_trades(
+            kafka_broker_address=config.kafka_broker_address,
+            kafka_topic=config.kafka_topic,
+            trade_data_source=replay,
+            num_partitions=len(config.product_ids),
+            max_queue_size=config.pipeline_max_queue_size,
+            producer_extra_config=producer_extra_config,
+            wire_format=config.trade_wire_format,
+            product_ids=config.product_ids,
+            add_partitions=config.kafka_topic_add_partitions,
+        )
+    elif config.live_or_historical == "book":
+        book_api = KrakenBookWebsocketAPI(
+            product_ids=config.product_ids,
+            depth=config.book_depth,
+            record_interval_ms=config.book_record_interval_ms,
+            imbalance_levels=config.book_imbalance_levels,
+            snapshot_levels=config.book_snapshot_levels,
+        )
+        produce_book_records(
+            kafka_broker_address=config.kafka_broker_address,
+            kafka_topic=config.kafka_topic,
+            book_api=book_api,
+            num_partitions=len(config.product_ids),
+            producer_extra_config=producer_extra_config,
         )
     else:
         raise ValueError("Invalid value for live_or_historical")
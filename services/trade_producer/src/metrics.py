@@ -0,0 +1,304 @@
+"""
+A small in-process metrics registry, with an HTTP endpoint in the Prometheus text
+format.
+
+The registry is disabled by default. Until `REGISTRY.enable()` is called, it hands
+out a shared no-op metric, so instrumented code costs a method call that does
+nothing. Components get their metrics when they are created, so the registry must
+be enabled before that, e.g. at the start of `main`.
+
+    trades = REGISTRY.counter(
+        "trades_total", "The trades we received", ["product_id"]
+    )
+    trades.labels("BTC/USD").inc(10)
+"""
+
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+from loguru import logger
+
+# Upper bounds of the histogram buckets, in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# (name suffix, extra labels, value) of one line of the Prometheus text format
+Sample = Tuple[str, Dict[str, str], float]
+
+
+class _CounterChild:
+    def __init__(self) -> None:
+        self._value = 0.0
+        self._function: Optional[Callable[[], float]] = None
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self._value += amount
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        """
+        Reads the value from `function` on every scrape, e.g. from a counter the
+        component already keeps.
+        """
+        self._function = function
+
+    def samples(self) -> List[Sample]:
+        value = self._function() if self._function is not None else self._value
+        return [("", {}, value)]
+
+
+class _GaugeChild(_CounterChild):
+    def set(self, value: float) -> None:
+        with self._lock:
+            self._value = value
+
+    def dec(self, amount: float = 1.0) -> None:
+        self.inc(-amount)
+
+
+class _HistogramChild:
+    def __init__(self, buckets: Sequence[float]) -> None:
+        self._buckets = buckets
+        self._counts = [0] * len(buckets)
+        self._count = 0
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        with self._lock:
+            self._count += 1
+            self._sum += value
+            for i, upper_bound in enumerate(self._buckets):
+                if value <= upper_bound:
+                    self._counts[i] += 1
+                    break
+
+    def samples(self) -> List[Sample]:
+        with self._lock:
+            counts, count, total = list(self._counts), self._count, self._sum
+
+        samples: List[Sample] = []
+        cumulative = 0
+        for upper_bound, n in zip(self._buckets, counts):
+            cumulative += n
+            samples.append(("_bucket", {"le": _format_value(upper_bound)}, cumulative))
+        samples.append(("_bucket", {"le": "+Inf"}, count))
+        samples.append(("_sum", {}, total))
+        samples.append(("_count", {}, count))
+        return samples
+
+
+Child = Union[_CounterChild, _GaugeChild, _HistogramChild]
+
+
+class Metric:
+    """
+    A metric with a fixed set of label names, and one child per set of label
+    values. A metric without labels can be used as its own child.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        kind: str,
+        labelnames: Sequence[str],
+        new_child: Callable[[], Child],
+    ) -> None:
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.labelnames = tuple(labelnames)
+        self._new_child = new_child
+        self._children: Dict[Tuple[str, ...], Child] = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values: object) -> Child:
+        """
+        Returns the child of the given label values, in the order of `labelnames`.
+        """
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects the labels {self.labelnames}")
+
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.labels().inc(amount)
+
+    def set(self, value: float) -> None:
+        self.labels().set(value)
+
+    def observe(self, value: float) -> None:
+        self.labels().observe(value)
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        self.labels().set_function(function)
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {_escape_help(self.help)}"
+        yield f"# TYPE {self.name} {self.kind}"
+        with self._lock:
+            children = list(self._children.items())
+        for values, child in children:
+            labels = dict(zip(self.labelnames, values))
+            for suffix, extra_labels, value in child.samples():
+                yield (
+                    f"{self.name}{suffix}{_format_labels({**labels, **extra_labels})} "
+                    f"{_format_value(value)}"
+                )
+
+
+class _NoopMetric:
+    """
+    What the registry hands out while it is disabled.
+    """
+
+    def labels(self, *values: object) -> "_NoopMetric":
+        return self
+
+    def inc(self, amount: float = 1.0) -> None:
+        pass
+
+    def dec(self, amount: float = 1.0) -> None:
+        pass
+
+    def set(self, value: float) -> None:
+        pass
+
+    def observe(self, value: float) -> None:
+        pass
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        pass
+
+
+_NOOP = _NoopMetric()
+
+
+class MetricsRegistry:
+    def __init__(self) -> None:
+        self.enabled = False
+        self._metrics: Dict[str, Metric] = {}
+        self._lock = threading.Lock()
+
+    def enable(self) -> None:
+        self.enabled = True
+
+    def counter(
+        self, name: str, help: str, labelnames: Sequence[str] = ()
+    ) -> Union[Metric, _NoopMetric]:
+        return self._get(name, help, "counter", labelnames, _CounterChild)
+
+    def gauge(
+        self, name: str, help: str, labelnames: Sequence[str] = ()
+    ) -> Union[Metric, _NoopMetric]:
+        return self._get(name, help, "gauge", labelnames, _GaugeChild)
+
+    def histogram(
+        self,
+        name: str,
+        help: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> Union[Metric, _NoopMetric]:
+        return self._get(
+            name, help, "histogram", labelnames, lambda: _HistogramChild(buckets)
+        )
+
+    def _get(
+        self,
+        name: str,
+        help: str,
+        kind: str,
+        labelnames: Sequence[str],
+        new_child: Callable[[], Child],
+    ) -> Union[Metric, _NoopMetric]:
+        """
+        Returns the metric with the given name, creating it the first time. Several
+        instances of a component (e.g. one per product) share the same metric.
+        """
+        if not self.enabled:
+            return _NOOP
+
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = Metric(name, help, kind, labelnames, new_child)
+                self._metrics[name] = metric
+            elif metric.kind != kind or metric.labelnames != tuple(labelnames):
+                raise ValueError(f"Metric {name} already exists with another type")
+            return metric
+
+    def render(self) -> str:
+        """
+        Returns all the metrics in the Prometheus text format.
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = [line for metric in metrics for line in metric.render()]
+        return "\n".join(lines) + "\n"
+
+    def start_http_server(
+        self, port: int, host: str = "0.0.0.0"
+    ) -> ThreadingHTTPServer:
+        """
+        Serves the metrics on http://host:port/metrics from a background thread.
+        """
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *args: object) -> None:
+                # don't log every scrape
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        thread = threading.Thread(
+            target=server.serve_forever, name="metrics_http_server", daemon=True
+        )
+        thread.start()
+        logger.info(f"Serving the metrics on http://{host}:{port}/metrics")
+        return server
+
+
+# The registry used by all the components of the service
+REGISTRY = MetricsRegistry()
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    pairs = ",".join(
+        f'{name}="{_escape_label_value(value)}"' for name, value in labels.items()
+    )
+    return "{" + pairs + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+def _escape_help(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("\n", "\\n")
+
+
+def _escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
@@ -1,4 +1,7 @@
 from src.trade_data_source.base import TradeSource
+from src.trade_data_source.kraken_book_websocket_api import KrakenBookWebsocketAPI
+from src.trade_data_source.kraken_csv_dump import KrakenCSVDump
 from src.trade_data_source.kraken_rest_api import KrakenRestAPI
 from src.trade_data_source.kraken_websocket_api import KrakenWebsocketAPI
-from src.trade_data_source.trade import Trade
+from src.trade_data_source.replay import ReplayTradeSource
+from src.trade_data_source.trade import Trade, TradeBatch
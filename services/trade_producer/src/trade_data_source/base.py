@@ -1,6 +1,7 @@
 from abc import ABC, abstractmethod
+from typing import Optional
 
-from src.trade_data_source.trade import Trade
+from src.trade_data_source.trade import Trade, TradeBatch
 
 
 class TradeSource(ABC):
@@ -9,12 +10,16 @@ class TradeSource(ABC):
     """
 
     @abstractmethod
-    def get_trades(self) -> list[Trade]:
+    def get_trades(self) -> list[Trade] | TradeBatch:
         """
         Retrieve the trades from the data source.
 
+        Sources that handle many trades at once (e.g. historical backfills) should
+        return a TradeBatch, which the producer serializes without creating a Python
+        object per trade.
+
         Returns:
-            A list of Trade objects.
+            A list of Trade objects, or a TradeBatch.
         """
         pass
 
@@ -24,3 +29,20 @@ class TradeSource(ABC):
         Returns True if tehre are no more trades to retrieve, False otherwise.
         """
         pass
+
+    def checkpoint(self) -> Optional[dict]:
+        """
+        Returns where the source is, right after the trades it returned so far, as
+        a JSON-serializable dict, so a new source can resume from there.
+
+        Returns:
+            The checkpoint, or None if the source can't resume.
+        """
+        return None
+
+    def close(self) -> None:
+        """
+        Releases the resources of the source (e.g. the threads that fetch ahead),
+        once we stop reading from it, whether it is done or not.
+        """
+        pass
@@ -0,0 +1,384 @@
+import asyncio
+import json
+import random
+import threading
+import time
+from dataclasses import dataclass
+from queue import Empty, Full, Queue
+from typing import Optional
+
+from loguru import logger
+from websockets.asyncio.client import ClientConnection, connect
+from websockets.exceptions import WebSocketException
+
+from src.metrics import REGISTRY
+from src.trade_data_source.kraken_websocket_api import (
+    KrakenWebsocketAPIError,
+    _json_loads,
+    to_ms,
+)
+from src.trade_data_source.order_book import OrderBook
+
+# The depths the Kraken `book` channel accepts
+BOOK_DEPTHS = (10, 25, 100, 500, 1000)
+
+
+@dataclass
+class BookMetrics:
+    """
+    Counters of the book connection, for monitoring.
+    """
+
+    product_ids: list[str]
+    n_connects: int = 0
+    n_messages: int = 0
+    n_updates: int = 0
+    n_records: int = 0
+    # how many times a checksum did not match, and we asked for a new snapshot
+    n_checksum_errors: int = 0
+    # how many records we dropped because the queue was full, and newer records of
+    # their products were waiting
+    n_dropped: int = 0
+
+
+class KrakenBookWebsocketAPI:
+    """
+    Keeps the level 2 order books of some products up to date from the Kraken
+    websocket `book` channel, and hands out records of the top of the book and the
+    imbalance of each product, e.g. once per second.
+
+    Every update is applied to an array-backed OrderBook as soon as it arrives, and
+    checked against the checksum Kraken sends with it. On a mismatch, we
+    resubscribe to that product to get a fresh snapshot. The records only sample
+    the books: at most one per product every `record_interval_ms`, which keeps
+    their rate independent from the (very bursty) rate of the updates.
+
+    The websocket is read by an asyncio event loop in a background thread, like
+    KrakenWebsocketConnection. The precision of the prices and quantities of each
+    product, needed for the checksums, comes from the `instrument` channel.
+    """
+
+    URL = "wss://ws.kraken.com/v2"
+
+    def __init__(
+        self,
+        product_ids: list[str],
+        url: str = URL,
+        depth: int = 10,
+        record_interval_ms: Optional[int] = 1000,
+        imbalance_levels: int = 10,
+        snapshot_levels: int = 0,
+        verify_checksum: bool = True,
+        max_queue_size: int = 10_000,
+        reconnect_backoff_base_sec: float = 1.0,
+        reconnect_backoff_max_sec: float = 30.0,
+        heartbeat_timeout_sec: float = 10.0,
+        get_timeout_sec: float = 1.0,
+    ):
+        """
+        Initializes the KrakenBookWebsocketAPI instance with the given product IDs,
+        and starts reading the books in the background.
+
+        Args:
+            product_ids: The product IDs whose books we keep.
+            url: The URL of the Kraken websocket API.
+            depth: The number of levels of each side of the books, one of
+                BOOK_DEPTHS.
+            record_interval_ms: How often we hand out a record of each product whose
+                book changed. If None, we hand out one after every update.
+            imbalance_levels: The number of levels of each side used to compute the
+                imbalance.
+            snapshot_levels: The number of levels of each side included in the
+                records. 0 for only the top of the book.
+            verify_checksum: Whether to check every update against its checksum.
+            max_queue_size: The maximum number of batches of records waiting for
+                `get_records`. When it is full, new records are dropped, since the
+                next ones supersede them.
+            reconnect_backoff_base_sec: The backoff after the first failed
+                connection. It doubles after every failed attempt.
+            reconnect_backoff_max_sec: The maximum backoff between two connections.
+            heartbeat_timeout_sec: We reconnect if we receive nothing (not even a
+                heartbeat) for this long.
+            get_timeout_sec: How long `get_records` waits for new records before
+                returning an empty list.
+        """
+        if depth not in BOOK_DEPTHS:
+            raise ValueError(f"depth must be one of {BOOK_DEPTHS}")
+
+        self.product_ids = product_ids
+        self.url = url
+        self.depth = depth
+        self.record_interval_ms = record_interval_ms
+        self.imbalance_levels = imbalance_levels
+        self.snapshot_levels = snapshot_levels
+        self.verify_checksum = verify_checksum
+        self.reconnect_backoff_base_sec = reconnect_backoff_base_sec
+        self.reconnect_backoff_max_sec = reconnect_backoff_max_sec
+        self.heartbeat_timeout_sec = heartbeat_timeout_sec
+        self.get_timeout_sec = get_timeout_sec
+
+        self.books = {
+            product_id: OrderBook(product_id, depth) for product_id in product_ids
+        }
+        self.metrics = BookMetrics(product_ids=product_ids)
+        for name, help in [
+            ("updates", "Book snapshots and updates applied"),
+            ("checksum_errors", "Book checksum mismatches"),
+            ("dropped", "Stale book records dropped because the queue was full"),
+        ]:
+            REGISTRY.counter(f"kraken_book_{name}_total", help).set_function(
+                lambda name=name: getattr(self.metrics, f"n_{name}")
+            )
+        # The error that stopped the reader, if any
+        self.error: Optional[BaseException] = None
+
+        self._records: Queue = Queue(maxsize=max_queue_size)
+        self._closed = False
+        # The products whose book changed since their last record. Only touched by
+        # the event loop thread.
+        self._changed: set[str] = set()
+
+        self._loop = asyncio.new_event_loop()
+        self._task = self._loop.create_task(self._run())
+        self._thread = threading.Thread(
+            target=self._run_loop, name="kraken_book_websocket_api", daemon=True
+        )
+        self._thread.start()
+
+    def get_records(self) -> list[dict]:
+        """
+        Returns the latest batch of records, waiting up to `get_timeout_sec` for
+        new ones.
+
+        Returns:
+            A list of records, as returned by `OrderBook.to_record`. Empty if no
+            record arrived in the meantime.
+        """
+        try:
+            return self._records.get(timeout=self.get_timeout_sec)
+        except Empty:
+            if self.error is not None:
+                raise KrakenWebsocketAPIError(
+                    "The reader of the book connection stopped"
+                ) from self.error
+            return []
+
+    def is_done(self) -> bool:
+        """
+        Returns True once the API was closed, and all its records were returned.
+        """
+        return self._closed and self._records.empty()
+
+    def close(self) -> None:
+        """
+        Closes the connection and stops the background thread.
+        """
+        self._closed = True
+        try:
+            self._loop.call_soon_threadsafe(self._task.cancel)
+        except RuntimeError:
+            # the event loop is already closed
+            pass
+        self._thread.join(timeout=5)
+
+    def _run_loop(self) -> None:
+        asyncio.set_event_loop(self._loop)
+        try:
+            self._loop.run_until_complete(self._task)
+        except asyncio.CancelledError:
+            pass
+        except BaseException as e:
+            logger.exception("The reader of the book connection stopped")
+            self.error = e
+        finally:
+            self._loop.close()
+
+    async def _run(self) -> None:
+        """
+        Connects to the API, subscribes and reads the books, reconnecting with
+        exponential backoff every time the connection drops.
+        """
+        attempt = 0
+        while True:
+            try:
+                async with connect(self.url) as ws:
+                    self.metrics.n_connects += 1
+                    logger.debug(f"Book connection established to {self.url}")
+                    attempt = 0
+
+                    # the books are rebuilt from the new snapshots
+                    for book in self.books.values():
+                        book.is_valid = False
+                    await self._subscribe(ws)
+                    await self._read(ws)
+            except (OSError, asyncio.TimeoutError, WebSocketException) as e:
+                logger.warning(f"Book connection lost: {e!r}")
+
+            backoff_sec = random.uniform(
+                0,
+                min(
+                    self.reconnect_backoff_max_sec,
+                    self.reconnect_backoff_base_sec * 2**attempt,
+                ),
+            )
+            attempt += 1
+            logger.info(
+                f"Reconnecting the book connection in {backoff_sec:.1f} seconds"
+            )
+            await asyncio.sleep(backoff_sec)
+
+    async def _subscribe(self, ws: ClientConnection) -> None:
+        """
+        Subscribes to the instruments, for the precision of each product, and then
+        to the books. The messages arrive in that order on the same connection.
+        """
+        if self.verify_checksum:
+            await ws.send(
+                json.dumps(
+                    {
+                        "method": "subscribe",
+                        "params": {"channel": "instrument", "snapshot": True},
+                    }
+                )
+            )
+        logger.debug(f"Subscribing to the books of {self.product_ids}")
+        await self._send_book_request(ws, "subscribe", self.product_ids)
+
+    async def _send_book_request(
+        self, ws: ClientConnection, method: str, product_ids: list[str]
+    ) -> None:
+        msg = {
+            "method": method,
+            "params": {
+                "channel": "book",
+                "symbol": product_ids,
+                "depth": self.depth,
+            },
+        }
+        if method == "subscribe":
+            msg["params"]["snapshot"] = True
+        await ws.send(json.dumps(msg))
+
+    async def _read(self, ws: ClientConnection) -> None:
+        """
+        Reads the messages until the connection drops, or goes silent for longer
+        than `heartbeat_timeout_sec`, and hands out the records on the way.
+        """
+        interval_sec = (self.record_interval_ms or 0) / 1000
+        next_records = time.monotonic() + interval_sec
+        last_message = time.monotonic()
+        while True:
+            # we wake up for the next records, even if no message arrives
+            timeout_sec = self.heartbeat_timeout_sec - (time.monotonic() - last_message)
+            if self.record_interval_ms is not None:
+                timeout_sec = min(timeout_sec, next_records - time.monotonic())
+            try:
+                message = await asyncio.wait_for(ws.recv(), timeout=max(timeout_sec, 0))
+            except asyncio.TimeoutError:
+                if time.monotonic() - last_message >= self.heartbeat_timeout_sec:
+                    # the connection went silent
+                    raise
+            else:
+                last_message = time.monotonic()
+                self.metrics.n_messages += 1
+                if "heartbeat" not in message:
+                    await self._handle_message(ws, _json_loads(message))
+                if self.record_interval_ms is None:
+                    self._emit_records()
+
+            if self.record_interval_ms is not None and time.monotonic() >= next_records:
+                self._emit_records()
+                next_records = time.monotonic() + interval_sec
+
+    async def _handle_message(self, ws: ClientConnection, message: dict) -> None:
+        channel = message.get("channel")
+        if channel == "book":
+            is_snapshot = message.get("type") == "snapshot"
+            for data in message["data"]:
+                await self._on_book(ws, data, is_snapshot)
+        elif channel == "instrument" and message.get("type") == "snapshot":
+            self._on_instruments(message["data"])
+        elif message.get("method") == "subscribe" and not message.get("success"):
+            raise KrakenWebsocketAPIError(f"Subscription failed: {message}")
+
+    def _on_instruments(self, data: dict) -> None:
+        for pair in data.get("pairs", []):
+            book = self.books.get(pair["symbol"])
+            if book is not None:
+                book.price_precision = pair["price_precision"]
+                book.qty_precision = pair["qty_precision"]
+
+    async def _on_book(
+        self, ws: ClientConnection, data: dict, is_snapshot: bool
+    ) -> None:
+        book = self.books.get(data["symbol"])
+        if book is None:
+            return
+
+        if is_snapshot:
+            book.apply_snapshot(data.get("bids", []), data.get("asks", []))
+            book.timestamp_ms = int(time.time() * 1000)
+        elif book.is_valid:
+            book.apply_update(data.get("bids", []), data.get("asks", []))
+            if "timestamp" in data:
+                book.timestamp_ms = to_ms(data["timestamp"])
+        else:
+            # waiting for a new snapshot
+            return
+        self.metrics.n_updates += 1
+
+        if (
+            self.verify_checksum
+            and book.can_verify()
+            and "checksum" in data
+            and book.checksum() != data["checksum"]
+        ):
+            self.metrics.n_checksum_errors += 1
+            logger.warning(
+                f"The checksum of the {book.product_id} book does not match. "
+                "Asking for a new snapshot"
+            )
+            book.is_valid = False
+            self._changed.discard(book.product_id)
+            await self._send_book_request(ws, "unsubscribe", [book.product_id])
+            await self._send_book_request(ws, "subscribe", [book.product_id])
+            return
+
+        self._changed.add(book.product_id)
+
+    def _emit_records(self) -> None:
+        """
+        Hands out a record for each product whose book changed since its last one.
+        """
+        if not self._changed:
+            return
+
+        records = [
+            self.books[product_id].to_record(
+                self.imbalance_levels, self.snapshot_levels
+            )
+            for product_id in self._changed
+            if self.books[product_id].is_valid
+        ]
+        self._changed.clear()
+        if not records:
+            return
+
+        self.metrics.n_records += len(records)
+        try:
+            self._records.put_nowait(records)
+        except Full:
+            # The producer is behind. Unlike trades, older records are superseded
+            # by the next ones, so instead of blocking the reads and letting the
+            # books fall behind the exchange, we replace the oldest batch with the
+            # new one. Its records of the products without a newer one are still
+            # their latest, so they are kept.
+            try:
+                oldest = self._records.get_nowait()
+            except Empty:
+                oldest = []
+            product_ids = {record["product_id"] for record in records}
+            kept = [r for r in oldest if r["product_id"] not in product_ids]
+            self.metrics.n_dropped += len(oldest) - len(kept)
+            # only this thread puts records, so there is room now
+            self._records.put_nowait(kept + records)
@@ -0,0 +1,278 @@
+import zipfile
+from contextlib import contextmanager
+from pathlib import Path
+from typing import IO, Callable, ContextManager, Iterator, List, Optional, Tuple
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+from loguru import logger
+
+from src.trade_data_source.base import TradeSource
+from src.trade_data_source.trade import TradeBatch
+from src.trade_data_source.trade_cache import TradeCache, _day_start
+
+# Kraken uses its own names for some assets in the names of the dump files
+ASSET_ALIASES = {"BTC": "XBT", "DOGE": "XDG"}
+
+
+class KrakenCSVDump(TradeSource):
+    """
+    Reads historical trades from the trade history CSV files Kraken publishes for
+    download, which hold every trade of each pair since it was listed.
+
+    There is one file per pair, e.g. XBTUSD.csv for BTC/USD, without a header, and
+    with one trade per line: the Unix timestamp in seconds, the price and the volume
+
+        1381095255,122.00000,0.10000000
+
+    The files can be in a directory, or in the ZIP archive as downloaded. They are
+    parsed in blocks by the multi-threaded pyarrow CSV reader, and the CSV files on
+    disk are memory-mapped, so we read the trades about as fast as the disk goes,
+    without holding a whole file in memory.
+
+    The products are read one after the other. If a `cache` is given, the trades are
+    also written to it one day at a time, so the REST API backfill can serve them
+    from the cache afterwards.
+    """
+
+    COLUMN_NAMES = ["timestamp", "price", "volume"]
+
+    def __init__(
+        self,
+        path: str,
+        product_ids: List[str],
+        from_ms: Optional[int] = None,
+        to_ms: Optional[int] = None,
+        cache: Optional[TradeCache] = None,
+        block_size_bytes: int = 16 * 1024 * 1024,
+    ) -> None:
+        """
+        Args:
+            path (str): A directory with the CSV files, a ZIP archive with them, or
+                a single CSV file.
+            product_ids (List[str]): The products to read, e.g. ["BTC/USD"].
+            from_ms (Optional[int]): The first millisecond to read. From the first
+                trade of each pair if None.
+            to_ms (Optional[int]): The last millisecond to read, inclusive. Until
+                the last trade of each pair if None.
+            cache (Optional[TradeCache]): Where we also store the trades we read.
+            block_size_bytes (int): How many bytes of CSV we parse at once.
+
+        Returns:
+            None
+        """
+        self.path = Path(path)
+        self.product_ids = product_ids
+        self.from_ms = from_ms
+        self.to_ms = to_ms
+        self.cache = cache
+        self.block_size_bytes = block_size_bytes
+
+        # fail early if a product has no file
+        self._files = [
+            (product_id, self._find_file(product_id)) for product_id in product_ids
+        ]
+        self._batches = self._read_all()
+        self._is_done = False
+
+    def get_trades(self) -> TradeBatch:
+        """
+        Returns the trades of the next block of the CSV files, in timestamp order.
+        """
+        try:
+            return next(self._batches)
+        except StopIteration:
+            self._is_done = True
+            return TradeBatch.empty()
+
+    def is_done(self) -> bool:
+        return self._is_done
+
+    def _read_all(self) -> Iterator[TradeBatch]:
+        for product_id, open_file in self._files:
+            logger.debug(f"Reading the trades of {product_id} from {self.path}")
+            n_trades = 0
+            writer = _CacheWriter(self.cache, product_id, self.from_ms, self.to_ms)
+
+            with open_file() as f:
+                for batch in self._read_file(product_id, f):
+                    writer.add(batch)
+                    n_trades += len(batch)
+                    yield batch
+
+            writer.close()
+            logger.debug(f"Read {n_trades} trades of {product_id}")
+
+    def _read_file(self, product_id: str, f: IO[bytes]) -> Iterator[TradeBatch]:
+        reader = pa_csv.open_csv(
+            f,
+            read_options=pa_csv.ReadOptions(
+                column_names=self.COLUMN_NAMES, block_size=self.block_size_bytes
+            ),
+            convert_options=pa_csv.ConvertOptions(
+                column_types={name: pa.float64() for name in self.COLUMN_NAMES}
+            ),
+        )
+
+        for block in reader:
+            timestamp_ms = pc.cast(
+                pc.round(pc.multiply(block["timestamp"], 1000)), pa.int64()
+            )
+
+            # the files are sorted by time, so we can skip the blocks before
+            # `from_ms`, and stop at the first block after `to_ms`
+            min_max = pc.min_max(timestamp_ms)
+            if self.to_ms is not None and min_max["min"].as_py() > self.to_ms:
+                return
+            if self.from_ms is not None and min_max["max"].as_py() < self.from_ms:
+                continue
+
+            batch = TradeBatch.from_columns(
+                product_id,
+                quantity=block["volume"].to_numpy(),
+                price=block["price"].to_numpy(),
+                timestamp_ms=timestamp_ms.to_numpy(),
+            )
+            if self.from_ms is not None and min_max["min"].as_py() < self.from_ms:
+                batch = batch.filter(batch.timestamp_ms >= self.from_ms)
+            if self.to_ms is not None and min_max["max"].as_py() > self.to_ms:
+                batch = batch.filter(batch.timestamp_ms <= self.to_ms)
+
+            if len(batch) > 0:
+                yield batch
+
+    def _find_file(
+        self, product_id: str
+    ) -> Callable[[], ContextManager[IO[bytes]]]:
+        """
+        Returns a function that opens the CSV file of the given product.
+        """
+        file_names = _dump_file_names(product_id)
+
+        if self.path.is_dir():
+            for file_name in file_names:
+                file_path = self.path / file_name
+                if file_path.exists():
+                    return lambda: pa.memory_map(str(file_path))
+
+        elif zipfile.is_zipfile(self.path):
+            with zipfile.ZipFile(self.path) as archive:
+                # the files may be in a folder inside the archive
+                members = {Path(name).name: name for name in archive.namelist()}
+            for file_name in file_names:
+                if file_name in members:
+                    member = members[file_name]
+                    return lambda: _open_zip_member(self.path, member)
+
+        elif self.path.name in file_names:
+            return lambda: pa.memory_map(str(self.path))
+
+        raise ValueError(
+            f"No trade history file for {product_id} in {self.path}, "
+            f"expected one of {file_names}"
+        )
+
+
+class _CacheWriter:
+    """
+    Writes the trades of one product to the trade cache, one day at a time.
+
+    The dump holds every trade of the pair, so every range we write is fully
+    covered, from `from_ms` (or the first trade) to the last trade we read.
+    """
+
+    def __init__(
+        self,
+        cache: Optional[TradeCache],
+        product_id: str,
+        from_ms: Optional[int],
+        to_ms: Optional[int],
+    ) -> None:
+        self.cache = cache
+        self.product_id = product_id
+        self.to_ms = to_ms
+        # the start of the range we did not write yet
+        self._from_ms = from_ms
+        # the trades of the last day, which may have more trades in the next block
+        self._pending = TradeBatch.empty()
+
+    def add(self, trades: TradeBatch) -> None:
+        if self.cache is None or len(trades) == 0:
+            return
+
+        trades = TradeBatch.concat([self._pending, trades])
+        if self._from_ms is None:
+            self._from_ms = int(trades.timestamp_ms[0])
+
+        last_day_ms = _day_start(int(trades.timestamp_ms[-1]))
+        if last_day_ms > self._from_ms:
+            is_complete = trades.timestamp_ms < last_day_ms
+            self._write(trades.filter(is_complete), last_day_ms - 1)
+            trades = trades.filter(~is_complete)
+        self._pending = trades
+
+    def close(self) -> None:
+        if self.cache is None or len(self._pending) == 0:
+            return
+
+        # the dump ends at its last trade, later trades may come from the API
+        self._write(self._pending, int(self._pending.timestamp_ms[-1]))
+        self._pending = TradeBatch.empty()
+
+    def _write(self, trades: TradeBatch, to_ms: int) -> None:
+        self.cache.write(self.product_id, trades, self._from_ms, to_ms)
+        self._from_ms = to_ms + 1
+
+
+def _dump_file_names(product_id: str) -> List[str]:
+    """
+    Returns the possible names of the dump file of a product, e.g. "XBTUSD.csv" and
+    "BTCUSD.csv" for "BTC/USD".
+    """
+    base, quote = _split_product_id(product_id)
+    names = [
+        f"{ASSET_ALIASES.get(base, base)}{ASSET_ALIASES.get(quote, quote)}.csv",
+        f"{base}{quote}.csv",
+    ]
+    return list(dict.fromkeys(names))
+
+
+def _split_product_id(product_id: str) -> Tuple[str, str]:
+    if "/" not in product_id:
+        raise ValueError(f"Invalid product ID: {product_id}, expected e.g. BTC/USD")
+    base, quote = product_id.split("/")
+    return base, quote
+
+
+@contextmanager
+def _open_zip_member(zip_path: Path, member: str) -> Iterator[IO[bytes]]:
+    """
+    Opens a file inside a ZIP archive. It is decompressed as we read it.
+    """
+    with zipfile.ZipFile(zip_path) as archive, archive.open(member) as f:
+        yield f
+
+
+if __name__ == "__main__":
+    # Loads the dump into the trade cache, without Kafka, e.g.
+    # python -m src.trade_data_source.kraken_csv_dump dump.zip cache BTC/USD ETH/USD
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("path")
+    parser.add_argument("cache_dir")
+    parser.add_argument("product_ids", nargs="+")
+    parser.add_argument("--from-ms", type=int, default=None)
+    parser.add_argument("--to-ms", type=int, default=None)
+    args = parser.parse_args()
+
+    dump = KrakenCSVDump(
+        args.path,
+        args.product_ids,
+        from_ms=args.from_ms,
+        to_ms=args.to_ms,
+        cache=TradeCache(args.cache_dir),
+    )
+    while not dump.is_done():
+        dump.get_trades()
@@ -1,46 +1,174 @@
-import json
-from pathlib import Path
-from time import sleep
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from queue import Full, Queue
 from typing import List, Optional, Tuple
 
-import requests
 from loguru import logger
 
-from src.trade_data_source.base import Trade, TradeSource
+from src.metrics import REGISTRY
+from src.trade_data_source.base import TradeSource
+from src.trade_data_source.kraken_rest_client import KrakenRestClient
+from src.trade_data_source.rate_limiter import RateLimiter
+from src.trade_data_source.trade import TradeBatch
+from src.trade_data_source.trade_cache import DAY_MS, TradeCache, TradeCacheWriter
 
 
 class KrakenRestAPI(TradeSource):
     """
     A class to fetch historical trade data from the Kraken REST API for multiple products.
+
+    Products are fetched concurrently, one thread per product (up to `max_workers`),
+    and all of them share a single KrakenRestClient, and so a single connection pool
+    and rate limiter, so together they stay within Kraken's public endpoint budget.
     """
 
+    # Kraken allows roughly 1 request per second on its public endpoints
+    # https://docs.kraken.com/api/docs/guides/spot-rest-ratelimits
+    DEFAULT_REQUESTS_PER_SEC = 1.0
+    DEFAULT_BURST = 1
+    # The rate we speed up to while Kraken does not throttle us. We start at the
+    # documented rate, probe above it one small step per successful request, and
+    # halve the rate whenever Kraken throttles us.
+    DEFAULT_MAX_REQUESTS_PER_SEC = 2.0
+
     def __init__(
         self,
         product_ids: List[str],
         last_n_days: int,
         cache_dir: Optional[str] = None,
+        max_workers: Optional[int] = None,
+        requests_per_sec: float = DEFAULT_REQUESTS_PER_SEC,
+        burst: int = DEFAULT_BURST,
+        num_shards: int = 1,
+        max_requests_per_sec: Optional[float] = None,
+        cache_max_size_bytes: Optional[int] = None,
+        cache_max_age_days: Optional[float] = None,
+        checkpoint: Optional[dict] = None,
     ) -> None:
-        # Init a list of KrakenRestAPISingleProduct instances
-        self.single_product_apis = [
-            KrakenRestAPISingleProduct(product_id, last_n_days, cache_dir)
-            for product_id in product_ids
+        """
+        Args:
+            product_ids (List[str]): The product IDs for which we want to get the trades.
+            last_n_days (int): The number of days from which we want to get historical data.
+            cache_dir (Optional[str]): The directory where we will store the historical data to
+            max_workers (Optional[int]): The maximum number of products fetched at the
+                same time. Defaults to one thread per product.
+            requests_per_sec (float): The request budget shared by all products.
+            burst (int): The maximum number of requests we can fire back to back.
+            num_shards (int): If greater than 1, the time range of each product is split
+                into `num_shards` sub-ranges that are fetched in parallel.
+            max_requests_per_sec (Optional[float]): The rate we can speed up to while
+                Kraken does not throttle us. Defaults to
+                DEFAULT_MAX_REQUESTS_PER_SEC, or `requests_per_sec` if it is higher.
+            cache_max_size_bytes (Optional[int]): The maximum size of the cache on disk.
+            cache_max_age_days (Optional[float]): Cached days not used for longer than
+                this are evicted.
+            checkpoint (Optional[dict]): A checkpoint saved by a previous run, to
+                resume the products from where it stopped.
+
+        Returns:
+            None
+        """
+        checkpoint = checkpoint or {}
+
+        # One rate limiter and connection pool shared by all the products
+        if max_requests_per_sec is None:
+            max_requests_per_sec = max(
+                requests_per_sec, self.DEFAULT_MAX_REQUESTS_PER_SEC
+            )
+        self.rate_limiter = RateLimiter(
+            rate=requests_per_sec, capacity=burst, max_rate=max_requests_per_sec
+        )
+        num_workers = max_workers or len(product_ids) * num_shards
+        self.client = KrakenRestClient(
+            rate_limiter=self.rate_limiter, pool_size=num_workers
+        )
+
+        # One cache shared by all the products
+        cache = None
+        if cache_dir is not None:
+            cache = TradeCache(
+                cache_dir,
+                max_size_bytes=cache_max_size_bytes,
+                max_age_days=cache_max_age_days,
+            )
+
+        # Init a list of KrakenRestAPISingleProduct (or KrakenRestAPIShardedProduct)
+        # instances
+        if num_shards > 1:
+            self.single_product_apis = [
+                KrakenRestAPIShardedProduct(
+                    product_id,
+                    last_n_days,
+                    num_shards,
+                    cache=cache,
+                    client=self.client,
+                    checkpoint=checkpoint.get(product_id),
+                )
+                for product_id in product_ids
+            ]
+        else:
+            self.single_product_apis = [
+                KrakenRestAPISingleProduct(
+                    product_id,
+                    last_n_days,
+                    cache=cache,
+                    client=self.client,
+                    checkpoint=checkpoint.get(product_id),
+                )
+                for product_id in product_ids
+            ]
+
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers or len(self.single_product_apis),
+            thread_name_prefix="kraken_rest_api",
+        )
+
+    def get_trades(self) -> TradeBatch:
+        """
+        Fetches one batch of trades for every product that is not done yet, in parallel.
+
+        The trades are returned grouped by product, in the order of `product_ids`, and
+        in timestamp order within each product.
+
+        Returns:
+            TradeBatch: The trades fetched for all the products.
+        """
+        # Fetch trades from all sources at the same time
+        futures = [
+            self._executor.submit(api.get_trades)
+            for api in self.single_product_apis
+            if not api.is_done()
         ]
 
-    def get_trades(self) -> List[Trade]:
-        # Fetch trades from all sources
-        trades = []
+        # Collect the results in submission order, so each product's trades
+        # stay together and sorted by timestamp
+        return TradeBatch.concat(future.result() for future in futures)
+
+    def checkpoint(self) -> dict:
+        """
+        Returns the checkpoint of every product. `get_trades` returns the trades of
+        all the products at once, so they are all right after the last batch.
+        """
+        checkpoint = {}
         for api in self.single_product_apis:
-            if not api.is_done():
-                trades.extend(api.get_trades())
-        return trades
+            checkpoint.update(api.checkpoint())
+        return checkpoint
 
     def is_done(self) -> bool:
         # Return True if all sources are done
         for api in self.single_product_apis:
             if not api.is_done():
                 return False
+
+        # nothing left to fetch, so we can release the worker threads
+        self._executor.shutdown(wait=False)
         return True
 
+    def close(self) -> None:
+        for api in self.single_product_apis:
+            api.close()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
 
 class KrakenRestAPISingleProduct(TradeSource):
     """
@@ -53,7 +181,11 @@ class KrakenRestAPISingleProduct(TradeSource):
         self,
         product_id: str,
         last_n_days: int,
-        cache_dir: Optional[str] = None,
+        cache: Optional[TradeCache] = None,
+        client: Optional[KrakenRestClient] = None,
+        from_ms: Optional[int] = None,
+        to_ms: Optional[int] = None,
+        checkpoint: Optional[dict] = None,
     ) -> None:
         """
         Basic initialization of the Kraken Rest API.
@@ -61,13 +193,28 @@ class KrakenRestAPISingleProduct(TradeSource):
         Args:
             product_id (str): One product ID for which we want to get the trades.
             last_n_days (int): The number of days from which we want to get historical data.
-            cache_dir (Optional[str]): The directory where we will store the historical data to
+            cache (Optional[TradeCache]): The cache where we store the historical data.
+                It can be shared with other instances.
+            client (Optional[KrakenRestClient]): The HTTP client used to talk to the
+                Kraken API. It can be shared with other instances. If not provided,
+                we create one that makes at most 1 request per second.
+            from_ms (Optional[int]): Overrides the start of the time range computed
+                from `last_n_days`.
+            to_ms (Optional[int]): Overrides the end (inclusive) of the time range
+                computed from `last_n_days`.
+            checkpoint (Optional[dict]): The checkpoint of this product saved by a
+                previous run, to resume from where it stopped.
 
         Returns:
             None
         """
         self.product_id = product_id
+        self.client = client or KrakenRestClient()
         self.from_ms, self.to_ms = self._init_from_to_ms(last_n_days)
+        if from_ms is not None:
+            self.from_ms = from_ms
+        if to_ms is not None:
+            self.to_ms = to_ms
 
         logger.debug(
             f"Initializing KrakenRestAPI: from_ms={ts_to_date(self.from_ms)}, to_ms={ts_to_date(self.to_ms)}"
@@ -78,16 +225,28 @@ class KrakenRestAPISingleProduct(TradeSource):
         # self.since_ms = from_ms
         self.last_trade_ms = self.from_ms
 
-        # are we done fetching historical data?
-        # Yes, if the last batch of trades has a data['result'][product_id]['last'] >= self.to_ms
-        # self._is_done = False
+        resume_from_ms = _resume_from_ms(checkpoint, self.from_ms, self.to_ms)
+        if resume_from_ms is not None:
+            logger.info(
+                f"Resuming {product_id} from the checkpoint at {ts_to_date(resume_from_ms)}"
+            )
+            self.last_trade_ms = resume_from_ms
+
+        # the cache is where we store the historical data to speed up service restarts
+        # and re-runs of the backfill over overlapping time ranges
+        self.cache = cache
+        self.use_cache = cache is not None
+        # the pages we download are written to the cache one whole day at a time
+        self._cache_writer = (
+            TradeCacheWriter(cache, product_id) if cache is not None else None
+        )
 
-        # cache_dir is the directory where we will store the historical data to speed up
-        # service restarts
-        self.use_cache = False
-        if cache_dir is not None:
-            self.cache = CachedTradeData(cache_dir)
-            self.use_cache = True
+        # exported on the metrics endpoint, if enabled
+        self._cache_reads = REGISTRY.counter(
+            "trade_cache_reads_total",
+            "Batches of historical trades read from the cache (hit) or the API (miss)",
+            ["product_id", "result"],
+        )
 
     @staticmethod
     def _init_from_to_ms(last_n_days: int) -> Tuple[int, int]:
@@ -116,179 +275,341 @@ class KrakenRestAPISingleProduct(TradeSource):
 
         return from_ms, to_ms
 
-    def get_trades(self) -> List[Trade]:
+    def get_trades(self) -> TradeBatch:
         """
-        Fetches a batch of trades from the Kraken Rest API and returns them as a list
-        of dictionaries.
+        Fetches a batch of trades from the cache, if it covers the current position,
+        or from the Kraken Rest API otherwise.
+
+        The trades stay in columnar form all the way, so a cache-warm backfill never
+        creates a Python object per trade.
 
         Args:
             None
 
         Returns:
-            List[Trade]: A list of dictionaries, where each dictionary contains the trade data.
+            TradeBatch: The trades, sorted by timestamp.
         """
-        # Replace the placeholders in the URL with the actual values for
-        # - product_id
-        # - since_ns
-        since_ns = self.last_trade_ms * 1_000_000
-        payload = {}
-        headers = {"Accept": "application/json"}
-        url = self.URL.format(product_id=self.product_id, since_sec=since_ns)
-        logger.debug(f"{url=}")
-
-        if self.use_cache and self.cache.has(url):
-            # read the data from the cache
-            trades = self.cache.read(url)
-            logger.debug(
-                f"Loaded {len(trades)} trades for {self.product_id}, since={ns_to_date(since_ns)} from the cache"
+        if self.use_cache:
+            covered_until_ms = self.cache.covered_until(
+                self.product_id, self.last_trade_ms
             )
-        else:
-            # make the request to the Kraken REST API
-            response = requests.request("GET", url, headers=headers, data=payload)
-
-            # parse string into dictionary
-            data = json.loads(response.text)
-
-            # TODO: Error handling
-            # It can happen that we get an error response from KrakenRESTAP like the following:
-            # data = {'error': ['EGeneral:Too many requests']}
-            # To solve this have several options
-            #
-            # Option 1. Check if the `error` key is present in the `data` and has
-            # a non-empty list value. If so, we could raise an exception, or even better, implment
-            # a retry mechanism, using a library like `retry` https://github.com/invl/retry
-            #
-            # Option 2. Simply slow down the rate at which we are making requests to the Kraken API,
-            # and cross your fingers.
-            #
-            # Option 3. Implement both Option 1 and Option 2, so you don't need to cross your fingers.
-            #
-            # Here is an example of how you could implement Option 2
-            if ("error" in data) and ("EGeneral:Too many requests" in data["error"]):
-                # slow down the rate at which we are making requests to the Kraken API
-                logger.info("Too many requests. Sleeping for 30 seconds")
-                sleep(30)
-
-            # Python trick
-            # Instead of initializing an empty list and appending to it, like this
-            #
-            # trades = []
-            # for trade in data['result'][self.product_ids[0]]:
-            #     trades.append({
-            #         'price': float(trade[0]),
-            #         'volume': float(trade[1]),
-            #         'time': int(trade[2]),
-            #     })
-            #
-            # You can use a list comprehension to do the same thing
-            trades = [
-                Trade(
-                    price=float(trade[0]),
-                    quantity=float(trade[1]),
-                    timestamp_ms=int(trade[2] * 1000),
-                    product_id=self.product_id,
-                )
-                for trade in data["result"][self.product_id]
-            ]
+            if covered_until_ms is not None:
+                self._cache_reads.labels(self.product_id, "hit").inc()
+                return self._get_trades_from_cache(covered_until_ms)
+            self._cache_reads.labels(self.product_id, "miss").inc()
 
-            logger.debug(
-                f"Fetched {len(trades)} trades for {self.product_id}, since={ns_to_date(since_ns)} from the Kraken REST API"
-            )
+        return self._get_trades_from_api()
 
-            if self.use_cache:
-                # write the data to the cache
-                self.cache.write(url, trades)
-                logger.debug(
-                    f"Wrote to cache for {self.product_id}, since={ns_to_date(since_ns)}"
-                )
+    def _get_trades_from_cache(self, covered_until_ms: int) -> TradeBatch:
+        """
+        Reads the trades from the cache, starting at `self.last_trade_ms`, and up to
+        the end of the covered range or the end of the UTC day, whichever comes first.
+        """
+        # `self.last_trade_ms` never goes below `self.from_ms`, so all the trades we
+        # read are inside the [from_ms, to_ms] range
+        from_ms = self.last_trade_ms
+        to_ms = min(covered_until_ms, self.to_ms, from_ms - from_ms % DAY_MS + DAY_MS - 1)
 
-            # slow down the rate at which we are making requests to the Kraken API
-            sleep(1)
+        trades = self.cache.read_batch(self.product_id, from_ms, to_ms)
+        logger.debug(
+            f"Loaded {len(trades)} trades for {self.product_id}, from={ts_to_date(from_ms)} to={ts_to_date(to_ms)} from the cache"
+        )
+
+        self.last_trade_ms = to_ms + 1
 
-        if trades[-1].timestamp_ms == self.last_trade_ms:
-            # if the last trade timestamp in the batch is the same as self.last_trade_ms,
-            # then we need to increment it by 1 to avoid repeating the exact same API request,
-            # which would result in an infinite loop
-            self.last_trade_ms = trades[-1].timestamp_ms + 1
+        return trades
+
+    def _get_trades_from_api(self) -> TradeBatch:
+        """
+        Fetches a page of trades from the Kraken Rest API, starting at
+        `self.last_trade_ms`, and stores it in the cache.
+        """
+        # Kraken returns the trades strictly after `since`, so we ask for the trades
+        # since 1ms before `self.last_trade_ms`, and drop the ones we already have
+        since_ms = self.last_trade_ms
+        since_ns = (since_ms - 1) * 1_000_000
+
+        # make the request to the Kraken REST API. The client takes care of
+        # pacing the requests and retrying them when Kraken throttles us.
+        raw_trades = self.client.get_trades(self.product_id, since_ns)
+
+        # Python trick
+        # Instead of initializing an empty list and appending to it, like this
+        #
+        # prices = []
+        # for trade in raw_trades:
+        #     prices.append(float(trade[0]))
+        #
+        # You can use a list comprehension to do the same thing.
+        # We build one column per field, instead of one Trade per row.
+        trades = TradeBatch.from_columns(
+            self.product_id,
+            quantity=[float(trade[1]) for trade in raw_trades],
+            price=[float(trade[0]) for trade in raw_trades],
+            timestamp_ms=[int(trade[2] * 1000) for trade in raw_trades],
+        )
+
+        logger.debug(
+            f"Fetched {len(trades)} trades for {self.product_id}, since={ns_to_date(since_ns)} from the Kraken REST API"
+        )
+
+        if len(trades) == 0:
+            # there are no trades after `since`, so there is nothing left to fetch
+            self.last_trade_ms = self.to_ms + 1
+            return trades
+
+        trades = trades.filter(trades.timestamp_ms >= since_ms)
+        if len(trades) == 0:
+            # the whole batch is from the millisecond before `since_ms`, which we
+            # already have. This needs a full page of trades in one millisecond, so
+            # in practice it never happens, but we move on to avoid an infinite loop.
+            self.last_trade_ms = since_ms + 1
+            return trades
+
+        last_trade_ms = int(trades.timestamp_ms[-1])
+        if last_trade_ms == since_ms:
+            # if all the trades in the batch happened in the same millisecond as
+            # `since_ms`, we need to move on to the next millisecond to avoid repeating
+            # the exact same API request, which would result in an infinite loop
+            self.last_trade_ms = last_trade_ms + 1
         else:
-            # otherwise, update self.last_trade_ms to the timestamp of the last trade
-            # in the batch
-            self.last_trade_ms = trades[-1].timestamp_ms
+            # otherwise, the batch might have been cut in the middle of the trades of
+            # its last millisecond. We keep the trades before that millisecond and the
+            # next request starts at it, so we neither skip nor repeat any trade.
+            trades = trades.filter(trades.timestamp_ms < last_trade_ms)
+            self.last_trade_ms = last_trade_ms
 
-        # filter out trades that are after the end timestamp
-        trades = [trade for trade in trades if trade.timestamp_ms <= self.to_ms]
+            if self.use_cache:
+                # every trade in [since_ms, last_trade_ms - 1] is in this batch
+                self._cache_writer.add(trades, since_ms, last_trade_ms - 1)
 
-        # if ns_to_date(since_ns) == '2024-04-30 18:33:41':
-        #     # self.cache._get_file_path(url)
+        # filter out trades that are outside the [from_ms, to_ms] range
+        return trades.filter(
+            (trades.timestamp_ms >= self.from_ms) & (trades.timestamp_ms <= self.to_ms)
+        )
 
-        return trades
+    def checkpoint(self) -> dict:
+        """
+        Every trade before `last_trade_ms` was returned, and the pages always end
+        at a millisecond boundary, so resuming from it neither skips nor repeats
+        any trade.
+        """
+        return {
+            self.product_id: {"from_ms": self.from_ms, "next_ms": self.last_trade_ms}
+        }
 
     def is_done(self) -> bool:
-        # return self._is_done
-        return self.last_trade_ms >= self.to_ms
+        # `last_trade_ms` is the timestamp of the next trade we want to fetch
+        if self.last_trade_ms <= self.to_ms:
+            return False
+        self.close()
+        return True
+
+    def close(self) -> None:
+        # the pages of the last day we downloaded
+        if self._cache_writer is not None:
+            self._cache_writer.flush()
 
 
-class CachedTradeData:
+class KrakenRestAPIShardedProduct(TradeSource):
     """
-    A class to handle the caching of trade data fetched from the Kraken REST API.
+    A class to fetch historical trade data from the Kraken REST API for a single product,
+    splitting the time range into `num_shards` disjoint sub-ranges that are paginated
+    in parallel.
+
+    Each shard is a KrakenRestAPISingleProduct restricted to its own sub-range. The
+    pages fetched by each shard are buffered in memory, and handed out shard after
+    shard, so the caller still sees one ordered stream of trades. A shard buffers at
+    most `max_buffered_pages` pages, and then waits for the caller to reach it, so
+    a long range is never held in memory as a whole.
+    The sub-ranges are disjoint and each shard pages through its own sub-range
+    without repeating trades, so the stitched stream has no duplicates.
     """
 
-    def __init__(self, cache_dir: str) -> None:
-        self.cache_dir = Path(cache_dir)
+    # 8 pages of up to 1000 trades per shard
+    DEFAULT_MAX_BUFFERED_PAGES = 8
 
-        if not self.cache_dir.exists():
-            # create the cache directory if it does not exist
-            self.cache_dir.mkdir(parents=True)
-
-    def read(self, url: str) -> List[Trade]:
+    def __init__(
+        self,
+        product_id: str,
+        last_n_days: int,
+        num_shards: int,
+        cache: Optional[TradeCache] = None,
+        client: Optional[KrakenRestClient] = None,
+        checkpoint: Optional[dict] = None,
+        max_buffered_pages: int = DEFAULT_MAX_BUFFERED_PAGES,
+    ) -> None:
         """
-        Reads from the cache the trade data for the given url
+        Args:
+            product_id (str): One product ID for which we want to get the trades.
+            last_n_days (int): The number of days from which we want to get historical data.
+            num_shards (int): The number of sub-ranges fetched in parallel.
+            cache (Optional[TradeCache]): The cache shared by all the shards.
+            client (Optional[KrakenRestClient]): The HTTP client shared by all the shards.
+            checkpoint (Optional[dict]): The checkpoint of this product saved by a
+                previous run. The shards before it are skipped, and the shard that
+                contains it resumes from it.
+            max_buffered_pages (int): The maximum number of pages a shard fetches
+                ahead of the caller.
+
+        Returns:
+            None
         """
-        file_path = self._get_file_path(url)
+        if num_shards < 1:
+            raise ValueError("num_shards must be at least 1")
 
-        if file_path.exists():
-            # read the data from the parquet file
-            import pandas as pd
+        self.product_id = product_id
+        self.client = client or KrakenRestClient(pool_size=num_shards)
+        self.from_ms, self.to_ms = KrakenRestAPISingleProduct._init_from_to_ms(
+            last_n_days
+        )
 
-            data = pd.read_parquet(file_path)
-            # transform the data to a list of Trade objects
-            return [Trade(**trade) for trade in data.to_dict(orient="records")]
+        # the timestamp of the next trade we hand out
+        self.next_ms = self.from_ms
+        resume_from_ms = _resume_from_ms(checkpoint, self.from_ms, self.to_ms)
+        if resume_from_ms is not None:
+            logger.info(
+                f"Resuming {product_id} from the checkpoint at {ts_to_date(resume_from_ms)}"
+            )
+            self.next_ms = resume_from_ms
+
+        self.shards = [
+            KrakenRestAPISingleProduct(
+                product_id,
+                last_n_days,
+                cache=cache,
+                client=self.client,
+                from_ms=max(shard_from_ms, self.next_ms),
+                to_ms=shard_to_ms,
+            )
+            for shard_from_ms, shard_to_ms in self._split_range(
+                self.from_ms, self.to_ms, num_shards
+            )
+            if shard_to_ms >= self.next_ms
+        ]
 
-        return []
+        # one queue of pages per shard, each page with the timestamp of the next
+        # trade after it. A `None` marks the end of the shard. The queues are
+        # bounded, so the shards after the current one stop fetching once they are
+        # `max_buffered_pages` ahead.
+        self._pages: List[Queue] = [
+            Queue(maxsize=max_buffered_pages) for _ in self.shards
+        ]
+        # set by `close`, to release the shards waiting for room in their queue
+        self._closed = threading.Event()
+        # index of the shard we are currently handing out trades from
+        self._current_shard = 0
+
+        self._executor = ThreadPoolExecutor(
+            # at least one worker, even if the checkpoint is after every shard
+            max_workers=max(len(self.shards), 1),
+            thread_name_prefix=f"kraken_rest_api_{product_id}",
+        )
+        self._futures = [
+            self._executor.submit(self._fetch_shard, shard_idx)
+            for shard_idx in range(len(self.shards))
+        ]
 
-    def write(self, url: str, trades: List[Trade]) -> None:
-        """
-        Saves the given trades to a parquet file in the cache directory.
+    @staticmethod
+    def _split_range(from_ms: int, to_ms: int, num_shards: int) -> List[Tuple[int, int]]:
         """
-        if not trades:
-            return
+        Splits the inclusive range [from_ms, to_ms] into `num_shards` disjoint
+        inclusive sub-ranges of (almost) the same length.
 
-        # transform the trades to a pandas DataFrame
-        import pandas as pd
-
-        data = pd.DataFrame([trade.model_dump() for trade in trades])
+        Args:
+            from_ms (int): The start of the range.
+            to_ms (int): The end (inclusive) of the range.
+            num_shards (int): The number of sub-ranges.
 
-        # write the DataFrame to a parquet file
-        file_path = self._get_file_path(url)
-        data.to_parquet(file_path)
+        Returns:
+            List[Tuple[int, int]]: The (from_ms, to_ms) pairs of each sub-range.
+        """
+        length = to_ms - from_ms + 1
+        bounds = [from_ms + length * i // num_shards for i in range(num_shards + 1)]
+        return [
+            (bounds[i], bounds[i + 1] - 1)
+            for i in range(num_shards)
+            if bounds[i] < bounds[i + 1]
+        ]
 
-    def has(self, url: str) -> bool:
+    def _fetch_shard(self, shard_idx: int) -> None:
         """
-        Returns True if the cache has the trade data for the given url, False otherwise.
+        Paginates one shard until it reaches its upper bound, putting each page in
+        the shard's queue.
         """
-        file_path = self._get_file_path(url)
-        return file_path.exists()
-
-    def _get_file_path(self, url: str) -> str:
+        shard = self.shards[shard_idx]
+        try:
+            while not shard.is_done() and not self._closed.is_set():
+                trades = shard.get_trades()
+                if len(trades) > 0:
+                    self._put(shard_idx, (trades, shard.last_trade_ms))
+        finally:
+            shard.close()
+            # let the consumer know this shard is finished, even if it failed
+            self._put(shard_idx, None)
+
+    def _put(self, shard_idx: int, page: Optional[Tuple[TradeBatch, int]]) -> None:
+        # we wait with a timeout, so we notice if the source is closed while the
+        # queue is full
+        while not self._closed.is_set():
+            try:
+                self._pages[shard_idx].put(page, timeout=0.1)
+                return
+            except Full:
+                pass
+
+    def get_trades(self) -> TradeBatch:
         """
-        Returns the file path where the trade data for the given url is (or will be) stored.
+        Returns the next page of trades, in timestamp order across all shards.
+        Blocks until the next page is available.
+
+        Returns:
+            TradeBatch: The trades of the page.
         """
-        # use the given url to generate a unique file name in a deterministic way
-        import hashlib
+        while self._current_shard < len(self.shards):
+            page = self._pages[self._current_shard].get()
+
+            if page is None:
+                # the current shard is finished. We re-raise any error it hit,
+                # and move on to the next one.
+                self._futures[self._current_shard].result()
+                self.next_ms = self.shards[self._current_shard].to_ms + 1
+                self._current_shard += 1
+                continue
+
+            trades, self.next_ms = page
+            return trades
+
+        self._executor.shutdown(wait=False)
+        return TradeBatch.empty()
+
+    def checkpoint(self) -> dict:
+        return {self.product_id: {"from_ms": self.from_ms, "next_ms": self.next_ms}}
 
-        url_hash = hashlib.md5(url.encode()).hexdigest()
-        return self.cache_dir / f"{url_hash}.parquet"
-        # return self.cache_dir / f'{product_id.replace ("/","-")}_{from_ms}.parquet'
+    def is_done(self) -> bool:
+        return self._current_shard >= len(self.shards)
+
+    def close(self) -> None:
+        self._closed.set()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _resume_from_ms(
+    checkpoint: Optional[dict], from_ms: int, to_ms: int
+) -> Optional[int]:
+    """
+    Returns the timestamp we can resume a product from, given the checkpoint saved
+    by a previous run, or None if we must start from `from_ms`.
+
+    Every trade in [checkpoint["from_ms"], checkpoint["next_ms"]) was produced, so
+    we can use the checkpoint if it started before the current range. A later
+    `last_n_days` run may start before the checkpoint, and then we start over.
+    """
+    if checkpoint is None or checkpoint["from_ms"] > from_ms:
+        return None
+    if checkpoint["next_ms"] <= from_ms:
+        return None
+    return min(checkpoint["next_ms"], to_ms + 1)
 
 
 def ts_to_date(ts: int) -> str:
@@ -0,0 +1,218 @@
+import random
+import time
+from typing import List, Optional
+
+import requests
+from loguru import logger
+from requests.adapters import HTTPAdapter
+
+from src.metrics import REGISTRY
+from src.trade_data_source.rate_limiter import RateLimiter
+
+
+class KrakenRestAPIError(Exception):
+    """
+    Raised when the Kraken REST API returns an error we cannot recover from.
+    """
+
+
+class KrakenRestClient:
+    """
+    A thin HTTP client for the public Kraken REST API.
+
+    - Keeps a pool of keep-alive connections, so we don't pay a TCP + TLS handshake
+      for every page.
+    - Asks for gzip-compressed responses.
+    - Paces the requests with a (possibly shared) RateLimiter, and adapts its rate
+      to the responses it gets: it slows down when Kraken throttles us and slowly
+      speeds up again after every successful request.
+    - Retries rate-limit errors, 5xx responses, responses that are not JSON and
+      network errors with exponential backoff and jitter, instead of crashing the
+      backfill.
+
+    A single instance is thread-safe and can be shared by several products.
+    """
+
+    BASE_URL = "https://api.kraken.com/0/public"
+
+    # Errors returned by Kraken in the `error` field that are worth retrying
+    # https://docs.kraken.com/api/docs/guides/spot-errors
+    RETRIABLE_ERRORS = (
+        "EGeneral:Too many requests",
+        "EAPI:Rate limit exceeded",
+        "EService:Unavailable",
+        "EService:Busy",
+        "EGeneral:Temporary lockout",
+    )
+
+    def __init__(
+        self,
+        rate_limiter: Optional[RateLimiter] = None,
+        pool_size: int = 10,
+        timeout_sec: float = 10.0,
+        max_retries: int = 8,
+        backoff_base_sec: float = 1.0,
+        backoff_max_sec: float = 60.0,
+    ) -> None:
+        """
+        Args:
+            rate_limiter (Optional[RateLimiter]): The rate limiter used to pace the
+                requests. If not provided, we make at most 1 request per second.
+            pool_size (int): The maximum number of connections kept alive.
+            timeout_sec (float): The connect and read timeout of each request.
+            max_retries (int): How many times we retry a request before giving up.
+            backoff_base_sec (float): The backoff after the first failed attempt.
+                It doubles after every failed attempt.
+            backoff_max_sec (float): The maximum backoff between two attempts.
+
+        Returns:
+            None
+        """
+        self.rate_limiter = rate_limiter or RateLimiter(rate=1.0)
+        self.timeout_sec = timeout_sec
+        self.max_retries = max_retries
+        self.backoff_base_sec = backoff_base_sec
+        self.backoff_max_sec = backoff_max_sec
+
+        self._session = requests.Session()
+        self._session.headers.update(
+            {"Accept": "application/json", "Accept-Encoding": "gzip, deflate"}
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self._session.mount("https://", adapter)
+        self._session.mount("http://", adapter)
+
+        # exported on the metrics endpoint, if enabled
+        self._request_duration = REGISTRY.histogram(
+            "kraken_rest_request_duration_seconds",
+            "Duration of the requests to the Kraken REST API",
+            ["endpoint"],
+        )
+        self._retries = REGISTRY.counter(
+            "kraken_rest_retries_total",
+            "Failed requests to the Kraken REST API we retried, by reason",
+            ["endpoint", "reason"],
+        )
+        self._throttled = REGISTRY.counter(
+            "kraken_rest_throttled_total",
+            "Requests rejected by the Kraken REST API rate limits",
+            ["endpoint"],
+        )
+        REGISTRY.gauge(
+            "kraken_rest_requests_per_second",
+            "Current rate of the (possibly shared) rate limiter",
+        ).set_function(lambda: self.rate_limiter.rate)
+
+    def get_trades(self, product_id: str, since_ns: int) -> List[list]:
+        """
+        Fetches one page of trades for the given product from the Kraken
+        `/Trades` endpoint.
+
+        Args:
+            product_id (str): The product ID, for example "BTC/USD".
+            since_ns (int): Only trades after this timestamp (in nanoseconds) are
+                returned.
+
+        Returns:
+            List[list]: The raw trades, as returned by Kraken:
+                [price, volume, time, buy/sell, market/limit, miscellaneous, trade_id]
+        """
+        data = self._get("Trades", params={"pair": product_id, "since": since_ns})
+        return data["result"][product_id]
+
+    def _get(self, endpoint: str, params: dict) -> dict:
+        """
+        Makes a GET request to the given endpoint, retrying with exponential backoff
+        and jitter when it is worth it.
+
+        Args:
+            endpoint (str): The endpoint name, for example "Trades".
+            params (dict): The query parameters.
+
+        Returns:
+            dict: The parsed JSON response.
+        """
+        url = f"{self.BASE_URL}/{endpoint}"
+
+        for attempt in range(self.max_retries + 1):
+            # wait for our turn, so we stay within the Kraken API rate limits
+            self.rate_limiter.acquire()
+
+            start = time.perf_counter()
+            try:
+                response = self._session.get(
+                    url, params=params, timeout=self.timeout_sec
+                )
+            except (requests.ConnectionError, requests.Timeout) as e:
+                reason = f"network error: {e}"
+                self._retries.labels(endpoint, "network").inc()
+            else:
+                self._request_duration.labels(endpoint).observe(
+                    time.perf_counter() - start
+                )
+                if response.status_code == 429:
+                    self.rate_limiter.slow_down()
+                    reason = "HTTP 429"
+                    self._throttled.labels(endpoint).inc()
+                    self._retries.labels(endpoint, "throttled").inc()
+                elif response.status_code >= 500:
+                    reason = f"HTTP {response.status_code}"
+                    self._retries.labels(endpoint, "server_error").inc()
+                elif (data := self._parse_json(response)) is None:
+                    reason = "the response is not JSON"
+                    self._retries.labels(endpoint, "invalid_response").inc()
+                else:
+                    errors = data.get("error") or []
+
+                    if not errors:
+                        # things are going well, so we can go a bit faster
+                        self.rate_limiter.speed_up()
+                        return data
+
+                    if not any(e in self.RETRIABLE_ERRORS for e in errors):
+                        raise KrakenRestAPIError(f"{url} {params}: {errors}")
+
+                    if any("Too many requests" in e or "Rate limit" in e for e in errors):
+                        self.rate_limiter.slow_down()
+                        self._throttled.labels(endpoint).inc()
+                        self._retries.labels(endpoint, "throttled").inc()
+                    else:
+                        self._retries.labels(endpoint, "api_error").inc()
+                    reason = ", ".join(errors)
+
+            if attempt == self.max_retries:
+                break
+
+            backoff_sec = self._backoff_sec(attempt)
+            logger.info(
+                f"Request to {endpoint} {params} failed ({reason}). "
+                f"Retrying in {backoff_sec:.1f} seconds "
+                f"(attempt {attempt + 1}/{self.max_retries}, "
+                f"rate={self.rate_limiter.rate:.2f} req/s)"
+            )
+            time.sleep(backoff_sec)
+
+        raise KrakenRestAPIError(
+            f"{url} {params}: giving up after {self.max_retries} retries ({reason})"
+        )
+
+    @staticmethod
+    def _parse_json(response: requests.Response) -> Optional[dict]:
+        """
+        Returns the JSON of a response, or None if it is not JSON, e.g. the HTML
+        error page of a proxy in front of Kraken, sent with a 200. Raises on 4xx.
+        """
+        response.raise_for_status()
+        try:
+            return response.json()
+        except ValueError:
+            return None
+
+    def _backoff_sec(self, attempt: int) -> float:
+        """
+        Returns how long to wait before the next attempt, using exponential backoff
+        with "full jitter", so that concurrent workers don't retry in lockstep.
+        """
+        return random.uniform(
+            0, min(self.backoff_max_sec, self.backoff_base_sec * 2**attempt)
+        )
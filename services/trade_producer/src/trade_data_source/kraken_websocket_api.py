@@ -1,89 +1,196 @@
+import asyncio
 import json
-from datetime import datetime, timezone
+import random
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from queue import Empty, Full, Queue
+from typing import Callable, Iterable, Optional
 
 from loguru import logger
-from websocket import create_connection
+from websockets.asyncio.client import ClientConnection, connect
+from websockets.exceptions import WebSocketException
 
+from src.metrics import REGISTRY
 from src.trade_data_source.base import Trade, TradeSource
+from src.trade_data_source.kraken_rest_api import KrakenRestAPISingleProduct
+from src.trade_data_source.trade import TradeBatch
+
+try:
+    # orjson parses the Kraken messages several times faster than the standard
+    # library. It is optional, and we fall back to `json` if it is not installed.
+    import orjson
+
+    _json_loads = orjson.loads
+except ImportError:  # pragma: no cover
+    _json_loads = json.loads
+
+
+# A function that returns all the trades of a product in the inclusive range
+# [from_ms, to_ms], sorted by timestamp
+GapFiller = Callable[[str, int, int], Iterable[Trade]]
+
+
+def fill_gap_from_rest_api(product_id: str, from_ms: int, to_ms: int) -> TradeBatch:
+    """
+    Fetches the trades of the given product in [from_ms, to_ms] from the Kraken
+    REST API. This is the default way to fill the gaps left by a disconnection.
+    """
+    api = KrakenRestAPISingleProduct(
+        product_id, last_n_days=1, from_ms=from_ms, to_ms=to_ms
+    )
+    pages = []
+    while not api.is_done():
+        pages.append(api.get_trades())
+    return TradeBatch.concat(pages)
+
+
+class KrakenWebsocketAPIError(Exception):
+    """
+    Raised when the Kraken websocket API fails in a way reconnecting cannot fix,
+    e.g. when it rejects our subscription.
+    """
 
 
 class KrakenWebsocketAPI(TradeSource):
     """
     Class for reading real-time trades from the Kraken websocket API.
+
+    The product IDs are spread over `num_connections` websocket connections. Each
+    connection is read by its own KrakenWebsocketConnection, an asyncio event loop
+    running in a background thread, and all of them hand their trades over to
+    `get_trades` through one bounded queue. When the queue is full, the readers
+    wait for the producer to catch up, instead of piling up trades in memory.
+
+    When a connection drops (or goes silent for longer than
+    `heartbeat_timeout_sec`), it reconnects with exponential backoff and subscribes
+    again. For every product we have seen trades of, the trades we missed while
+    disconnected are then fetched with `gap_filler` (by default, from the Kraken
+    REST API), and handed out before the new live trades, so the stream of trades
+    has neither gaps nor duplicates.
     """
 
     URL = "wss://ws.kraken.com/v2"
 
-    def __init__(self, product_ids: list[str]):
+    def __init__(
+        self,
+        product_ids: list[str],
+        url: str = URL,
+        num_connections: int = 1,
+        max_queue_size: int = 10_000,
+        gap_filler: Optional[GapFiller] = fill_gap_from_rest_api,
+        reconnect_backoff_base_sec: float = 1.0,
+        reconnect_backoff_max_sec: float = 30.0,
+        heartbeat_timeout_sec: float = 10.0,
+        get_timeout_sec: float = 1.0,
+        metrics_log_interval_sec: float = 60.0,
+    ):
         """
-        Initializes the KrakenWebsocketAPI instance with the given product ID.
+        Initializes the KrakenWebsocketAPI instance with the given product IDs, and
+        starts reading trades in the background.
 
         Args:
-            product_id: The product ID to fetch trades from the Kraken API.
+            product_ids: The product IDs to fetch trades from the Kraken API.
+            url: The URL of the Kraken websocket API.
+            num_connections: The number of websocket connections the product IDs
+                are spread over.
+            max_queue_size: The maximum number of batches of trades waiting for
+                `get_trades`.
+            gap_filler: The function used to fetch the trades we missed while
+                disconnected. If None, the gaps are not filled.
+            reconnect_backoff_base_sec: The backoff after the first failed
+                connection. It doubles after every failed attempt.
+            reconnect_backoff_max_sec: The maximum backoff between two connections.
+            heartbeat_timeout_sec: We reconnect if we receive nothing (not even a
+                heartbeat) for this long.
+            get_timeout_sec: How long `get_trades` waits for new trades before
+                returning an empty list.
+            metrics_log_interval_sec: How often each connection logs its metrics.
         """
+        if num_connections < 1:
+            raise ValueError("num_connections must be at least 1")
+
         self.product_ids = product_ids
+        self.get_timeout_sec = get_timeout_sec
 
-        # Create a websocket connection
-        self._ws = create_connection(self.URL)
-        logger.debug("Connection established")
+        # The batches of trades ready to be returned by `get_trades`, shared by
+        # all the connections
+        self._trades: Queue = Queue(maxsize=max_queue_size)
+        self._closed = False
 
-        # Subscribe to trades for a given product ID
-        self._subscribe(product_ids)
+        # Spread the products round-robin over the connections
+        num_connections = min(num_connections, len(product_ids))
+        self.connections = [
+            KrakenWebsocketConnection(
+                connection_id,
+                product_ids[connection_id::num_connections],
+                self._trades,
+                url=url,
+                gap_filler=gap_filler,
+                reconnect_backoff_base_sec=reconnect_backoff_base_sec,
+                reconnect_backoff_max_sec=reconnect_backoff_max_sec,
+                heartbeat_timeout_sec=heartbeat_timeout_sec,
+                metrics_log_interval_sec=metrics_log_interval_sec,
+            )
+            for connection_id in range(num_connections)
+        ]
 
-    def get_trades(self) -> list[Trade]:
+    def get_trades(self) -> list[Trade] | TradeBatch:
         """
         Returns the latest batch of trades from the Kraken API.
+        Waits up to `get_timeout_sec` for new trades.
 
         Returns:
-            A list of Trade objects.
+            A list of Trade objects, or a TradeBatch for the trades that filled
+            a gap. Empty if no trades arrived in the meantime.
         """
-        message = self._ws.recv()
-
-        if "heartbeat" in message:
-            logger.debug("Heartbeat received")
+        try:
+            return self._trades.get(timeout=self.get_timeout_sec)
+        except Empty:
+            for connection in self.connections:
+                if connection.error is not None:
+                    raise KrakenWebsocketAPIError(
+                        f"The reader of connection {connection.connection_id} stopped"
+                    ) from connection.error
             return []
 
-        message = json.loads(message)
-
-        # Extract the trade data
-        trades = []
-        for trade in message["data"]:
-            trades.append(
-                Trade(
-                    product_id=trade["symbol"],
-                    quantity=trade["qty"],
-                    price=trade["price"],
-                    timestamp_ms=self.to_ms(trade["timestamp"]),
-                )
-            )
+    @staticmethod
+    def parse_trades(message: str | bytes) -> list[Trade]:
+        """
+        Extracts the trades from a raw message of the Kraken `trade` channel.
 
-        return trades
+        Args:
+            message: The raw message, as received from the websocket.
 
-    def is_done(self) -> bool:
-        """
-        Returns True if the API connection is closed.
+        Returns:
+            A list of Trade objects. Empty if the message does not hold trades.
         """
-        return False
+        message = _json_loads(message)
+        if message.get("channel") != "trade":
+            return []
+        return _parse_trade_data(message["data"])
 
-    def _subscribe(self, product_ids: list[str]):
+    def metrics(self) -> list["ConnectionMetrics"]:
+        """
+        Returns the metrics of each connection.
         """
-        Subscribes to the trades for the given product IDs.
+        return [connection.metrics for connection in self.connections]
 
-        Args:
-            product_id: The product ID to subscribe to.
+    def is_done(self) -> bool:
         """
-        logger.debug(f"Subscribing to trades for {product_ids}")
-        msg = {
-            "method": "subscribe",
-            "params": {"channel": "trade", "symbol": product_ids, "snapshot": False},
-        }
-        self._ws.send(json.dumps(msg))
-        logger.debug(f"Subscription successful!")
+        Returns True once the API was closed, and all its trades were returned.
+        """
+        return self._closed and self._trades.empty()
 
-        # Discard the first two messages, because they are just confirmations
-        for product_id in product_ids:
-            _ = self._ws.recv()
-            _ = self._ws.recv()
+    def close(self) -> None:
+        """
+        Closes all the connections and stops their background threads.
+        """
+        self._closed = True
+        for connection in self.connections:
+            connection.close()
 
     @staticmethod
     def to_ms(timestamp: str) -> int:
@@ -98,5 +205,440 @@ class KrakenWebsocketAPI(TradeSource):
         Returns:
             The timestamp in milliseconds.
         """
-        timestamp = datetime.fromisoformat(timestamp[:-1]).replace(tzinfo=timezone.utc)
-        return int(timestamp.timestamp() * 1000)
+        return to_ms(timestamp)
+
+
+@dataclass
+class ConnectionMetrics:
+    """
+    Counters and gauges of one websocket connection, for monitoring.
+    """
+
+    product_ids: list[str]
+    # how many times we connected
+    n_connects: int = 0
+    n_messages: int = 0
+    n_trades: int = 0
+    # how many times the queue was full, and we had to wait for the producer
+    n_queue_full: int = 0
+    # the time between the last trade of a message and the moment we read it,
+    # i.e. how far behind the exchange this connection is
+    last_lag_ms: Optional[int] = None
+    # the highest lag since the metrics were last logged
+    max_lag_ms: Optional[int] = None
+
+
+class KrakenWebsocketConnection:
+    """
+    One websocket connection to the Kraken API, subscribed to some of the products,
+    and read by an asyncio event loop in its own background thread.
+
+    See KrakenWebsocketAPI for how reconnections and gaps are handled.
+    """
+
+    def __init__(
+        self,
+        connection_id: int,
+        product_ids: list[str],
+        trades: Queue,
+        url: str,
+        gap_filler: Optional[GapFiller],
+        reconnect_backoff_base_sec: float,
+        reconnect_backoff_max_sec: float,
+        heartbeat_timeout_sec: float,
+        metrics_log_interval_sec: float,
+    ):
+        """
+        Args:
+            connection_id: The index of this connection, for the logs.
+            product_ids: The product IDs this connection subscribes to.
+            trades: The queue where we put the batches of trades.
+            See KrakenWebsocketAPI for the other arguments.
+        """
+        self.connection_id = connection_id
+        self.product_ids = product_ids
+        self.url = url
+        self.gap_filler = gap_filler
+        self.reconnect_backoff_base_sec = reconnect_backoff_base_sec
+        self.reconnect_backoff_max_sec = reconnect_backoff_max_sec
+        self.heartbeat_timeout_sec = heartbeat_timeout_sec
+        self.metrics_log_interval_sec = metrics_log_interval_sec
+
+        self.metrics = ConnectionMetrics(product_ids=product_ids)
+        self._export_metrics()
+        # The error that stopped the reader, if any
+        self.error: Optional[BaseException] = None
+
+        self._trades = trades
+
+        # The state below is only touched by the event loop thread.
+        # For each product, the timestamp of the last trade we handed out, and how
+        # many trades we handed out in that same millisecond.
+        self._last_trade_ms: dict[str, int] = {}
+        self._n_trades_at_last_ms: dict[str, int] = {}
+        # For each product, the end of the last gap we filled. The live trades up
+        # to that timestamp were already returned by the gap filler.
+        self._gap_to_ms: dict[str, int] = {}
+        # The live trades of the products whose gap is being filled
+        self._pending: dict[str, list[Trade]] = {}
+        self._gap_fill_tasks: set[asyncio.Task] = set()
+        self._last_metrics_log = time.monotonic()
+
+        self._loop = asyncio.new_event_loop()
+        self._task = self._loop.create_task(self._run())
+        self._thread = threading.Thread(
+            target=self._run_loop,
+            name=f"kraken_websocket_api_{connection_id}",
+            daemon=True,
+        )
+        self._thread.start()
+
+    def close(self) -> None:
+        """
+        Closes the connection and stops the background thread.
+        """
+        try:
+            self._loop.call_soon_threadsafe(self._task.cancel)
+        except RuntimeError:
+            # the event loop is already closed
+            pass
+        self._thread.join(timeout=5)
+
+    def _run_loop(self) -> None:
+        """
+        Runs the event loop until the connection is closed. This is the body of the
+        background thread.
+        """
+        asyncio.set_event_loop(self._loop)
+        try:
+            self._loop.run_until_complete(self._task)
+        except asyncio.CancelledError:
+            pass
+        except BaseException as e:
+            logger.exception(f"The reader of connection {self.connection_id} stopped")
+            self.error = e
+        finally:
+            self._loop.close()
+
+    async def _run(self) -> None:
+        """
+        Connects to the API, subscribes and reads the trades, reconnecting with
+        exponential backoff every time the connection drops.
+        """
+        attempt = 0
+        while True:
+            try:
+                async with connect(self.url) as ws:
+                    self.metrics.n_connects += 1
+                    logger.debug(
+                        f"Connection {self.connection_id} established to {self.url}"
+                    )
+                    attempt = 0
+
+                    await self._subscribe(ws)
+                    await self._read(ws)
+            except (OSError, asyncio.TimeoutError, WebSocketException) as e:
+                logger.warning(f"Connection {self.connection_id} lost: {e!r}")
+
+            backoff_sec = random.uniform(
+                0,
+                min(
+                    self.reconnect_backoff_max_sec,
+                    self.reconnect_backoff_base_sec * 2**attempt,
+                ),
+            )
+            attempt += 1
+            logger.info(
+                f"Reconnecting connection {self.connection_id} in {backoff_sec:.1f} seconds"
+            )
+            await asyncio.sleep(backoff_sec)
+
+    async def _subscribe(self, ws: ClientConnection) -> None:
+        """
+        Subscribes to the trades for the product IDs. The confirmations are handled
+        by `_handle_message`, like any other message.
+        """
+        logger.debug(f"Subscribing to trades for {self.product_ids}")
+        msg = {
+            "method": "subscribe",
+            "params": {
+                "channel": "trade",
+                "symbol": self.product_ids,
+                "snapshot": False,
+            },
+        }
+        await ws.send(json.dumps(msg))
+
+    async def _read(self, ws: ClientConnection) -> None:
+        """
+        Reads the messages until the connection drops, or goes silent for longer
+        than `heartbeat_timeout_sec`.
+        """
+        while True:
+            message = await asyncio.wait_for(
+                ws.recv(), timeout=self.heartbeat_timeout_sec
+            )
+            self.metrics.n_messages += 1
+            if "heartbeat" not in message:
+                await self._handle_message(_json_loads(message))
+
+            if time.monotonic() - self._last_metrics_log > self.metrics_log_interval_sec:
+                self._log_metrics()
+
+    async def _handle_message(self, message: dict) -> None:
+        if message.get("channel") == "trade":
+            trades = _parse_trade_data(message["data"])
+            self._update_lag(trades)
+            await self._on_trades(trades)
+        elif message.get("method") == "subscribe":
+            self._on_subscribed(message)
+
+    def _on_subscribed(self, message: dict) -> None:
+        """
+        Handles the confirmation of the subscription to one product. If we were
+        already receiving trades for it, this is a reconnection, and we start
+        filling the gap.
+        """
+        if not message.get("success"):
+            raise KrakenWebsocketAPIError(f"Subscription failed: {message}")
+
+        product_id = message["result"]["symbol"]
+        logger.debug(f"Subscription to {product_id} successful!")
+
+        if self.gap_filler is None or product_id not in self._last_trade_ms:
+            return
+
+        # The trades after the confirmation come through the websocket. The ones
+        # before it, down to the last trade we saw, come from the gap filler.
+        self._gap_to_ms[product_id] = int(time.time() * 1000)
+
+        if product_id in self._pending:
+            # a gap fill is already running, and it will extend to the new gap
+            return
+
+        self._pending[product_id] = []
+        task = asyncio.create_task(self._fill_gap(product_id))
+        self._gap_fill_tasks.add(task)
+        task.add_done_callback(self._gap_fill_tasks.discard)
+
+    async def _fill_gap(self, product_id: str) -> None:
+        """
+        Hands out the trades we missed while disconnected, and then the live trades
+        we received in the meantime.
+        """
+        while True:
+            from_ms = self._last_trade_ms[product_id]
+            to_ms = self._gap_to_ms[product_id]
+            logger.info(
+                f"Filling the gap in the {product_id} trades from {from_ms} to {to_ms}"
+            )
+
+            try:
+                trades = await asyncio.get_running_loop().run_in_executor(
+                    None, self.gap_filler, product_id, from_ms, to_ms
+                )
+            except Exception as e:
+                logger.error(f"Could not fill the gap in the {product_id} trades: {e!r}")
+                trades = []
+
+            # The gap starts at the millisecond of the last trade we handed out, so
+            # we skip the trades of that millisecond we already have
+            n_skip = self._n_trades_at_last_ms[product_id]
+            gap_trades = []
+            for trade in trades:
+                if trade.timestamp_ms == from_ms and n_skip > 0:
+                    n_skip -= 1
+                elif from_ms <= trade.timestamp_ms <= to_ms:
+                    gap_trades.append(trade)
+            await self._emit(gap_trades)
+
+            if self._gap_to_ms[product_id] == to_ms:
+                break
+            # we reconnected again while filling the gap, so there is a new gap
+
+        # Hand out the live trades we held back. More of them can arrive while we
+        # wait for room in the queue, so we loop until there are none left.
+        while self._pending[product_id]:
+            pending = self._pending[product_id]
+            self._pending[product_id] = []
+            await self._emit([trade for trade in pending if trade.timestamp_ms > to_ms])
+        del self._pending[product_id]
+
+    async def _on_trades(self, trades: list[Trade]) -> None:
+        if not self._gap_to_ms:
+            # we never reconnected, so there is nothing to filter
+            await self._emit(trades)
+            return
+
+        live_trades = []
+        for trade in trades:
+            product_id = trade.product_id
+            if product_id in self._pending:
+                # the gap of this product is being filled, so its live trades
+                # have to wait
+                self._pending[product_id].append(trade)
+            elif trade.timestamp_ms > self._gap_to_ms.get(product_id, -1):
+                live_trades.append(trade)
+        await self._emit(live_trades)
+
+    async def _emit(self, trades: list[Trade]) -> None:
+        """
+        Hands the trades over to `get_trades`, and remembers the last one of each
+        product.
+        """
+        if not trades:
+            return
+
+        for trade in trades:
+            if trade.timestamp_ms == self._last_trade_ms.get(trade.product_id):
+                self._n_trades_at_last_ms[trade.product_id] += 1
+            else:
+                self._last_trade_ms[trade.product_id] = trade.timestamp_ms
+                self._n_trades_at_last_ms[trade.product_id] = 1
+        self.metrics.n_trades += len(trades)
+
+        try:
+            self._trades.put_nowait(trades)
+        except Full:
+            # The producer is behind. We wait for room in a worker thread, so the
+            # event loop keeps answering the pings of the server, and we stop
+            # reading from this connection until then.
+            self.metrics.n_queue_full += 1
+            while True:
+                try:
+                    await asyncio.to_thread(self._trades.put, trades, timeout=1.0)
+                    return
+                except Full:
+                    continue
+
+    def _update_lag(self, trades: list[Trade]) -> None:
+        if not trades:
+            return
+        lag_ms = int(time.time() * 1000) - trades[-1].timestamp_ms
+        self.metrics.last_lag_ms = lag_ms
+        if self.metrics.max_lag_ms is None or lag_ms > self.metrics.max_lag_ms:
+            self.metrics.max_lag_ms = lag_ms
+        if REGISTRY.enabled:
+            # the trades of a message all belong to the same product
+            product_id = trades[-1].product_id
+            self._lag.labels(product_id).observe(lag_ms / 1000)
+            self._trades_received.labels(product_id).inc(len(trades))
+
+    def _export_metrics(self) -> None:
+        """
+        Exports the metrics of this connection on the metrics endpoint, if enabled.
+        The counters of `self.metrics` are read on every scrape.
+        """
+        for name, help in [
+            ("connects", "Times the connection was (re)established"),
+            ("messages", "Messages received, including heartbeats"),
+            ("queue_full", "Times the trades queue was full, and we stopped reading"),
+        ]:
+            REGISTRY.counter(
+                f"kraken_websocket_{name}_total", help, ["connection"]
+            ).labels(self.connection_id).set_function(
+                lambda name=name: getattr(self.metrics, f"n_{name}")
+            )
+        self._trades_received = REGISTRY.counter(
+            "kraken_websocket_trades_total",
+            "Trades received from the Kraken websocket API",
+            ["product_id"],
+        )
+        self._lag = REGISTRY.histogram(
+            "kraken_websocket_lag_seconds",
+            "Time between a trade on the exchange and its arrival here",
+            ["product_id"],
+        )
+
+    def _log_metrics(self) -> None:
+        logger.info(f"Websocket connection {self.connection_id}: {self.metrics}")
+        self.metrics.max_lag_ms = None
+        self._last_metrics_log = time.monotonic()
+
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def _parse_trade_data(data: list[dict]) -> list[Trade]:
+    """
+    Extracts the trades from the `data` field of a Kraken `trade` message.
+    """
+    # This runs for every trade in the stream, so we pass the fields by position
+    # (product_id, quantity, price, timestamp_ms), which is noticeably faster than
+    # by keyword.
+    return [
+        Trade(
+            trade["symbol"],
+            float(trade["qty"]),
+            float(trade["price"]),
+            to_ms(trade["timestamp"]),
+        )
+        for trade in data
+    ]
+
+
+def to_ms(timestamp: str) -> int:
+    """
+    Transforms an RFC3339 timestamp like '2024-06-17T09:36:39.467866Z' into Unix
+    milliseconds.
+
+    Kraken always sends UTC timestamps in this exact layout, and trades come in
+    bursts that share the same second, so instead of building a datetime for every
+    trade, we look up the whole seconds in a cache and only parse the milliseconds.
+    Anything that does not look like that layout goes through
+    `datetime.fromisoformat`.
+
+    Args:
+        timestamp: A timestamp string.
+
+    Returns:
+        The timestamp in milliseconds, truncated to the millisecond.
+    """
+    n_chars = len(timestamp)
+    is_utc = n_chars >= 20 and timestamp[-1] == "Z"
+    if is_utc and (n_chars == 20 or timestamp[19] == "."):
+        try:
+            ms = _second_start_ms(timestamp[:19])
+            if n_chars >= 24:
+                # e.g. '.467866Z', we keep the first 3 digits
+                ms += int(timestamp[20:23])
+            elif n_chars > 21:
+                # e.g. '.4Z', which means 400 ms
+                ms += int(timestamp[20:-1].ljust(3, "0"))
+            return ms
+        except ValueError:
+            pass
+
+    # slow path, for timestamps with an offset or in an unexpected layout
+    if timestamp.endswith("Z"):
+        timestamp = timestamp[:-1] + "+00:00"
+    date = datetime.fromisoformat(timestamp)
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return (date - _EPOCH) // timedelta(milliseconds=1)
+
+
+@lru_cache(maxsize=4096)
+def _second_start_ms(timestamp: str) -> int:
+    """
+    Returns the Unix milliseconds of a UTC timestamp like '2024-06-17T09:36:39'.
+    Raises ValueError if the timestamp is not in that layout.
+    """
+    if timestamp[10] != "T" or timestamp[13] != ":" or timestamp[16] != ":":
+        raise ValueError(f"Unexpected timestamp layout: {timestamp}")
+
+    return (
+        _day_start_ms(timestamp[:10])
+        + int(timestamp[11:13]) * 3_600_000
+        + int(timestamp[14:16]) * 60_000
+        + int(timestamp[17:19]) * 1000
+    )
+
+
+@lru_cache(maxsize=16)
+def _day_start_ms(date: str) -> int:
+    """
+    Returns the Unix milliseconds of midnight UTC of a date like '2024-06-17'.
+    """
+    day = datetime.strptime(date, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+    return (day - _EPOCH) // timedelta(milliseconds=1)
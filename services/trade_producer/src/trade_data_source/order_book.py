@@ -0,0 +1,186 @@
+import zlib
+from array import array
+from bisect import bisect_left
+from functools import lru_cache
+from typing import Iterable, List, Optional, Tuple
+
+# How many levels of each side go into the Kraken checksum
+CHECKSUM_LEVELS = 10
+
+
+class OrderBookSide:
+    """
+    One side of a level 2 order book, as two parallel arrays of doubles sorted by
+    price: the best level first.
+
+    The prices of the bids are stored negated, so both sides are sorted in
+    ascending order and a level is found with a binary search. An update of one
+    level is a binary search plus, when a level appears or disappears, a memmove
+    of the levels after it, which is very cheap for the depths Kraken serves
+    (10 to 1000 levels). The arrays take 16 bytes per level, instead of the
+    ~100 bytes of a dict of Python floats.
+    """
+
+    def __init__(self, is_bid: bool, depth: int) -> None:
+        self._sign = -1.0 if is_bid else 1.0
+        self.depth = depth
+        self._keys = array("d")
+        self.qtys = array("d")
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def clear(self) -> None:
+        del self._keys[:]
+        del self.qtys[:]
+
+    def update(self, price: float, qty: float) -> None:
+        """
+        Sets the quantity of the given price level. A quantity of 0 removes it.
+        """
+        key = self._sign * price
+        keys = self._keys
+        i = bisect_left(keys, key)
+        if i < len(keys) and keys[i] == key:
+            if qty == 0:
+                del keys[i]
+                del self.qtys[i]
+            else:
+                self.qtys[i] = qty
+        elif qty != 0:
+            keys.insert(i, key)
+            self.qtys.insert(i, qty)
+
+    def truncate(self) -> None:
+        """
+        Drops the levels beyond the subscribed depth. Kraken does not send the
+        removal of those levels, they are simply out of scope.
+        """
+        if len(self._keys) > self.depth:
+            del self._keys[self.depth :]
+            del self.qtys[self.depth :]
+
+    def price(self, i: int) -> float:
+        return self._sign * self._keys[i]
+
+    def levels(self, n_levels: int) -> List[Tuple[float, float]]:
+        """
+        Returns the best `n_levels` levels, as (price, qty) pairs.
+        """
+        n_levels = min(n_levels, len(self._keys))
+        return [(self.price(i), self.qtys[i]) for i in range(n_levels)]
+
+    def total_qty(self, n_levels: int) -> float:
+        return sum(self.qtys[:n_levels])
+
+
+class OrderBook:
+    """
+    The level 2 order book of one product, kept up to date from the snapshot and
+    the updates of the Kraken `book` channel.
+
+    https://docs.kraken.com/api/docs/websocket-v2/book
+    """
+
+    def __init__(
+        self,
+        product_id: str,
+        depth: int,
+        price_precision: Optional[int] = None,
+        qty_precision: Optional[int] = None,
+    ) -> None:
+        """
+        Args:
+            product_id: The product ID, for example "BTC/USD".
+            depth: The depth we subscribed to. Levels beyond it are dropped.
+            price_precision: The number of decimals of the prices of this product,
+                needed to compute the checksum.
+            qty_precision: The number of decimals of the quantities.
+        """
+        self.product_id = product_id
+        self.bids = OrderBookSide(is_bid=True, depth=depth)
+        self.asks = OrderBookSide(is_bid=False, depth=depth)
+        self.price_precision = price_precision
+        self.qty_precision = qty_precision
+        # False until we get a snapshot, and after a checksum mismatch
+        self.is_valid = False
+        # the exchange timestamp of the last update
+        self.timestamp_ms: Optional[int] = None
+
+    def apply_snapshot(self, bids: Iterable[dict], asks: Iterable[dict]) -> None:
+        self.bids.clear()
+        self.asks.clear()
+        self.apply_update(bids, asks)
+        self.is_valid = True
+
+    def apply_update(self, bids: Iterable[dict], asks: Iterable[dict]) -> None:
+        for level in bids:
+            self.bids.update(level["price"], level["qty"])
+        for level in asks:
+            self.asks.update(level["price"], level["qty"])
+        self.bids.truncate()
+        self.asks.truncate()
+
+    def can_verify(self) -> bool:
+        return self.price_precision is not None and self.qty_precision is not None
+
+    def checksum(self) -> int:
+        """
+        Returns the CRC32 checksum Kraken computes over the top 10 levels of each
+        side: the asks from best to worst, and then the bids, each level as its
+        price and quantity formatted with the precision of the product, without
+        the decimal point and the leading zeros.
+        """
+        if not self.can_verify():
+            raise ValueError(f"The precision of {self.product_id} is unknown")
+
+        parts = []
+        for side in (self.asks, self.bids):
+            for i in range(min(CHECKSUM_LEVELS, len(side))):
+                parts.append(_checksum_number(side.price(i), self.price_precision))
+                parts.append(_checksum_number(side.qtys[i], self.qty_precision))
+        return zlib.crc32("".join(parts).encode())
+
+    def to_record(self, imbalance_levels: int = 10, snapshot_levels: int = 0) -> dict:
+        """
+        Returns the top of the book and the imbalance of its first
+        `imbalance_levels` levels, i.e. (bid qty - ask qty) / (bid qty + ask qty),
+        and, if `snapshot_levels` > 0, the first levels of each side.
+        """
+        record = {
+            "product_id": self.product_id,
+            "timestamp_ms": self.timestamp_ms,
+            "bid_price": None,
+            "bid_qty": None,
+            "ask_price": None,
+            "ask_qty": None,
+            "mid_price": None,
+            "spread": None,
+            "imbalance": None,
+        }
+        if len(self.bids) > 0:
+            record["bid_price"] = self.bids.price(0)
+            record["bid_qty"] = self.bids.qtys[0]
+        if len(self.asks) > 0:
+            record["ask_price"] = self.asks.price(0)
+            record["ask_qty"] = self.asks.qtys[0]
+        if len(self.bids) > 0 and len(self.asks) > 0:
+            record["mid_price"] = (record["bid_price"] + record["ask_price"]) / 2
+            record["spread"] = record["ask_price"] - record["bid_price"]
+
+        bid_qty = self.bids.total_qty(imbalance_levels)
+        ask_qty = self.asks.total_qty(imbalance_levels)
+        if bid_qty + ask_qty > 0:
+            record["imbalance"] = (bid_qty - ask_qty) / (bid_qty + ask_qty)
+
+        if snapshot_levels > 0:
+            record["bids"] = self.bids.levels(snapshot_levels)
+            record["asks"] = self.asks.levels(snapshot_levels)
+        return record
+
+
+# Formatting the 40 numbers of a checksum is most of the cost of an update, and
+# between two updates almost all of them are the same
+@lru_cache(maxsize=1 << 16)
+def _checksum_number(value: float, precision: int) -> str:
+    return f"{value:.{precision}f}".replace(".", "").lstrip("0")
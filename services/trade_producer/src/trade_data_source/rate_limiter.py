@@ -0,0 +1,100 @@
+import threading
+import time
+from typing import Optional
+
+
+class RateLimiter:
+    """
+    A thread-safe token bucket rate limiter.
+
+    Tokens are added to the bucket at a constant `rate` (tokens per second), up to
+    a maximum of `capacity` tokens. Every call to `acquire` takes one token from the
+    bucket, blocking until one is available.
+
+    A single instance can be shared across threads so that all of them, together,
+    stay within the same request budget.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        capacity: int = 1,
+        min_rate: Optional[float] = None,
+        max_rate: Optional[float] = None,
+    ) -> None:
+        """
+        Args:
+            rate (float): The number of tokens added to the bucket per second.
+            capacity (int): The maximum number of tokens the bucket can hold, i.e.
+                the largest burst of requests we allow.
+            min_rate (Optional[float]): The lowest rate `slow_down` can go to.
+                Defaults to a tenth of `rate`.
+            max_rate (Optional[float]): The highest rate `speed_up` can go to.
+                Defaults to `rate`, so `speed_up` only recovers from a `slow_down`,
+                and never goes above the start rate.
+
+        Returns:
+            None
+        """
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1")
+
+        self.rate = rate
+        self.capacity = capacity
+        self.min_rate = min_rate if min_rate is not None else rate / 10
+        self.max_rate = max_rate if max_rate is not None else rate
+
+        # we start with a full bucket
+        self._tokens = float(capacity)
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """
+        Takes one token from the bucket, blocking until one is available.
+        """
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                # time until the next token is available
+                wait_sec = (1 - self._tokens) / self.rate
+
+            # sleep outside the lock, so other threads can check the bucket
+            time.sleep(wait_sec)
+
+    def slow_down(self, factor: float = 0.5) -> None:
+        """
+        Multiplies the rate by `factor`, without going below `min_rate`.
+        Called when the server tells us we are going too fast.
+        """
+        with self._lock:
+            self._refill()
+            self.rate = max(self.min_rate, self.rate * factor)
+            # drop the accumulated burst, so we don't hammer the server right away
+            self._tokens = min(self._tokens, 1.0)
+
+    def speed_up(self, step: float = 0.05) -> None:
+        """
+        Adds `step` to the rate, without going above `max_rate`.
+        Called after every successful request, so we slowly creep back towards
+        the limit after a slow down.
+        """
+        with self._lock:
+            self._refill()
+            self.rate = min(self.max_rate, self.rate + step)
+
+    def _refill(self) -> None:
+        """
+        Adds the tokens accumulated since the last refill to the bucket.
+        Must be called with the lock held.
+        """
+        now = time.monotonic()
+        self._tokens = min(
+            self.capacity, self._tokens + (now - self._last_refill) * self.rate
+        )
+        self._last_refill = now
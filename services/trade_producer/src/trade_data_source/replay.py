@@ -0,0 +1,211 @@
+import time
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+from loguru import logger
+
+from src.trade_data_source.base import TradeSource
+from src.trade_data_source.trade import TRADE_SCHEMA, TradeBatch
+from src.trade_data_source.trade_cache import DAY_MS
+
+# The file formats we can replay, by file extension
+FILE_FORMATS = {
+    ".parquet": "parquet",
+    ".arrow": "ipc",
+    ".feather": "ipc",
+}
+
+
+class ReplayTradeSource(TradeSource):
+    """
+    Replays trades from local parquet or Arrow IPC files with the TRADE_SCHEMA, e.g.
+    the trade cache directory, either as fast as possible or `speed` times faster
+    than real time.
+
+    The trades of all the products are merged in timestamp order. Trades with the
+    same timestamp keep the order they have in the files, so two replays of the same
+    files always produce the same trades in the same order.
+
+    The files are read one time chunk at a time (a UTC day by default), so we can
+    replay more trades than fit in memory.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        product_ids: Optional[List[str]] = None,
+        from_ms: Optional[int] = None,
+        to_ms: Optional[int] = None,
+        speed: Optional[float] = None,
+        chunk_ms: int = DAY_MS,
+        max_batch_size: int = 10_000,
+        max_sleep_sec: float = 0.1,
+    ) -> None:
+        """
+        Args:
+            path (str): A parquet or Arrow file, or a directory that we search for
+                them recursively.
+            product_ids (Optional[List[str]]): The products to replay. All of them
+                if None.
+            from_ms (Optional[int]): The first millisecond to replay. The first
+                trade in the files if None.
+            to_ms (Optional[int]): The last millisecond to replay, inclusive. The
+                last trade in the files if None.
+            speed (Optional[float]): How many times faster than real time we replay
+                the trades, keeping the original gaps between them, e.g. 100.0
+                replays an hour in 36 seconds. As fast as possible if None.
+            chunk_ms (int): How much time we read from the files at once.
+            max_batch_size (int): The maximum number of trades returned by
+                `get_trades`.
+            max_sleep_sec (float): The longest `get_trades` waits for the next
+                trade before returning an empty batch.
+
+        Returns:
+            None
+        """
+        if speed is not None and speed <= 0:
+            raise ValueError("speed must be positive")
+
+        self.path = path
+        self.product_ids = product_ids
+        self.speed = speed
+        self.chunk_ms = chunk_ms
+        self.max_batch_size = max_batch_size
+        self.max_sleep_sec = max_sleep_sec
+
+        self._dataset = _open_dataset(Path(path))
+        self._filter = (
+            pc.field("product_id").isin(product_ids) if product_ids else None
+        )
+
+        if from_ms is None or to_ms is None:
+            first_ms, last_ms = self._time_range()
+            from_ms = first_ms if from_ms is None else from_ms
+            to_ms = last_ms if to_ms is None else to_ms
+        self.from_ms = from_ms
+        self.to_ms = to_ms
+
+        # the start of the next chunk to read
+        self._next_chunk_ms = from_ms
+        # the trades of the current chunk, and how many we already returned
+        self._batch = TradeBatch.empty()
+        self._position = 0
+
+        # the wall clock time when we started replaying, and the timestamp of the
+        # first trade, to pace the replay
+        self._clock_start: Optional[float] = None
+        self._replay_start_ms: Optional[int] = None
+
+    def get_trades(self) -> TradeBatch:
+        """
+        Returns the next trades, in timestamp order. When pacing the replay, these
+        are the trades that are due by now, or an empty batch if none is due yet.
+        """
+        if self._position >= len(self._batch):
+            self._read_next_chunk()
+            if self._position >= len(self._batch):
+                return TradeBatch.empty()
+
+        stop = min(self._position + self.max_batch_size, len(self._batch))
+
+        if self.speed is not None:
+            stop = min(stop, self._due_position())
+            if stop <= self._position:
+                self._wait_for_next_trade()
+                stop = min(
+                    self._position + self.max_batch_size, self._due_position()
+                )
+                if stop <= self._position:
+                    return TradeBatch.empty()
+
+        trades = self._batch.slice(self._position, stop)
+        self._position = stop
+        return trades
+
+    def is_done(self) -> bool:
+        return self._next_chunk_ms > self.to_ms and self._position >= len(self._batch)
+
+    def _read_next_chunk(self) -> None:
+        """
+        Reads the chunks until we find one with trades, or we reach `to_ms`.
+        """
+        while self._next_chunk_ms <= self.to_ms:
+            chunk_from_ms = self._next_chunk_ms
+            chunk_to_ms = min(chunk_from_ms + self.chunk_ms - 1, self.to_ms)
+            self._next_chunk_ms = chunk_to_ms + 1
+
+            condition = (pc.field("timestamp_ms") >= chunk_from_ms) & (
+                pc.field("timestamp_ms") <= chunk_to_ms
+            )
+            if self._filter is not None:
+                condition = condition & self._filter
+            table = self._dataset.to_table(filter=condition)
+            if table.num_rows == 0:
+                continue
+
+            # the sort is stable, so this is a k-way merge of the products, which
+            # keeps the order of the trades within the same millisecond
+            self._batch = TradeBatch.from_table(table.sort_by("timestamp_ms"))
+            self._position = 0
+            logger.debug(
+                f"Replaying {table.num_rows} trades from {chunk_from_ms} to "
+                f"{chunk_to_ms}"
+            )
+            return
+
+    def _due_position(self) -> int:
+        """
+        Returns the position in the current batch of the first trade that is not
+        due yet.
+        """
+        if self._clock_start is None:
+            self._clock_start = time.monotonic()
+            self._replay_start_ms = int(self._batch.timestamp_ms[self._position])
+
+        replayed_ms = (time.monotonic() - self._clock_start) * 1000 * self.speed
+        due_ms = self._replay_start_ms + replayed_ms
+        return int(np.searchsorted(self._batch.timestamp_ms, due_ms, side="right"))
+
+    def _wait_for_next_trade(self) -> None:
+        next_ms = int(self._batch.timestamp_ms[self._position])
+        replayed_ms = (time.monotonic() - self._clock_start) * 1000 * self.speed
+        wait_sec = (next_ms - self._replay_start_ms - replayed_ms) / 1000 / self.speed
+        time.sleep(min(max(wait_sec, 0.0), self.max_sleep_sec))
+
+    def _time_range(self) -> Tuple[int, int]:
+        """
+        Returns the timestamps of the first and the last trade in the files.
+        """
+        timestamps = self._dataset.to_table(
+            columns=["timestamp_ms"], filter=self._filter
+        )["timestamp_ms"]
+        if len(timestamps) == 0:
+            # nothing to replay
+            return 0, -1
+        min_max = pc.min_max(timestamps)
+        return min_max["min"].as_py(), min_max["max"].as_py()
+
+
+def _open_dataset(path: Path) -> ds.Dataset:
+    """
+    Opens the parquet and Arrow files at `path` as a single dataset. Other files,
+    e.g. the index.json of the trade cache, are ignored.
+    """
+    files = [path] if path.is_file() else sorted(path.rglob("*"))
+
+    datasets = []
+    for suffix, file_format in FILE_FORMATS.items():
+        paths = [str(file) for file in files if file.suffix == suffix]
+        if paths:
+            datasets.append(ds.dataset(paths, schema=TRADE_SCHEMA, format=file_format))
+
+    if not datasets:
+        logger.warning(f"No parquet or Arrow files found in {path}")
+        return ds.dataset(pa.Table.from_batches([], schema=TRADE_SCHEMA))
+    if len(datasets) == 1:
+        return datasets[0]
+    return ds.dataset(datasets)
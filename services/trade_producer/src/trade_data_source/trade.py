@@ -1,8 +1,258 @@
-from pydantic import BaseModel
+from dataclasses import dataclass
+from typing import Iterable, Iterator, List, Sequence
 
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+# The columnar layout of a batch of trades, with one column per Trade field
+TRADE_SCHEMA = pa.schema(
+    [
+        ("product_id", pa.string()),
+        ("quantity", pa.float64()),
+        ("price", pa.float64()),
+        ("timestamp_ms", pa.int64()),
+    ]
+)
+
+
+@dataclass(slots=True)
+class Trade:
+    """
+    A single trade.
+
+    It is a slotted dataclass instead of a pydantic model, because we create millions
+    of them during a backfill, and validation and a `__dict__` per instance make
+    that a lot slower. Prefer `TradeBatch` to move many trades around.
+    """
 
-class Trade(BaseModel):
     product_id: str
     quantity: float
     price: float
     timestamp_ms: int
+
+    def model_dump(self) -> dict:
+        """
+        Returns the trade as a dict, like the pydantic `model_dump` it replaces.
+        """
+        return {
+            "product_id": self.product_id,
+            "quantity": self.quantity,
+            "price": self.price,
+            "timestamp_ms": self.timestamp_ms,
+        }
+
+
+class TradeBatch:
+    """
+    A batch of trades, stored column by column in contiguous numpy arrays.
+
+    The product of each trade is stored as an index (`product_code`) into the
+    `product_ids` list, so we don't keep a string per trade.
+
+    It behaves like a read-only list of Trade objects (`len`, iteration, indexing),
+    so the code written for `list[Trade]` keeps working, but the producer and the
+    trade cache read the arrays directly, without creating a Trade per row.
+    """
+
+    __slots__ = ("product_ids", "product_code", "quantity", "price", "timestamp_ms")
+
+    def __init__(
+        self,
+        product_ids: List[str],
+        product_code: Sequence[int],
+        quantity: Sequence[float],
+        price: Sequence[float],
+        timestamp_ms: Sequence[int],
+    ) -> None:
+        """
+        Args:
+            product_ids (List[str]): The distinct product IDs in the batch.
+            product_code (Sequence[int]): For each trade, the index of its product
+                ID in `product_ids`.
+            quantity (Sequence[float]): The quantity of each trade.
+            price (Sequence[float]): The price of each trade.
+            timestamp_ms (Sequence[int]): The timestamp of each trade, in Unix
+                milliseconds.
+
+        Returns:
+            None
+        """
+        self.product_ids = list(product_ids)
+        self.product_code = np.ascontiguousarray(product_code, dtype=np.int32)
+        self.quantity = np.ascontiguousarray(quantity, dtype=np.float64)
+        self.price = np.ascontiguousarray(price, dtype=np.float64)
+        self.timestamp_ms = np.ascontiguousarray(timestamp_ms, dtype=np.int64)
+
+        lengths = {
+            len(self.product_code),
+            len(self.quantity),
+            len(self.price),
+            len(self.timestamp_ms),
+        }
+        if len(lengths) > 1:
+            raise ValueError(
+                "All the columns of a TradeBatch must have the same length"
+            )
+
+    @classmethod
+    def empty(cls) -> "TradeBatch":
+        return cls([], [], [], [], [])
+
+    @classmethod
+    def from_columns(
+        cls,
+        product_id: str,
+        quantity: Sequence[float],
+        price: Sequence[float],
+        timestamp_ms: Sequence[int],
+    ) -> "TradeBatch":
+        """
+        Builds a batch where all the trades belong to the same product.
+        """
+        product_code = np.zeros(len(timestamp_ms), dtype=np.int32)
+        return cls([product_id], product_code, quantity, price, timestamp_ms)
+
+    @classmethod
+    def from_trades(cls, trades: Iterable[Trade]) -> "TradeBatch":
+        if isinstance(trades, TradeBatch):
+            return trades
+
+        trades = list(trades)
+        codes = {}
+        product_code = [
+            codes.setdefault(trade.product_id, len(codes)) for trade in trades
+        ]
+        return cls(
+            list(codes),
+            product_code,
+            [trade.quantity for trade in trades],
+            [trade.price for trade in trades],
+            [trade.timestamp_ms for trade in trades],
+        )
+
+    @classmethod
+    def from_table(cls, table: pa.Table) -> "TradeBatch":
+        """
+        Builds a batch from a pyarrow Table with the TRADE_SCHEMA.
+        """
+        product_id = table["product_id"].combine_chunks().dictionary_encode()
+        return cls(
+            product_id.dictionary.to_pylist(),
+            product_id.indices.to_numpy(zero_copy_only=False),
+            table["quantity"].to_numpy(),
+            table["price"].to_numpy(),
+            table["timestamp_ms"].to_numpy(),
+        )
+
+    @classmethod
+    def concat(cls, batches: Iterable["TradeBatch"]) -> "TradeBatch":
+        """
+        Concatenates several batches into one, in the given order.
+        """
+        batches = list(batches)
+        if not batches:
+            return cls.empty()
+        if len(batches) == 1:
+            return batches[0]
+
+        # the batches may list their products in a different order, so we map the
+        # product codes of each batch to the codes of the concatenated batch
+        codes: dict = {}
+        product_codes = []
+        for batch in batches:
+            mapping = np.array(
+                [codes.setdefault(p, len(codes)) for p in batch.product_ids],
+                dtype=np.int32,
+            )
+            product_codes.append(mapping[batch.product_code])
+
+        return cls(
+            list(codes),
+            np.concatenate(product_codes),
+            np.concatenate([batch.quantity for batch in batches]),
+            np.concatenate([batch.price for batch in batches]),
+            np.concatenate([batch.timestamp_ms for batch in batches]),
+        )
+
+    def filter(self, mask: np.ndarray) -> "TradeBatch":
+        """
+        Returns the trades for which `mask` is True.
+        """
+        return TradeBatch(
+            self.product_ids,
+            self.product_code[mask],
+            self.quantity[mask],
+            self.price[mask],
+            self.timestamp_ms[mask],
+        )
+
+    def slice(self, start: int, stop: int) -> "TradeBatch":
+        """
+        Returns the trades from `start` to `stop`, without copying them.
+        """
+        return TradeBatch(
+            self.product_ids,
+            self.product_code[start:stop],
+            self.quantity[start:stop],
+            self.price[start:stop],
+            self.timestamp_ms[start:stop],
+        )
+
+    def product_id_array(self) -> pa.Array:
+        """
+        Returns the product ID of each trade, as a pyarrow string array.
+        """
+        return pc.take(
+            pa.array(self.product_ids, type=pa.string()), pa.array(self.product_code)
+        )
+
+    def to_table(self) -> pa.Table:
+        """
+        Returns the batch as a pyarrow Table with the TRADE_SCHEMA. The numeric
+        columns are not copied.
+        """
+        return pa.Table.from_arrays(
+            [
+                self.product_id_array(),
+                pa.array(self.quantity),
+                pa.array(self.price),
+                pa.array(self.timestamp_ms),
+            ],
+            schema=TRADE_SCHEMA,
+        )
+
+    def to_trades(self) -> List[Trade]:
+        return list(self)
+
+    def __len__(self) -> int:
+        return len(self.timestamp_ms)
+
+    def __iter__(self) -> Iterator[Trade]:
+        product_ids = self.product_ids
+        # `tolist` converts the whole column to Python numbers at once, which is a
+        # lot faster than reading the numpy arrays one element at a time
+        for code, quantity, price, timestamp_ms in zip(
+            self.product_code.tolist(),
+            self.quantity.tolist(),
+            self.price.tolist(),
+            self.timestamp_ms.tolist(),
+        ):
+            yield Trade(product_ids[code], quantity, price, timestamp_ms)
+
+    def __getitem__(self, i: int) -> Trade:
+        return Trade(
+            self.product_ids[self.product_code[i]],
+            float(self.quantity[i]),
+            float(self.price[i]),
+            int(self.timestamp_ms[i]),
+        )
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, (TradeBatch, list)):
+            return self.to_trades() == list(other)
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return f"TradeBatch({len(self)} trades, product_ids={self.product_ids})"
+
@@ -0,0 +1,409 @@
+import json
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from loguru import logger
+
+from src.trade_data_source.trade import TRADE_SCHEMA, Trade, TradeBatch
+
+DAY_MS = 24 * 60 * 60 * 1000
+
+
+class TradeCache:
+    """
+    A local cache of historical trades, partitioned by product and UTC day.
+
+    The cache directory looks like this:
+
+        cache_dir/
+            BTC-USD/
+                index.json          <- the time ranges we have fully downloaded
+                2024-10-01.parquet  <- all the trades of that day we have
+                2024-10-02.parquet
+                ...
+
+    `index.json` holds a sorted list of non-overlapping, inclusive [from_ms, to_ms]
+    ranges. A range is only added once every trade in it is stored, so any
+    sub-range of it can be served from disk without calling the Kraken API, no
+    matter which `since` values were used to download it.
+
+    Old partitions are evicted when the cache grows above `max_size_bytes`, or when
+    they have not been used for more than `max_age_days`. Evicting a partition also
+    removes its day from the covered ranges.
+
+    Every `write` rewrites the partitions it touches, so the sources that download
+    many small pages write them through a `TradeCacheWriter`, one whole day at a
+    time.
+    """
+
+    INDEX_FILE = "index.json"
+    SCHEMA = TRADE_SCHEMA
+
+    # One lock per product directory, shared by all the TradeCache instances, so
+    # the shards of the same product don't overwrite each other's partitions
+    _locks: Dict[Path, threading.Lock] = {}
+    _locks_lock = threading.Lock()
+
+    def __init__(
+        self,
+        cache_dir: str,
+        max_size_bytes: Optional[int] = None,
+        max_age_days: Optional[float] = None,
+        evict_every_n_writes: int = 50,
+    ) -> None:
+        """
+        Args:
+            cache_dir (str): The directory where the trades are stored.
+            max_size_bytes (Optional[int]): The maximum size of the cache on disk.
+                The least recently used partitions are evicted above this size.
+            max_age_days (Optional[float]): Partitions not used for longer than this
+                are evicted.
+            evict_every_n_writes (int): How often we check if we need to evict.
+
+        Returns:
+            None
+        """
+        self.cache_dir = Path(cache_dir)
+        self.max_size_bytes = max_size_bytes
+        self.max_age_days = max_age_days
+        self.evict_every_n_writes = evict_every_n_writes
+        self._n_writes = 0
+        # the parsed index of each product directory, with the (inode, mtime) of
+        # the file it was read from, so we only parse it again once it changed
+        self._indexes: Dict[Path, Tuple[Tuple[int, int], List[Tuple[int, int]]]] = {}
+
+        if not self.cache_dir.exists():
+            # create the cache directory if it does not exist
+            self.cache_dir.mkdir(parents=True)
+
+        self.evict()
+
+    def covered_until(self, product_id: str, timestamp_ms: int) -> Optional[int]:
+        """
+        Returns the end of the covered range that contains `timestamp_ms`, or None if
+        `timestamp_ms` is not covered, i.e. we need to call the API to get it.
+        """
+        with self._lock(product_id):
+            for from_ms, to_ms in self._read_index(product_id):
+                if from_ms <= timestamp_ms <= to_ms:
+                    return to_ms
+        return None
+
+    def read(self, product_id: str, from_ms: int, to_ms: int) -> List[Trade]:
+        """
+        Returns the cached trades for the given product in the inclusive range
+        [from_ms, to_ms], sorted by timestamp.
+        """
+        return self.read_batch(product_id, from_ms, to_ms).to_trades()
+
+    def read_batch(self, product_id: str, from_ms: int, to_ms: int) -> TradeBatch:
+        """
+        Same as `read`, but returns the trades as a TradeBatch.
+        """
+        return TradeBatch.from_table(self.read_table(product_id, from_ms, to_ms))
+
+    def read_table(self, product_id: str, from_ms: int, to_ms: int) -> pa.Table:
+        """
+        Same as `read`, but returns the trades as a pyarrow Table, without creating
+        a Python object per trade.
+        """
+        tables = []
+        with self._lock(product_id):
+            for day_ms in range(_day_start(from_ms), to_ms + 1, DAY_MS):
+                file_path = self._get_file_path(product_id, day_ms)
+                if not file_path.exists():
+                    continue
+
+                table = pq.read_table(file_path)
+                mask = pc.and_(
+                    pc.greater_equal(table["timestamp_ms"], from_ms),
+                    pc.less_equal(table["timestamp_ms"], to_ms),
+                )
+                tables.append(table.filter(mask))
+
+                # mark the partition as recently used, for the eviction policy
+                os.utime(file_path)
+
+        if not tables:
+            return self.SCHEMA.empty_table()
+        return pa.concat_tables(tables)
+
+    def write(
+        self,
+        product_id: str,
+        trades: Union[List[Trade], TradeBatch],
+        from_ms: int,
+        to_ms: int,
+    ) -> None:
+        """
+        Stores the given trades, and marks the inclusive range [from_ms, to_ms] as
+        covered. `trades` must hold every trade of the product in that range.
+
+        Any trade we already had in that range is replaced, so writing overlapping
+        ranges does not create duplicates.
+        """
+        table = TradeBatch.from_trades(trades).to_table()
+
+        with self._lock(product_id):
+            for day_ms in range(_day_start(from_ms), to_ms + 1, DAY_MS):
+                day_mask = pc.and_(
+                    pc.greater_equal(table["timestamp_ms"], max(from_ms, day_ms)),
+                    pc.less_equal(table["timestamp_ms"], min(to_ms, day_ms + DAY_MS - 1)),
+                )
+                self._write_partition(
+                    product_id, day_ms, table.filter(day_mask), from_ms, to_ms
+                )
+
+            covered = self._read_index(product_id)
+            self._write_index(product_id, _add_range(covered, (from_ms, to_ms)))
+
+        self._n_writes += 1
+        if self._n_writes % self.evict_every_n_writes == 0:
+            self.evict()
+
+    def _write_partition(
+        self,
+        product_id: str,
+        day_ms: int,
+        new_trades: pa.Table,
+        from_ms: int,
+        to_ms: int,
+    ) -> None:
+        """
+        Merges `new_trades` into the partition of the given day, replacing the trades
+        in [from_ms, to_ms] we already had.
+        """
+        file_path = self._get_file_path(product_id, day_ms)
+        if file_path.exists():
+            old_trades = pq.read_table(file_path)
+            keep_mask = pc.or_(
+                pc.less(old_trades["timestamp_ms"], from_ms),
+                pc.greater(old_trades["timestamp_ms"], to_ms),
+            )
+            new_trades = pa.concat_tables([old_trades.filter(keep_mask), new_trades])
+        elif new_trades.num_rows == 0:
+            return
+
+        # the sort is stable, so trades within the same millisecond keep their order
+        new_trades = new_trades.sort_by("timestamp_ms")
+
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = file_path.with_suffix(".tmp")
+        pq.write_table(new_trades, tmp_path)
+        os.replace(tmp_path, file_path)
+
+    def evict(self) -> None:
+        """
+        Deletes the partitions that are too old, and then the least recently used
+        ones until the cache fits in `max_size_bytes`.
+        """
+        if self.max_size_bytes is None and self.max_age_days is None:
+            return
+
+        # (last used time, size, product directory, file path)
+        partitions: List[Tuple[float, int, Path, Path]] = []
+        for file_path in self.cache_dir.glob("*/*.parquet"):
+            stat = file_path.stat()
+            partitions.append((stat.st_mtime, stat.st_size, file_path.parent, file_path))
+        partitions.sort()
+
+        total_size = sum(size for _, size, _, _ in partitions)
+        now = time.time()
+        for last_used, size, product_dir, file_path in partitions:
+            too_old = (
+                self.max_age_days is not None
+                and now - last_used > self.max_age_days * 24 * 60 * 60
+            )
+            too_big = self.max_size_bytes is not None and total_size > self.max_size_bytes
+            if not (too_old or too_big):
+                continue
+
+            self._evict_partition(product_dir, file_path)
+            total_size -= size
+
+    def _evict_partition(self, product_dir: Path, file_path: Path) -> None:
+        """
+        Deletes one partition, and removes its day from the covered ranges.
+        """
+        day_ms = _date_to_ms(file_path.stem)
+        with self._dir_lock(product_dir):
+            covered = self._read_index_file(product_dir / self.INDEX_FILE)
+            covered = _remove_range(covered, (day_ms, day_ms + DAY_MS - 1))
+            self._write_index_file(product_dir / self.INDEX_FILE, covered)
+            file_path.unlink(missing_ok=True)
+
+        logger.debug(f"Evicted {file_path} from the trade cache")
+
+    def _read_index(self, product_id: str) -> List[Tuple[int, int]]:
+        return self._read_index_file(self._get_product_dir(product_id) / self.INDEX_FILE)
+
+    def _write_index(self, product_id: str, covered: List[Tuple[int, int]]) -> None:
+        product_dir = self._get_product_dir(product_id)
+        product_dir.mkdir(parents=True, exist_ok=True)
+        self._write_index_file(product_dir / self.INDEX_FILE, covered)
+
+    def _read_index_file(self, index_path: Path) -> List[Tuple[int, int]]:
+        try:
+            stat = index_path.stat()
+        except FileNotFoundError:
+            return []
+
+        # the index is replaced, never written in place, so another instance (or
+        # an eviction) that changed it also changed its inode
+        version = (stat.st_ino, stat.st_mtime_ns)
+        cached = self._indexes.get(index_path)
+        if cached is not None and cached[0] == version:
+            return list(cached[1])
+
+        with open(index_path) as f:
+            covered = [tuple(r) for r in json.load(f)["covered"]]
+        self._indexes[index_path] = (version, covered)
+        return list(covered)
+
+    @staticmethod
+    def _write_index_file(index_path: Path, covered: List[Tuple[int, int]]) -> None:
+        # write to a temporary file first, so a crash never leaves a broken index
+        tmp_path = index_path.with_suffix(".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump({"covered": covered}, f)
+        os.replace(tmp_path, index_path)
+
+    def _get_product_dir(self, product_id: str) -> Path:
+        return self.cache_dir / product_id.replace("/", "-")
+
+    def _get_file_path(self, product_id: str, day_ms: int) -> Path:
+        """
+        Returns the file path where the trades of the given product and UTC day are
+        (or will be) stored.
+        """
+        return self._get_product_dir(product_id) / f"{_ms_to_date(day_ms)}.parquet"
+
+    def _lock(self, product_id: str) -> threading.Lock:
+        return self._dir_lock(self._get_product_dir(product_id))
+
+    @classmethod
+    def _dir_lock(cls, product_dir: Path) -> threading.Lock:
+        key = product_dir.resolve()
+        with cls._locks_lock:
+            if key not in cls._locks:
+                cls._locks[key] = threading.Lock()
+            return cls._locks[key]
+
+
+class TradeCacheWriter:
+    """
+    Writes a stream of pages of trades of one product to the cache, one whole UTC
+    day at a time.
+
+    `TradeCache.write` reads, merges and rewrites the partition of every day it
+    touches, so writing each page of ~1000 trades as it comes would rewrite the
+    partition of a busy day hundreds of times. The writer keeps the pages of the
+    current day in memory instead, and writes them all at once when a page reaches
+    the next day, or on `flush`.
+
+    The pages must be contiguous: each one holds every trade of the product in its
+    range, and starts right after the previous one. A page that does not is written
+    after flushing the previous ones.
+    """
+
+    def __init__(self, cache: TradeCache, product_id: str) -> None:
+        self.cache = cache
+        self.product_id = product_id
+        # the pages of the range [self._from_ms, self._to_ms] not written yet
+        self._pages: List[TradeBatch] = []
+        self._from_ms: Optional[int] = None
+        self._to_ms: Optional[int] = None
+
+    def add(self, trades: TradeBatch, from_ms: int, to_ms: int) -> None:
+        """
+        Adds a page that holds every trade of the product in the inclusive range
+        [from_ms, to_ms], and writes the days it completes.
+        """
+        if self._to_ms is not None and from_ms != self._to_ms + 1:
+            self.flush()
+        if self._from_ms is None:
+            self._from_ms = from_ms
+        self._pages.append(trades)
+        self._to_ms = to_ms
+
+        # the days before the one that contains the end of the page are complete
+        day_end_ms = _day_start(to_ms + 1) - 1
+        if day_end_ms >= self._from_ms:
+            pending = TradeBatch.concat(self._pages)
+            is_complete = pending.timestamp_ms <= day_end_ms
+            self.cache.write(
+                self.product_id, pending.filter(is_complete), self._from_ms, day_end_ms
+            )
+            self._pages = [pending.filter(~is_complete)]
+            self._from_ms = day_end_ms + 1
+            if self._from_ms > self._to_ms:
+                self._pages, self._from_ms, self._to_ms = [], None, None
+
+    def flush(self) -> None:
+        """
+        Writes the pages not written yet, e.g. the last ones, which do not end a day.
+        """
+        if self._from_ms is not None:
+            self.cache.write(
+                self.product_id,
+                TradeBatch.concat(self._pages),
+                self._from_ms,
+                self._to_ms,
+            )
+        self._pages, self._from_ms, self._to_ms = [], None, None
+
+
+def _day_start(timestamp_ms: int) -> int:
+    return timestamp_ms - timestamp_ms % DAY_MS
+
+
+def _ms_to_date(timestamp_ms: int) -> str:
+    return datetime.fromtimestamp(timestamp_ms / 1000, tz=timezone.utc).strftime(
+        "%Y-%m-%d"
+    )
+
+
+def _date_to_ms(date: str) -> int:
+    day = datetime.strptime(date, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+    return int(day.timestamp() * 1000)
+
+
+def _add_range(
+    ranges: List[Tuple[int, int]], new_range: Tuple[int, int]
+) -> List[Tuple[int, int]]:
+    """
+    Adds an inclusive range to a sorted list of non-overlapping inclusive ranges,
+    merging the ranges that overlap or touch.
+    """
+    merged: List[Tuple[int, int]] = []
+    for from_ms, to_ms in sorted(ranges + [new_range]):
+        if merged and from_ms <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], to_ms))
+        else:
+            merged.append((from_ms, to_ms))
+    return merged
+
+
+def _remove_range(
+    ranges: List[Tuple[int, int]], removed: Tuple[int, int]
+) -> List[Tuple[int, int]]:
+    """
+    Removes an inclusive range from a sorted list of non-overlapping inclusive ranges.
+    """
+    result: List[Tuple[int, int]] = []
+    for from_ms, to_ms in ranges:
+        if to_ms < removed[0] or from_ms > removed[1]:
+            result.append((from_ms, to_ms))
+            continue
+        if from_ms < removed[0]:
+            result.append((from_ms, removed[0] - 1))
+        if to_ms > removed[1]:
+            result.append((removed[1] + 1, to_ms))
+    return result
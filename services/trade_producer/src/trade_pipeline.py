@@ -0,0 +1,307 @@
+import threading
+import time
+from queue import Empty, Full, Queue
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from confluent_kafka import KafkaError, Message
+from loguru import logger
+from quixstreams.kafka import Producer
+
+from src.checkpoints import CheckpointTracker, PendingCheckpoint
+from src.metrics import REGISTRY
+from src.trade_data_source import TradeBatch, TradeSource
+from src.trade_serializer import serialize_trade_batch
+
+# librdkafka settings for a high-throughput producer. Waiting a few milliseconds
+# lets it pack many trades into each request, and compressing those big batches
+# cuts the bytes sent to the broker a lot, since trades are very repetitive.
+DEFAULT_PRODUCER_CONFIG = {
+    "linger.ms": 20,
+    "batch.size": 1_000_000,
+    "compression.type": "lz4",
+}
+
+
+class DeliveryReport:
+    """
+    Counts the messages we produced, and the ones Kafka confirmed or rejected,
+    through the delivery callback of each message.
+
+    The callbacks are called by `producer.poll`, always from the thread that
+    produces, so no lock is needed.
+    """
+
+    def __init__(self) -> None:
+        self.n_produced = 0
+        self.n_delivered = 0
+        self.n_failed = 0
+        # how many times the librdkafka buffer was full, and we had to wait
+        self.n_buffer_full = 0
+        self.last_error: Optional[KafkaError] = None
+
+    def on_delivery(self, error: Optional[KafkaError], message: Message) -> None:
+        if error is None:
+            self.n_delivered += 1
+        else:
+            self.n_failed += 1
+            self.last_error = error
+
+    @property
+    def n_in_flight(self) -> int:
+        return self.n_produced - self.n_delivered - self.n_failed
+
+    def __repr__(self) -> str:
+        return (
+            f"DeliveryReport(produced={self.n_produced}, delivered={self.n_delivered}, "
+            f"failed={self.n_failed}, in_flight={self.n_in_flight}, "
+            f"buffer_full={self.n_buffer_full})"
+        )
+
+
+class TradeReader(threading.Thread):
+    """
+    The first stage of the pipeline: reads the trades from the source, and puts
+    them in a bounded queue for the producer stage, each batch with the checkpoint
+    of the source right after it.
+
+    When the queue is full, because Kafka is slow, the reader blocks and stops
+    reading from the source, which lets the source apply its own backpressure
+    (e.g. the websocket readers stop reading their sockets).
+    """
+
+    # Marks the end of the trades in the queue
+    DONE = None
+
+    def __init__(self, trade_data_source: TradeSource, batches: Queue) -> None:
+        super().__init__(name="trade_reader", daemon=True)
+        self.trade_data_source = trade_data_source
+        self.batches = batches
+        self.error: Optional[BaseException] = None
+        self._stop_event = threading.Event()
+
+    def run(self) -> None:
+        last_checkpoint = self.trade_data_source.checkpoint()
+        try:
+            while not self.trade_data_source.is_done():
+                if self._stop_event.is_set():
+                    break
+                trades = self.trade_data_source.get_trades()
+                checkpoint = self.trade_data_source.checkpoint()
+                # an empty batch can still move the checkpoint forward, e.g. a day
+                # without trades
+                if len(trades) > 0 or checkpoint != last_checkpoint:
+                    self._put((TradeBatch.from_trades(trades), checkpoint))
+                    last_checkpoint = checkpoint
+        except BaseException as e:
+            self.error = e
+        finally:
+            self.trade_data_source.close()
+            self._put(self.DONE)
+
+    def stop(self) -> None:
+        self._stop_event.set()
+
+    def _put(self, batch: Optional[Tuple[TradeBatch, Optional[dict]]]) -> None:
+        # we wait with a timeout, so we notice if the producer stage stopped
+        # consuming the queue
+        while True:
+            try:
+                self.batches.put(batch, timeout=1.0)
+                return
+            except Full:
+                if self._stop_event.is_set():
+                    return
+
+
+def product_partitions(
+    product_ids: List[str],
+    num_partitions: int,
+    current: Optional[Dict[str, int]] = None,
+) -> Dict[str, int]:
+    """
+    Returns the partition of the messages of each product, by message key.
+
+    The products already in the topic keep their partition, since moving one
+    splits its windows in progress in the consumers and resets its state there.
+    The others go to the partitions with the fewest products, in the order of
+    the config, so with one partition per product each product gets its own.
+    Hashing the keys, like the default partitioner does, often puts two products
+    in the same partition and leaves another one empty, and then the consumer of
+    that partition does twice the work.
+
+    Args:
+        product_ids: The product IDs, e.g. ["BTC/USD", "ETH/USD"].
+        num_partitions: The number of partitions of the topic.
+        current: The partition of the message keys already in the topic (see
+            `main.current_product_partitions`).
+
+    Returns:
+        Dict[str, int]: The partition of each message key, e.g. "BTC-USD".
+    """
+    keys = [product_id.replace("/", "-") for product_id in product_ids]
+    current = current or {}
+    partitions = {
+        key: current[key]
+        for key in keys
+        if key in current and current[key] < num_partitions
+    }
+
+    n_products = [0] * num_partitions
+    for partition in partitions.values():
+        n_products[partition] += 1
+    for key in keys:
+        if key not in partitions:
+            partition = n_products.index(min(n_products))
+            partitions[key] = partition
+            n_products[partition] += 1
+
+    return {key: partitions[key] for key in keys}
+
+
+def produce_batches(
+    producer: Producer,
+    topic_name: str,
+    batches: Queue,
+    report: DeliveryReport,
+    wire_format: str = "json",
+    checkpoints: Optional[CheckpointTracker] = None,
+    partitions: Optional[Dict[str, int]] = None,
+    buffer_full_poll_sec: float = 0.1,
+    report_interval_sec: float = 60.0,
+) -> None:
+    """
+    The second stage of the pipeline: takes the batches of trades from the queue,
+    and produces them to Kafka until it gets `TradeReader.DONE`.
+
+    Args:
+        producer: The Kafka producer.
+        topic_name: The name of the Kafka topic to save the trades.
+        batches: The queue filled by the TradeReader.
+        report: Where we count the produced and delivered messages.
+        wire_format: The format of the messages, "json", "binary" or "batch".
+        checkpoints: Where we save the checkpoint of each batch, once Kafka has
+            delivered it.
+        partitions: The partition of each message key, see `product_partitions`.
+            The keys that are not in it are hashed by the default partitioner.
+        buffer_full_poll_sec: How long we wait for deliveries when the librdkafka
+            buffer is full.
+        report_interval_sec: How often we log the delivery report.
+
+    Returns:
+        None
+    """
+    last_report = time.monotonic()
+
+    # exported on the metrics endpoint, if enabled. The counters of the report are
+    # read on every scrape, so we don't count twice
+    trades_produced = REGISTRY.counter(
+        "trade_producer_trades_produced_total",
+        "Trades sent to the Kafka producer",
+        ["product_id"],
+    )
+    for name, help, read in [
+        ("messages_produced", "Messages sent to the Kafka producer", "n_produced"),
+        ("messages_delivered", "Messages confirmed by Kafka", "n_delivered"),
+        ("messages_failed", "Messages Kafka could not deliver", "n_failed"),
+        ("buffer_full", "Times the librdkafka buffer was full", "n_buffer_full"),
+    ]:
+        REGISTRY.counter(f"trade_producer_{name}_total", help).set_function(
+            lambda read=read: getattr(report, read)
+        )
+    REGISTRY.gauge(
+        "trade_producer_messages_in_flight", "Messages not confirmed by Kafka yet"
+    ).set_function(lambda: report.n_in_flight)
+    REGISTRY.gauge(
+        "trade_producer_pipeline_queue_size",
+        "Batches of trades waiting between the reader and the producer",
+    ).set_function(batches.qsize)
+
+    while True:
+        try:
+            batch = batches.get(timeout=1.0)
+        except Empty:
+            # nothing to produce, but we still serve the delivery callbacks
+            producer.poll(0)
+            continue
+
+        if batch is TradeReader.DONE:
+            break
+        batch, checkpoint = batch
+
+        if REGISTRY.enabled and len(batch) > 0:
+            counts = np.bincount(batch.product_code, minlength=len(batch.product_ids))
+            for product_id, count in zip(batch.product_ids, counts):
+                trades_produced.labels(product_id).inc(int(count))
+
+        # Serialize the whole batch at once, column by column
+        keys, values = serialize_trade_batch(batch, wire_format)
+
+        on_delivery = report.on_delivery
+        if checkpoints is not None and checkpoint is not None:
+            # the checkpoint is saved once all the messages of the batch are delivered
+            pending = checkpoints.add(checkpoint, n_messages=len(values))
+            on_delivery = _on_delivery_with_checkpoint(report, pending)
+
+        for key, value in zip(keys, values):
+            _produce(
+                producer,
+                topic_name,
+                key,
+                value,
+                partitions.get(key) if partitions else None,
+                on_delivery,
+                report,
+                buffer_full_poll_sec,
+            )
+
+        if checkpoints is not None:
+            checkpoints.commit()
+
+        if time.monotonic() - last_report > report_interval_sec:
+            logger.info(f"Kafka {report}")
+            last_report = time.monotonic()
+
+
+def _on_delivery_with_checkpoint(
+    report: DeliveryReport, pending: PendingCheckpoint
+) -> Callable[[Optional[KafkaError], Message], None]:
+    def on_delivery(error: Optional[KafkaError], message: Message) -> None:
+        report.on_delivery(error, message)
+        pending.on_delivery(error, message)
+
+    return on_delivery
+
+
+def _produce(
+    producer: Producer,
+    topic_name: str,
+    key: str,
+    value: bytes,
+    partition: Optional[int],
+    on_delivery: Callable[[Optional[KafkaError], Message], None],
+    report: DeliveryReport,
+    buffer_full_poll_sec: float,
+) -> None:
+    """
+    Produces one message. If the librdkafka buffer is full (e.g. the broker is slow
+    or unreachable for a while), we keep serving the delivery callbacks until there
+    is room again, instead of dropping the message or crashing.
+    """
+    while True:
+        try:
+            producer.produce(
+                topic=topic_name,
+                value=value,
+                key=key,
+                partition=partition,
+                on_delivery=on_delivery,
+                buffer_error_max_tries=0,
+            )
+            report.n_produced += 1
+            return
+        except BufferError:
+            report.n_buffer_full += 1
+            if report.n_buffer_full % 100 == 1:
+                logger.warning(f"Kafka producer buffer is full, waiting. {report}")
+            producer.poll(buffer_full_poll_sec)
@@ -0,0 +1,166 @@
+from typing import List, Tuple
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from src.json_columns import check_product_ids, float_to_json
+from src.trade_codec import (
+    HEADER,
+    WIRE_FORMAT_VERSION,
+    WIRE_FORMATS,
+    encode_trade_batch,
+)
+from src.trade_data_source.trade import TradeBatch
+
+# The maximum number of trades in a "batch" message. 10k trades take 240kB, well
+# below the 1MB default maximum message size of Kafka.
+MAX_TRADES_PER_MESSAGE = 10_000
+
+
+def serialize_trade_batch(
+    trades: TradeBatch, wire_format: str = "json"
+) -> Tuple[List[str], List[bytes]]:
+    """
+    Serializes a batch of trades into Kafka message keys and values, working on
+    whole columns at a time instead of creating a Trade and a dict per trade.
+
+    With the "json" wire format, the values are the same JSON documents, byte for
+    byte, `topic.serialize(value=trade.model_dump())` produces, e.g.
+    {"product_id":"BTC/USD","quantity":0.1,"price":100.0,...}, so the consumers can
+    keep reading the topic with the "json" deserializer.
+
+    With the "binary" wire format, the values are the same messages
+    `src.trade_codec.encode_trade` produces.
+
+    With the "batch" wire format, there is one message per product, or more if it
+    has more than MAX_TRADES_PER_MESSAGE trades, encoded with
+    `src.trade_codec.encode_trade_batch`.
+
+    Args:
+        trades (TradeBatch): The trades to serialize.
+        wire_format (str): "json", "binary" or "batch".
+
+    Returns:
+        Tuple[List[str], List[bytes]]: The message keys (the product IDs, with "/"
+            replaced by "-") and the message values.
+    """
+    if wire_format not in WIRE_FORMATS:
+        raise ValueError(f"Invalid wire format: {wire_format}")
+
+    # one key per product, shared by all the messages of that product
+    product_keys = [product_id.replace("/", "-") for product_id in trades.product_ids]
+
+    if wire_format == "batch":
+        return _batch_messages(trades, product_keys)
+
+    keys = [product_keys[code] for code in trades.product_code.tolist()]
+
+    if wire_format == "binary":
+        return keys, _binary_values(trades)
+
+    check_product_ids(trades.product_ids)
+
+    # wrapping the numpy arrays in pyarrow arrays does not copy them
+    values = pc.binary_join_element_wise(
+        '{"product_id":"',
+        trades.product_id_array(),
+        '","quantity":',
+        float_to_json(pa.array(trades.quantity)),
+        ',"price":',
+        float_to_json(pa.array(trades.price)),
+        ',"timestamp_ms":',
+        pc.cast(pa.array(trades.timestamp_ms), pa.string()),
+        "}",
+        # separator
+        "",
+    )
+
+    return keys, pc.cast(values, pa.binary()).to_pylist()
+
+
+def _batch_messages(
+    trades: TradeBatch, product_keys: List[str]
+) -> Tuple[List[str], List[bytes]]:
+    """
+    Encodes the trades of each product into "batch" messages, keeping the order of
+    the trades of each product.
+    """
+    keys: List[str] = []
+    values: List[bytes] = []
+
+    for code, product_id in enumerate(trades.product_ids):
+        if len(trades.product_ids) == 1:
+            product_trades = trades
+        else:
+            product_trades = trades.filter(trades.product_code == code)
+
+        for start in range(0, len(product_trades), MAX_TRADES_PER_MESSAGE):
+            end = start + MAX_TRADES_PER_MESSAGE
+            keys.append(product_keys[code])
+            values.append(
+                encode_trade_batch(
+                    product_id,
+                    product_trades.timestamp_ms[start:end],
+                    product_trades.price[start:end],
+                    product_trades.quantity[start:end],
+                )
+            )
+
+    return keys, values
+
+
+def _binary_values(trades: TradeBatch) -> List[bytes]:
+    """
+    Encodes the trades in the binary wire format.
+
+    All the trades of a product have the same length, so we write them into a numpy
+    record array with the layout of `trade_codec.HEADER` plus the product ID, and
+    slice the raw buffer into one message per trade.
+    """
+    values: List[bytes] = [b""] * len(trades)
+
+    for code, product_id in enumerate(trades.product_ids):
+        product_bytes = product_id.encode()
+        if len(product_bytes) > 255:
+            raise ValueError(f"Product ID is too long: {product_id}")
+
+        if len(trades.product_ids) == 1:
+            index = None
+        else:
+            index = np.flatnonzero(trades.product_code == code)
+            if len(index) == 0:
+                continue
+
+        records = np.empty(
+            len(trades) if index is None else len(index),
+            dtype=np.dtype(
+                [
+                    ("version", "u1"),
+                    ("timestamp_ms", "<i8"),
+                    ("price", "<f8"),
+                    ("quantity", "<f8"),
+                    ("product_len", "u1"),
+                    ("product_id", f"S{len(product_bytes)}"),
+                ]
+            ),
+        )
+        assert records.itemsize == HEADER.size + len(product_bytes)
+
+        records["version"] = WIRE_FORMAT_VERSION
+        records["product_len"] = len(product_bytes)
+        records["product_id"] = product_bytes
+        for field in ("timestamp_ms", "price", "quantity"):
+            column = getattr(trades, field)
+            records[field] = column if index is None else column[index]
+
+        buffer = records.tobytes()
+        size = records.itemsize
+        messages = [buffer[i : i + size] for i in range(0, len(buffer), size)]
+
+        if index is None:
+            return messages
+        for i, message in zip(index.tolist(), messages):
+            values[i] = message
+
+    return values
@@ -0,0 +1,79 @@
+import zipfile
+
+import pytest
+
+from src.trade_data_source.kraken_csv_dump import KrakenCSVDump
+from src.trade_data_source.trade import Trade
+from src.trade_data_source.trade_cache import DAY_MS, TradeCache
+
+# 2024-10-01 00:00:00 UTC
+DAY_1 = 1727740800000
+HOUR_MS = 60 * 60 * 1000
+
+
+def _write_dump(path, n_trades: int, step_ms: int) -> list[Trade]:
+    trades = [
+        Trade("BTC/USD", 0.5 + i, 60000.0 + i, DAY_1 + i * step_ms)
+        for i in range(n_trades)
+    ]
+    with open(path, "w") as f:
+        for trade in trades:
+            f.write(
+                f"{trade.timestamp_ms / 1000},{trade.price:.5f},{trade.quantity:.8f}\n"
+            )
+    return trades
+
+
+def _read_all(source: KrakenCSVDump) -> list[Trade]:
+    trades = []
+    while not source.is_done():
+        trades.extend(source.get_trades())
+    return trades
+
+
+def test_csv_dump_reads_the_file_of_each_product_in_blocks(tmp_path):
+    trades = _write_dump(tmp_path / "XBTUSD.csv", n_trades=100, step_ms=1500)
+
+    source = KrakenCSVDump(str(tmp_path), ["BTC/USD"], block_size_bytes=256)
+
+    assert _read_all(source) == trades
+
+
+def test_csv_dump_reads_zip_archives_and_filters_by_time(tmp_path):
+    trades = _write_dump(tmp_path / "XBTUSD.csv", n_trades=100, step_ms=HOUR_MS)
+    with zipfile.ZipFile(tmp_path / "dump.zip", "w") as archive:
+        archive.write(tmp_path / "XBTUSD.csv", "TimeAndSales_Combined/XBTUSD.csv")
+    from_ms, to_ms = DAY_1 + 10 * HOUR_MS, DAY_1 + 20 * HOUR_MS
+
+    source = KrakenCSVDump(
+        str(tmp_path / "dump.zip"),
+        ["BTC/USD"],
+        from_ms=from_ms,
+        to_ms=to_ms,
+        block_size_bytes=256,
+    )
+
+    assert _read_all(source) == [
+        t for t in trades if from_ms <= t.timestamp_ms <= to_ms
+    ]
+
+
+def test_csv_dump_fills_the_trade_cache(tmp_path):
+    trades = _write_dump(tmp_path / "XBTUSD.csv", n_trades=100, step_ms=HOUR_MS)
+    cache = TradeCache(str(tmp_path / "cache"))
+    last_ms = trades[-1].timestamp_ms
+
+    _read_all(
+        KrakenCSVDump(str(tmp_path), ["BTC/USD"], cache=cache, block_size_bytes=256)
+    )
+
+    assert cache.covered_until("BTC/USD", DAY_1) == last_ms
+    assert cache.covered_until("BTC/USD", last_ms + 1) is None
+    assert cache.read("BTC/USD", DAY_1, DAY_1 + 5 * DAY_MS) == trades
+
+
+def test_csv_dump_fails_early_when_a_product_has_no_file(tmp_path):
+    _write_dump(tmp_path / "XBTUSD.csv", n_trades=1, step_ms=1)
+
+    with pytest.raises(ValueError):
+        KrakenCSVDump(str(tmp_path), ["BTC/USD", "ETH/USD"])
@@ -0,0 +1,226 @@
+import time
+
+import pytest
+import requests
+
+from src.trade_data_source.kraken_rest_api import (
+    KrakenRestAPI,
+    KrakenRestAPIShardedProduct,
+    KrakenRestAPISingleProduct,
+)
+from src.trade_data_source.kraken_rest_client import (
+    KrakenRestAPIError,
+    KrakenRestClient,
+)
+from src.trade_data_source.rate_limiter import RateLimiter
+from src.trade_data_source.trade_cache import TradeCache
+
+PRODUCT_ID = "BTC/USD"
+PAGE_SIZE = 7
+
+
+class FakeResponse:
+    def __init__(self, data: dict, status_code: int = 200):
+        self.data = data
+        self.status_code = status_code
+
+    def json(self) -> dict:
+        return self.data
+
+    def raise_for_status(self) -> None:
+        pass
+
+
+def _fast_client() -> KrakenRestClient:
+    return KrakenRestClient(
+        rate_limiter=RateLimiter(rate=1000.0, capacity=1000), backoff_base_sec=0.001
+    )
+
+
+@pytest.fixture
+def fake_kraken(monkeypatch):
+    """
+    Replaces the Kraken REST API with a fake one that has one trade every 5 minutes,
+    and returns at most PAGE_SIZE trades per request.
+    """
+    from_ms, to_ms = KrakenRestAPISingleProduct._init_from_to_ms(last_n_days=1)
+    n_requests = []
+    all_trades = [
+        [str(100.0 + i), "0.1", (from_ms + i * 5 * 60 * 1000) / 1000]
+        for i in range((to_ms - from_ms) // (5 * 60 * 1000) + 12)
+    ]
+
+    def fake_get(self, url, params, **kwargs):
+        n_requests.append(params["since"])
+        trades = [t for t in all_trades if t[2] * 1e9 > params["since"]][:PAGE_SIZE]
+        return FakeResponse({"error": [], "result": {PRODUCT_ID: trades}})
+
+    monkeypatch.setattr(requests.Session, "get", fake_get)
+
+    expected_ts = [
+        int(t[2] * 1000) for t in all_trades if from_ms <= int(t[2] * 1000) <= to_ms
+    ]
+    return expected_ts, n_requests
+
+
+def _fetch_all(api) -> list:
+    trades = []
+    while not api.is_done():
+        trades.extend(api.get_trades())
+    return trades
+
+
+def test_split_range_is_disjoint_and_complete():
+    shards = KrakenRestAPIShardedProduct._split_range(0, 99, 3)
+
+    assert shards[0][0] == 0
+    assert shards[-1][1] == 99
+    for (_, prev_to_ms), (from_ms, _) in zip(shards, shards[1:]):
+        assert from_ms == prev_to_ms + 1
+
+
+def test_sharded_product_matches_single_product(fake_kraken):
+    client = _fast_client()
+
+    single = KrakenRestAPISingleProduct(PRODUCT_ID, 1, client=client)
+    sharded = KrakenRestAPIShardedProduct(PRODUCT_ID, 1, num_shards=4, client=client)
+
+    single_ts = [trade.timestamp_ms for trade in _fetch_all(single)]
+    sharded_ts = [trade.timestamp_ms for trade in _fetch_all(sharded)]
+
+    expected_ts, _ = fake_kraken
+    assert single_ts == expected_ts
+    assert sharded_ts == expected_ts
+
+
+def test_shards_buffer_a_bounded_number_of_pages(fake_kraken):
+    expected_ts, _ = fake_kraken
+    sharded = KrakenRestAPIShardedProduct(
+        PRODUCT_ID, 1, num_shards=4, client=_fast_client(), max_buffered_pages=2
+    )
+
+    first_page = sharded.get_trades()
+    # the later shards have time to fetch well ahead of the first one
+    time.sleep(0.2)
+    assert all(pages.qsize() <= 2 for pages in sharded._pages)
+    assert not any(future.done() for future in sharded._futures[1:])
+
+    # the other pages are all still there, in order
+    trades = list(first_page) + _fetch_all(sharded)
+    assert [trade.timestamp_ms for trade in trades] == expected_ts
+
+
+def test_closing_releases_the_blocked_shards(fake_kraken):
+    sharded = KrakenRestAPIShardedProduct(
+        PRODUCT_ID, 1, num_shards=4, client=_fast_client(), max_buffered_pages=1
+    )
+    sharded.get_trades()
+
+    sharded.close()
+
+    for future in sharded._futures:
+        future.result(timeout=5)
+
+
+def test_cached_rerun_does_not_call_the_api(fake_kraken, tmp_path):
+    expected_ts, n_requests = fake_kraken
+    cache = TradeCache(str(tmp_path))
+
+    first_run = KrakenRestAPISingleProduct(
+        PRODUCT_ID, 1, cache=cache, client=_fast_client()
+    )
+    assert [trade.timestamp_ms for trade in _fetch_all(first_run)] == expected_ts
+    n_requests.clear()
+
+    # a second run over an overlapping window is served from the cache
+    second_run = KrakenRestAPIShardedProduct(
+        PRODUCT_ID, 1, num_shards=3, cache=cache, client=_fast_client()
+    )
+    assert [trade.timestamp_ms for trade in _fetch_all(second_run)] == expected_ts
+    assert len(n_requests) == 0
+
+
+def test_client_retries_when_throttled(monkeypatch):
+    responses = [
+        FakeResponse({"error": ["EGeneral:Too many requests"]}),
+        FakeResponse({}, status_code=502),
+        FakeResponse({"error": [], "result": {PRODUCT_ID: [["100.0", "0.1", 1.0]]}}),
+    ]
+    monkeypatch.setattr(
+        requests.Session, "get", lambda self, url, **kwargs: responses.pop(0)
+    )
+    client = _fast_client()
+
+    trades = client.get_trades(PRODUCT_ID, since_ns=0)
+
+    assert trades == [["100.0", "0.1", 1.0]]
+    # we got throttled once, so the client slowed down
+    assert client.rate_limiter.rate < 1000.0
+
+
+class HTMLResponse(FakeResponse):
+    def json(self) -> dict:
+        raise requests.JSONDecodeError("Expecting value", "<html>", 0)
+
+
+def test_client_retries_responses_that_are_not_json(monkeypatch):
+    responses = [
+        HTMLResponse({}),
+        FakeResponse({"error": [], "result": {PRODUCT_ID: [["100.0", "0.1", 1.0]]}}),
+    ]
+    monkeypatch.setattr(
+        requests.Session, "get", lambda self, url, **kwargs: responses.pop(0)
+    )
+
+    assert _fast_client().get_trades(PRODUCT_ID, since_ns=0) == [["100.0", "0.1", 1.0]]
+
+
+def test_backfill_can_speed_up_above_the_start_rate():
+    api = KrakenRestAPI([PRODUCT_ID], last_n_days=1)
+
+    for _ in range(100):
+        api.rate_limiter.speed_up()
+
+    assert api.rate_limiter.rate == KrakenRestAPI.DEFAULT_MAX_REQUESTS_PER_SEC
+
+
+def test_client_raises_on_non_retriable_error(monkeypatch):
+    monkeypatch.setattr(
+        requests.Session,
+        "get",
+        lambda self, url, **kwargs: FakeResponse({"error": ["EQuery:Unknown asset pair"]}),
+    )
+
+    with pytest.raises(KrakenRestAPIError):
+        _fast_client().get_trades("FOO/BAR", since_ns=0)
+
+
+@pytest.mark.parametrize("num_shards", [1, 3])
+def test_backfill_resumes_from_a_checkpoint(fake_kraken, num_shards):
+    expected_ts, _ = fake_kraken
+
+    def make_api(checkpoint=None):
+        if num_shards == 1:
+            return KrakenRestAPISingleProduct(
+                PRODUCT_ID, last_n_days=1, client=_fast_client(), checkpoint=checkpoint
+            )
+        return KrakenRestAPIShardedProduct(
+            PRODUCT_ID,
+            last_n_days=1,
+            num_shards=num_shards,
+            client=_fast_client(),
+            checkpoint=checkpoint,
+        )
+
+    # the first run stops after a few pages
+    api = make_api()
+    first_run = []
+    for _ in range(5):
+        first_run.extend(api.get_trades())
+    checkpoint = api.checkpoint()[PRODUCT_ID]
+    api.close()
+
+    second_run = _fetch_all(make_api(checkpoint))
+
+    timestamps = [trade.timestamp_ms for trade in first_run + second_run]
+    assert timestamps == expected_ts
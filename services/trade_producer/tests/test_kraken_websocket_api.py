@@ -0,0 +1,238 @@
+import asyncio
+import json
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from websockets.asyncio.server import serve
+
+from src.trade_data_source.kraken_websocket_api import (
+    KrakenWebsocketAPI,
+    KrakenWebsocketAPIError,
+    to_ms,
+)
+from src.trade_data_source.trade import Trade
+
+
+def _reference_ms(timestamp: str) -> int:
+    date = datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
+    epoch = datetime(1970, 1, 1, tzinfo=timezone.utc)
+    return (date - epoch) // timedelta(milliseconds=1)
+
+
+@pytest.mark.parametrize(
+    "timestamp",
+    [
+        "2024-06-17T09:36:39.467866Z",
+        "2024-06-17T09:36:39.467Z",
+        "2024-06-17T09:36:39.4Z",
+        "2024-06-17T09:36:39Z",
+        "2024-12-31T23:59:59.999999Z",
+        "2024-06-17T11:36:39.467866+02:00",
+    ],
+)
+def test_to_ms_matches_datetime(timestamp):
+    assert to_ms(timestamp) == _reference_ms(timestamp)
+
+
+def test_parse_trades():
+    message = (
+        '{"channel":"trade","type":"update","data":[{"symbol":"BTC/USD",'
+        '"side":"sell","price":62345.1,"qty":0.0012,"ord_type":"market",'
+        '"trade_id":74350919,"timestamp":"2024-06-17T09:36:39.467866Z"}]}'
+    )
+
+    assert KrakenWebsocketAPI.parse_trades(message) == [
+        Trade(
+            product_id="BTC/USD",
+            quantity=0.0012,
+            price=62345.1,
+            timestamp_ms=1718616999467,
+        )
+    ]
+
+
+def test_parse_trades_ignores_other_channels():
+    message = '{"channel":"status","type":"update","data":[{"system":"online"}]}'
+
+    assert KrakenWebsocketAPI.parse_trades(message) == []
+
+
+class FakeKrakenServer:
+    """
+    A local stand-in for the Kraken websocket API, running in a background thread.
+
+    Every connection confirms the subscription, and sends the messages of the next
+    script in `scripts` (the last one is reused) for the products it subscribed to.
+    The first `n_drops` connections are dropped after that, the others stay open.
+    """
+
+    def __init__(
+        self,
+        scripts: list[list[dict]],
+        n_drops: int = 0,
+        reject_subscription: bool = False,
+    ):
+        self.scripts = scripts
+        self.n_drops = n_drops
+        self.reject_subscription = reject_subscription
+        self._started = threading.Event()
+        self._thread = threading.Thread(target=asyncio.run, args=(self._serve(),))
+        self._thread.daemon = True
+        self._thread.start()
+        self._started.wait(timeout=5)
+
+    async def _serve(self) -> None:
+        async with serve(self._handler, "localhost", 0) as server:
+            self.url = f"ws://localhost:{server.sockets[0].getsockname()[1]}"
+            self._started.set()
+            await asyncio.Future()
+
+    async def _handler(self, ws) -> None:
+        request = json.loads(await ws.recv())
+        for symbol in request["params"]["symbol"]:
+            await ws.send(
+                json.dumps(
+                    {
+                        "method": "subscribe",
+                        "result": {"channel": "trade", "symbol": symbol},
+                        "success": not self.reject_subscription,
+                    }
+                )
+            )
+
+        script = self.scripts.pop(0) if len(self.scripts) > 1 else self.scripts[0]
+        for message in script:
+            if message["data"][0]["symbol"] in request["params"]["symbol"]:
+                await ws.send(json.dumps(message))
+
+        if self.n_drops > 0:
+            self.n_drops -= 1
+            return
+        await asyncio.Future()
+
+
+def _trade_message(*timestamps_ms: int, symbol: str = "BTC/USD") -> dict:
+    return {
+        "channel": "trade",
+        "type": "update",
+        "data": [
+            {
+                "symbol": symbol,
+                "price": 100.0 + i,
+                "qty": 0.1,
+                "timestamp": datetime.fromtimestamp(ts / 1000, tz=timezone.utc)
+                .isoformat(timespec="microseconds")
+                .replace("+00:00", "Z"),
+            }
+            for i, ts in enumerate(timestamps_ms)
+        ],
+    }
+
+
+def _collect(api: KrakenWebsocketAPI, n_trades: int, timeout_sec: float = 10.0):
+    trades = []
+    deadline = time.monotonic() + timeout_sec
+    while len(trades) < n_trades and time.monotonic() < deadline:
+        trades.extend(api.get_trades())
+    return trades
+
+
+def test_reconnects_and_fills_the_gap():
+    now_ms = int(time.time() * 1000)
+    past_ms, future_ms = now_ms - 60_000, now_ms + 60_000
+    server = FakeKrakenServer(
+        [
+            # the first connection drops after 3 trades
+            [_trade_message(past_ms, past_ms + 1000, past_ms + 1000)],
+            # after reconnecting, a trade we get from the gap filler, and a new one
+            [_trade_message(past_ms + 2000), _trade_message(future_ms)],
+        ],
+        n_drops=1,
+    )
+
+    gaps = []
+
+    def fake_gap_filler(product_id: str, from_ms: int, to_ms: int) -> list[Trade]:
+        gaps.append((product_id, from_ms, to_ms))
+        # let the live trades arrive while we are filling the gap
+        time.sleep(0.2)
+        return [
+            Trade("BTC/USD", 0.1, 101.0, past_ms + 1000),
+            Trade("BTC/USD", 0.1, 102.0, past_ms + 1000),
+            Trade("BTC/USD", 0.1, 103.0, past_ms + 1000),
+            Trade("BTC/USD", 0.1, 104.0, past_ms + 2000),
+        ]
+
+    api = KrakenWebsocketAPI(
+        ["BTC/USD"],
+        url=server.url,
+        gap_filler=fake_gap_filler,
+        reconnect_backoff_base_sec=0.01,
+        get_timeout_sec=0.1,
+    )
+    try:
+        trades = _collect(api, n_trades=6)
+    finally:
+        api.close()
+
+    assert [(trade.timestamp_ms, trade.price) for trade in trades] == [
+        (past_ms, 100.0),
+        (past_ms + 1000, 101.0),
+        (past_ms + 1000, 102.0),
+        # the third trade of that millisecond, which we missed
+        (past_ms + 1000, 103.0),
+        (past_ms + 2000, 104.0),
+        (future_ms, 100.0),
+    ]
+    assert api.metrics()[0].n_connects == 2
+    assert len(gaps) == 1
+    assert gaps[0][:2] == ("BTC/USD", past_ms + 1000)
+    assert now_ms <= gaps[0][2] < future_ms
+
+
+def test_raises_when_the_subscription_is_rejected():
+    server = FakeKrakenServer([[]], reject_subscription=True)
+    api = KrakenWebsocketAPI(["FOO/BAR"], url=server.url, get_timeout_sec=0.1)
+
+    with pytest.raises(KrakenWebsocketAPIError):
+        _collect(api, n_trades=1, timeout_sec=5)
+
+
+def test_spreads_products_over_connections_with_a_bounded_queue():
+    product_ids = ["BTC/USD", "ETH/USD", "SOL/USD"]
+    now_ms = int(time.time() * 1000)
+    server = FakeKrakenServer(
+        [
+            [
+                _trade_message(now_ms + i, symbol=product_id)
+                for i in range(20)
+                for product_id in product_ids
+            ]
+        ]
+    )
+
+    api = KrakenWebsocketAPI(
+        product_ids,
+        url=server.url,
+        num_connections=2,
+        max_queue_size=2,
+        gap_filler=None,
+        get_timeout_sec=0.1,
+    )
+    try:
+        # let the readers fill the queue
+        time.sleep(0.5)
+        trades = _collect(api, n_trades=60)
+    finally:
+        api.close()
+
+    metrics = api.metrics()
+    assert [m.product_ids for m in metrics] == [["BTC/USD", "SOL/USD"], ["ETH/USD"]]
+    assert sum(m.n_trades for m in metrics) == 60
+    # the readers had to wait for us
+    assert sum(m.n_queue_full for m in metrics) > 0
+    for product_id in product_ids:
+        timestamps = [t.timestamp_ms for t in trades if t.product_id == product_id]
+        assert timestamps == [now_ms + i for i in range(20)]
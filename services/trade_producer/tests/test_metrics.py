@@ -0,0 +1,84 @@
+from queue import Queue
+from urllib.request import urlopen
+
+import pytest
+
+from src.metrics import MetricsRegistry
+from src.trade_pipeline import DeliveryReport, TradeReader, produce_batches
+from tests.test_trade_pipeline import FakeProducer, FakeSource
+
+
+def test_disabled_registry_hands_out_noop_metrics():
+    registry = MetricsRegistry()
+
+    counter = registry.counter("trades_total", "Trades", ["product_id"])
+    counter.labels("BTC/USD").inc(10)
+
+    assert registry.render() == "\n"
+
+
+def test_render_uses_the_prometheus_text_format():
+    registry = MetricsRegistry()
+    registry.enable()
+
+    trades = registry.counter("trades_total", "Trades", ["product_id"])
+    trades.labels('BTC/"USD"').inc(3)
+    registry.gauge("queue_size", "Queue size").set_function(lambda: 7)
+    latency = registry.histogram("latency_seconds", "Latency", buckets=(0.1, 1.0))
+    latency.observe(0.05)
+    latency.observe(0.5)
+    latency.observe(5.0)
+
+    assert registry.render().splitlines() == [
+        "# HELP trades_total Trades",
+        "# TYPE trades_total counter",
+        'trades_total{product_id="BTC/\\"USD\\""} 3.0',
+        "# HELP queue_size Queue size",
+        "# TYPE queue_size gauge",
+        "queue_size 7.0",
+        "# HELP latency_seconds Latency",
+        "# TYPE latency_seconds histogram",
+        'latency_seconds_bucket{le="0.1"} 1.0',
+        'latency_seconds_bucket{le="1.0"} 2.0',
+        'latency_seconds_bucket{le="+Inf"} 3.0',
+        "latency_seconds_sum 5.55",
+        "latency_seconds_count 3.0",
+    ]
+
+
+def test_metrics_are_shared_by_name_and_checked():
+    registry = MetricsRegistry()
+    registry.enable()
+
+    first = registry.counter("trades_total", "Trades", ["product_id"])
+    assert registry.counter("trades_total", "Trades", ["product_id"]) is first
+    with pytest.raises(ValueError):
+        registry.gauge("trades_total", "Trades", ["product_id"])
+    with pytest.raises(ValueError):
+        first.labels("BTC/USD", "ETH/USD")
+
+
+def test_pipeline_metrics_are_served_over_http(monkeypatch):
+    registry = MetricsRegistry()
+    registry.enable()
+    monkeypatch.setattr("src.trade_pipeline.REGISTRY", registry)
+
+    batches = Queue()
+    reader = TradeReader(FakeSource(n_batches=3, batch_size=4), batches)
+    producer = FakeProducer(buffer_size=100)
+    reader.start()
+    produce_batches(producer, "trades", batches, DeliveryReport())
+    producer.poll()
+    reader.join()
+
+    server = registry.start_http_server(port=0, host="127.0.0.1")
+    try:
+        port = server.server_address[1]
+        body = urlopen(f"http://127.0.0.1:{port}/metrics").read().decode()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert 'trade_producer_trades_produced_total{product_id="BTC/USD"} 12.0' in body
+    assert "trade_producer_messages_delivered_total 12.0" in body
+    assert "trade_producer_messages_in_flight 0.0" in body
@@ -0,0 +1,210 @@
+import asyncio
+import json
+import threading
+import time
+import zlib
+
+from websockets.asyncio.server import serve
+
+from src.trade_data_source.kraken_book_websocket_api import KrakenBookWebsocketAPI
+from src.trade_data_source.order_book import OrderBook
+
+
+def _levels(*levels: tuple) -> list[dict]:
+    return [{"price": price, "qty": qty} for price, qty in levels]
+
+
+def _book() -> OrderBook:
+    book = OrderBook("BTC/USD", depth=10, price_precision=1, qty_precision=8)
+    book.apply_snapshot(
+        bids=_levels((100.0, 1.0), (99.5, 2.0), (99.0, 3.0)),
+        asks=_levels((100.5, 0.5), (101.0, 1.5)),
+    )
+    return book
+
+
+def test_updates_insert_replace_and_remove_levels():
+    book = _book()
+
+    book.apply_update(
+        bids=_levels((99.8, 4.0), (99.5, 0.0)),
+        asks=_levels((100.5, 0.25), (102.0, 1.0)),
+    )
+
+    assert book.bids.levels(10) == [(100.0, 1.0), (99.8, 4.0), (99.0, 3.0)]
+    assert book.asks.levels(10) == [(100.5, 0.25), (101.0, 1.5), (102.0, 1.0)]
+
+
+def test_levels_beyond_the_depth_are_dropped():
+    book = OrderBook("BTC/USD", depth=10)
+    book.apply_snapshot(bids=_levels(*[(100.0 - i, 1.0) for i in range(10)]), asks=[])
+
+    book.apply_update(bids=_levels((100.5, 1.0)), asks=[])
+
+    assert len(book.bids) == 10
+    assert book.bids.price(0) == 100.5
+    assert book.bids.price(9) == 92.0
+
+
+def test_checksum_follows_the_kraken_format():
+    book = _book()
+
+    # asks from best to worst, then bids, without the decimal point and the
+    # leading zeros
+    expected = "1005" + "50000000" + "1010" + "150000000"
+    expected += "1000" + "100000000" + "995" + "200000000" + "990" + "300000000"
+    assert book.checksum() == zlib.crc32(expected.encode())
+
+
+def test_record_has_the_top_of_the_book_and_the_imbalance():
+    record = _book().to_record(imbalance_levels=2, snapshot_levels=1)
+
+    assert record["bid_price"] == 100.0
+    assert record["ask_price"] == 100.5
+    assert record["mid_price"] == 100.25
+    assert record["spread"] == 0.5
+    # (1 + 2 - 0.5 - 1.5) / (1 + 2 + 0.5 + 1.5)
+    assert record["imbalance"] == 0.2
+    assert record["bids"] == [(100.0, 1.0)]
+    assert record["asks"] == [(100.5, 0.5)]
+
+
+class FakeKrakenBookServer:
+    """
+    A local stand-in for the Kraken `book` channel: sends the instruments, and then
+    the given book messages to every connection. It records the book requests it
+    gets.
+    """
+
+    def __init__(self, messages: list[dict]):
+        self.messages = messages
+        self.requests: list[dict] = []
+        self._started = threading.Event()
+        self._thread = threading.Thread(target=asyncio.run, args=(self._serve(),))
+        self._thread.daemon = True
+        self._thread.start()
+        self._started.wait(timeout=5)
+
+    async def _serve(self) -> None:
+        async with serve(self._handler, "localhost", 0) as server:
+            self.url = f"ws://localhost:{server.sockets[0].getsockname()[1]}"
+            self._started.set()
+            await asyncio.Future()
+
+    async def _handler(self, ws) -> None:
+        instruments = {
+            "channel": "instrument",
+            "type": "snapshot",
+            "data": {
+                "assets": [],
+                "pairs": [
+                    {"symbol": "BTC/USD", "price_precision": 1, "qty_precision": 8}
+                ],
+            },
+        }
+        async for message in ws:
+            request = json.loads(message)
+            if request["params"]["channel"] == "instrument":
+                await ws.send(json.dumps(instruments))
+                continue
+            self.requests.append(request)
+            if request["method"] == "subscribe" and len(self.requests) == 1:
+                for book_message in self.messages:
+                    await ws.send(json.dumps(book_message))
+
+
+def _book_message(type: str, bids: list, asks: list, checksum: int) -> dict:
+    data = {
+        "symbol": "BTC/USD",
+        "bids": _levels(*bids),
+        "asks": _levels(*asks),
+        "checksum": checksum,
+    }
+    if type == "update":
+        data["timestamp"] = "2024-06-17T09:36:39.467866Z"
+    return {"channel": "book", "type": type, "data": [data]}
+
+
+def _wait_for_records(api: KrakenBookWebsocketAPI) -> list[dict]:
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline:
+        records = api.get_records()
+        if records:
+            return records
+    raise TimeoutError
+
+
+def test_api_applies_the_updates_and_hands_out_records():
+    book = _book()
+    snapshot = _book_message(
+        "snapshot",
+        bids=[(100.0, 1.0), (99.5, 2.0), (99.0, 3.0)],
+        asks=[(100.5, 0.5), (101.0, 1.5)],
+        checksum=book.checksum(),
+    )
+    book.apply_update(bids=_levels((100.0, 2.0)), asks=[])
+    update = _book_message(
+        "update", bids=[(100.0, 2.0)], asks=[], checksum=book.checksum()
+    )
+    server = FakeKrakenBookServer([snapshot, update])
+
+    api = KrakenBookWebsocketAPI(
+        ["BTC/USD"], url=server.url, record_interval_ms=50, get_timeout_sec=0.1
+    )
+    try:
+        records = _wait_for_records(api)
+    finally:
+        api.close()
+
+    assert records[0]["bid_qty"] == 2.0
+    assert records[0]["timestamp_ms"] == 1718616999467
+    assert api.metrics.n_checksum_errors == 0
+
+
+def test_api_asks_for_a_new_snapshot_when_the_checksum_does_not_match():
+    snapshot = _book_message(
+        "snapshot", bids=[(100.0, 1.0)], asks=[(100.5, 0.5)], checksum=0
+    )
+    server = FakeKrakenBookServer([snapshot])
+
+    api = KrakenBookWebsocketAPI(
+        ["BTC/USD"], url=server.url, record_interval_ms=50, get_timeout_sec=0.1
+    )
+    try:
+        deadline = time.monotonic() + 5
+        while len(server.requests) < 3 and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        api.close()
+
+    assert api.metrics.n_checksum_errors == 1
+    assert [request["method"] for request in server.requests] == [
+        "subscribe",
+        "unsubscribe",
+        "subscribe",
+    ]
+    assert api.get_records() == []
+
+
+def test_a_full_queue_keeps_the_latest_record_of_each_product():
+    server = FakeKrakenBookServer([])
+    api = KrakenBookWebsocketAPI(
+        ["BTC/USD", "ETH/USD"], url=server.url, max_queue_size=1, get_timeout_sec=0.1
+    )
+    api.close()
+    api.books = {"BTC/USD": _book(), "ETH/USD": _book()}
+    api.books["ETH/USD"].product_id = "ETH/USD"
+
+    # the producer is behind: the first batch is still in the queue
+    api._changed.update(["BTC/USD", "ETH/USD"])
+    api._emit_records()
+    api.books["BTC/USD"].apply_update(bids=_levels((100.0, 2.0)), asks=[])
+    api._changed.add("BTC/USD")
+    api._emit_records()
+
+    records = {record["product_id"]: record for record in api.get_records()}
+    assert records["BTC/USD"]["bid_qty"] == 2.0
+    # the book of ETH/USD did not change, its record is still the latest one
+    assert records["ETH/USD"]["bid_qty"] == 1.0
+    assert api.metrics.n_dropped == 1
+    assert api.get_records() == []
@@ -0,0 +1,25 @@
+import time
+
+from src.trade_data_source.rate_limiter import RateLimiter
+
+
+def test_rate_limiter_allows_burst():
+    rate_limiter = RateLimiter(rate=1.0, capacity=3)
+
+    start = time.monotonic()
+    for _ in range(3):
+        rate_limiter.acquire()
+
+    # the first `capacity` requests go through without waiting
+    assert time.monotonic() - start < 0.1
+
+
+def test_rate_limiter_paces_requests():
+    rate_limiter = RateLimiter(rate=20.0, capacity=1)
+
+    start = time.monotonic()
+    for _ in range(5):
+        rate_limiter.acquire()
+
+    # 1 token is available right away, the other 4 take 1/20 sec each
+    assert time.monotonic() - start >= 4 / 20 - 0.01
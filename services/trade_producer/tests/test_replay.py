@@ -0,0 +1,89 @@
+import time
+
+import pyarrow.feather as feather
+
+from src.trade_data_source.replay import ReplayTradeSource
+from src.trade_data_source.trade import Trade, TradeBatch
+from src.trade_data_source.trade_cache import DAY_MS, TradeCache
+
+# 2024-10-01 00:00:00 UTC
+DAY_1 = 1727740800000
+
+
+def _replay_all(source: ReplayTradeSource) -> list[Trade]:
+    trades = []
+    while not source.is_done():
+        trades.extend(source.get_trades())
+    return trades
+
+
+def _fill_cache(cache_dir: str) -> list[Trade]:
+    cache = TradeCache(cache_dir)
+    btc = [
+        Trade("BTC/USD", 0.1, 100.0 + i, DAY_1 + i * 7 * 60 * 60 * 1000)
+        for i in range(8)
+    ]
+    eth = [
+        Trade("ETH/USD", 0.2, 10.0 + i, DAY_1 + i * 5 * 60 * 60 * 1000)
+        for i in range(10)
+    ]
+    cache.write("BTC/USD", btc, DAY_1, DAY_1 + 3 * DAY_MS - 1)
+    cache.write("ETH/USD", eth, DAY_1, DAY_1 + 3 * DAY_MS - 1)
+    return btc + eth
+
+
+def test_replay_merges_the_products_in_timestamp_order(tmp_path):
+    trades = _fill_cache(str(tmp_path))
+
+    source = ReplayTradeSource(str(tmp_path), max_batch_size=3)
+    replayed = _replay_all(source)
+
+    assert sorted(replayed, key=lambda t: t.timestamp_ms) == replayed
+    assert sorted(replayed, key=lambda t: (t.timestamp_ms, t.product_id)) == sorted(
+        trades, key=lambda t: (t.timestamp_ms, t.product_id)
+    )
+    # a second replay gives the same trades in the same order
+    assert _replay_all(ReplayTradeSource(str(tmp_path))) == replayed
+
+
+def test_replay_filters_by_product_and_time(tmp_path):
+    trades = _fill_cache(str(tmp_path))
+    from_ms, to_ms = DAY_1 + DAY_MS, DAY_1 + 2 * DAY_MS
+
+    source = ReplayTradeSource(
+        str(tmp_path), product_ids=["ETH/USD"], from_ms=from_ms, to_ms=to_ms
+    )
+
+    assert _replay_all(source) == [
+        t
+        for t in trades
+        if t.product_id == "ETH/USD" and from_ms <= t.timestamp_ms <= to_ms
+    ]
+
+
+def test_replay_reads_arrow_files(tmp_path):
+    trades = [Trade("BTC/USD", 0.1, 100.0, ts) for ts in (1, 2, 3)]
+    feather.write_feather(
+        TradeBatch.from_trades(trades).to_table(), tmp_path / "a.arrow"
+    )
+
+    assert _replay_all(ReplayTradeSource(str(tmp_path / "a.arrow"))) == trades
+
+
+def test_replay_keeps_the_gaps_between_trades_at_the_given_speed(tmp_path):
+    trades = [Trade("BTC/USD", 0.1, 100.0, ts) for ts in (0, 1000, 3000)]
+    feather.write_feather(
+        TradeBatch.from_trades(trades).to_table(), tmp_path / "a.arrow"
+    )
+    source = ReplayTradeSource(str(tmp_path), speed=10.0)
+
+    start = time.monotonic()
+    arrivals = []
+    while not source.is_done():
+        for trade in source.get_trades():
+            arrivals.append((time.monotonic() - start, trade))
+
+    assert [trade for _, trade in arrivals] == trades
+    # 3 seconds of trades, 10 times faster
+    assert 0.1 <= arrivals[1][0] < 0.25
+    assert 0.3 <= arrivals[2][0] < 0.45
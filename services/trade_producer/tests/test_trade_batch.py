@@ -0,0 +1,39 @@
+from src.trade_data_source.trade import Trade, TradeBatch
+
+TRADES = [
+    Trade(product_id="BTC/USD", quantity=0.1, price=100.0, timestamp_ms=1),
+    Trade(product_id="ETH/USD", quantity=0.2, price=10.0, timestamp_ms=2),
+    Trade(product_id="BTC/USD", quantity=0.3, price=101.0, timestamp_ms=3),
+]
+
+
+def test_trade_batch_behaves_like_a_list_of_trades():
+    batch = TradeBatch.from_trades(TRADES)
+
+    assert len(batch) == 3
+    assert list(batch) == TRADES
+    assert batch[-1] == TRADES[-1]
+    assert batch.product_ids == ["BTC/USD", "ETH/USD"]
+    assert batch.product_code.tolist() == [0, 1, 0]
+
+
+def test_trade_batch_round_trips_through_arrow():
+    batch = TradeBatch.from_trades(TRADES)
+
+    assert TradeBatch.from_table(batch.to_table()) == TRADES
+
+
+def test_trade_batch_concat_remaps_product_codes():
+    eth = TradeBatch.from_columns("ETH/USD", [1.0], [10.0], [0])
+    btc_and_eth = TradeBatch.from_trades(TRADES)
+
+    batch = TradeBatch.concat([eth, btc_and_eth])
+
+    assert batch.product_ids == ["ETH/USD", "BTC/USD"]
+    assert [trade.product_id for trade in batch] == [
+        "ETH/USD",
+        "BTC/USD",
+        "ETH/USD",
+        "BTC/USD",
+    ]
+    assert batch.filter(batch.timestamp_ms >= 2) == TRADES[1:]
@@ -0,0 +1,129 @@
+import os
+from pathlib import Path
+
+import pyarrow.parquet as pq
+
+from src.trade_data_source.trade import Trade, TradeBatch
+from src.trade_data_source.trade_cache import DAY_MS, TradeCache, TradeCacheWriter
+
+PRODUCT_ID = "BTC/USD"
+# 2024-10-01 00:00:00 UTC
+DAY_1 = 1727740800000
+
+# The cache that trade_to_ohlcv reads in its tests, to check it reads our files
+TRADE_TO_OHLCV_FIXTURE = (
+    Path(__file__).parents[2] / "trade_to_ohlcv" / "tests" / "data" / "trade_cache"
+)
+
+
+def _trades(from_ms: int, to_ms: int, step_ms: int) -> list[Trade]:
+    return [
+        Trade(product_id=PRODUCT_ID, quantity=0.1, price=100.0 + i, timestamp_ms=ts)
+        for i, ts in enumerate(range(from_ms, to_ms + 1, step_ms))
+    ]
+
+
+def test_trade_cache_serves_sub_ranges_across_days(tmp_path):
+    cache = TradeCache(str(tmp_path))
+    trades = _trades(DAY_1, DAY_1 + 2 * DAY_MS - 1, step_ms=60 * 60 * 1000)
+
+    cache.write(PRODUCT_ID, trades, DAY_1, DAY_1 + 2 * DAY_MS - 1)
+
+    # one partition per UTC day
+    assert sorted(p.name for p in (tmp_path / "BTC-USD").glob("*.parquet")) == [
+        "2024-10-01.parquet",
+        "2024-10-02.parquet",
+    ]
+    from_ms, to_ms = DAY_1 + 20 * 60 * 60 * 1000, DAY_1 + 30 * 60 * 60 * 1000
+    assert cache.covered_until(PRODUCT_ID, from_ms) == DAY_1 + 2 * DAY_MS - 1
+    assert cache.read(PRODUCT_ID, from_ms, to_ms) == [
+        t for t in trades if from_ms <= t.timestamp_ms <= to_ms
+    ]
+
+
+def test_trade_cache_merges_overlapping_writes_without_duplicates(tmp_path):
+    cache = TradeCache(str(tmp_path))
+    trades = _trades(DAY_1, DAY_1 + 999, step_ms=10)
+
+    cache.write(PRODUCT_ID, trades[:60], DAY_1, DAY_1 + 599)
+    cache.write(PRODUCT_ID, trades[40:], DAY_1 + 400, DAY_1 + 999)
+
+    assert cache.covered_until(PRODUCT_ID, DAY_1) == DAY_1 + 999
+    assert cache.covered_until(PRODUCT_ID, DAY_1 + 1000) is None
+    assert cache.read(PRODUCT_ID, DAY_1, DAY_1 + 999) == trades
+
+
+def test_trade_cache_evicts_least_recently_used_days(tmp_path):
+    cache = TradeCache(str(tmp_path))
+    cache.write(PRODUCT_ID, _trades(DAY_1, DAY_1 + 999, 10), DAY_1, DAY_1 + 999)
+    day_2 = DAY_1 + DAY_MS
+    cache.write(PRODUCT_ID, _trades(day_2, day_2 + 999, 10), day_2, day_2 + 999)
+
+    # pretend we used the first day long ago
+    old_partition = tmp_path / "BTC-USD" / "2024-10-01.parquet"
+    os.utime(old_partition, (0, 0))
+
+    TradeCache(str(tmp_path), max_age_days=1)
+
+    assert not old_partition.exists()
+    assert cache.covered_until(PRODUCT_ID, DAY_1) is None
+    assert cache.covered_until(PRODUCT_ID, day_2) == day_2 + 999
+
+
+def test_trade_cache_writer_writes_each_day_once(tmp_path, monkeypatch):
+    cache = TradeCache(str(tmp_path))
+    writes = []
+    write = cache.write
+    monkeypatch.setattr(
+        cache,
+        "write",
+        lambda product_id, trades, from_ms, to_ms: (
+            writes.append((from_ms, to_ms)) or write(product_id, trades, from_ms, to_ms)
+        ),
+    )
+    hour_ms = 60 * 60 * 1000
+    trades = _trades(DAY_1, DAY_1 + 3 * DAY_MS - 1, step_ms=hour_ms)
+    writer = TradeCacheWriter(cache, PRODUCT_ID)
+
+    # pages of 6 hours, the last one ends in the middle of the third day
+    end_ms = DAY_1 + 2 * DAY_MS + 12 * hour_ms - 1
+    for from_ms in range(DAY_1, end_ms, 6 * hour_ms):
+        to_ms = from_ms + 6 * hour_ms - 1
+        page = [t for t in trades if from_ms <= t.timestamp_ms <= to_ms]
+        writer.add(TradeBatch.from_trades(page), from_ms, to_ms)
+    assert writes == [
+        (DAY_1, DAY_1 + DAY_MS - 1),
+        (DAY_1 + DAY_MS, DAY_1 + 2 * DAY_MS - 1),
+    ]
+
+    writer.flush()
+    assert writes[-1] == (DAY_1 + 2 * DAY_MS, end_ms)
+    assert cache.covered_until(PRODUCT_ID, DAY_1) == end_ms
+    assert cache.read(PRODUCT_ID, DAY_1, end_ms) == [
+        t for t in trades if t.timestamp_ms <= end_ms
+    ]
+
+
+def test_trade_cache_sees_the_index_written_by_another_instance(tmp_path):
+    cache = TradeCache(str(tmp_path))
+    assert cache.covered_until(PRODUCT_ID, DAY_1) is None
+
+    TradeCache(str(tmp_path)).write(
+        PRODUCT_ID, _trades(DAY_1, DAY_1 + 999, 10), DAY_1, DAY_1 + 999
+    )
+
+    assert cache.covered_until(PRODUCT_ID, DAY_1) == DAY_1 + 999
+
+
+def test_trade_cache_writes_the_files_trade_to_ohlcv_reads(tmp_path):
+    fixture = TRADE_TO_OHLCV_FIXTURE / "BTC-USD" / "2024-10-01.parquet"
+    expected = pq.read_table(fixture)
+
+    cache = TradeCache(str(tmp_path))
+    cache.write(PRODUCT_ID, TradeBatch.from_table(expected), DAY_1, DAY_1 + DAY_MS - 1)
+
+    # if the layout changes on purpose, write the fixture again with the new one
+    table = pq.read_table(tmp_path / "BTC-USD" / "2024-10-01.parquet")
+    assert table.schema.remove_metadata() == expected.schema.remove_metadata()
+    assert table.schema.remove_metadata() == TradeCache.SCHEMA
+    assert table.equals(expected)
@@ -0,0 +1,292 @@
+from queue import Queue
+from types import SimpleNamespace
+
+import orjson
+import pytest
+from confluent_kafka import KafkaError
+
+import src.main
+from src.checkpoints import CheckpointStore, CheckpointTracker
+from src.trade_data_source import Trade, TradeSource
+from src.trade_pipeline import (
+    DeliveryReport,
+    TradeReader,
+    produce_batches,
+    product_partitions,
+)
+
+
+class FakeSource(TradeSource):
+    def __init__(self, n_batches: int, batch_size: int):
+        self.batches = [
+            [
+                Trade("BTC/USD", 0.1, 100.0, i * batch_size + j)
+                for j in range(batch_size)
+            ]
+            for i in range(n_batches)
+        ]
+
+    def get_trades(self) -> list[Trade]:
+        return self.batches.pop(0)
+
+    def is_done(self) -> bool:
+        return not self.batches
+
+
+class FakeProducer:
+    """
+    Keeps at most `buffer_size` undelivered messages, like the librdkafka buffer,
+    and delivers them when polled.
+    """
+
+    def __init__(self, buffer_size: int):
+        self.buffer_size = buffer_size
+        self.buffer = []
+        self.delivered = []
+        self.partitions = []
+
+    def produce(
+        self, topic, value, key, on_delivery, buffer_error_max_tries, partition=None
+    ):
+        if len(self.buffer) >= self.buffer_size:
+            raise BufferError()
+        self.buffer.append((key, value, on_delivery))
+        self.partitions.append(partition)
+
+    def poll(self, timeout: float = 0):
+        for key, value, on_delivery in self.buffer:
+            self.delivered.append(value)
+            on_delivery(None, None)
+        self.buffer = []
+
+
+def test_pipeline_produces_every_trade_in_order_when_the_buffer_fills_up():
+    batches = Queue(maxsize=2)
+    reader = TradeReader(FakeSource(n_batches=10, batch_size=7), batches)
+    producer = FakeProducer(buffer_size=5)
+    report = DeliveryReport()
+
+    reader.start()
+    produce_batches(producer, "trades", batches, report, buffer_full_poll_sec=0)
+    producer.poll()
+    reader.join()
+
+    assert reader.error is None
+    timestamps = [orjson.loads(value)["timestamp_ms"] for value in producer.delivered]
+    assert timestamps == list(range(70))
+    assert report.n_produced == report.n_delivered == 70
+    assert report.n_buffer_full > 0
+
+
+def test_each_product_gets_its_own_partition():
+    class MultiProductSource(FakeSource):
+        def __init__(self):
+            product_ids = ["ETH/USD", "BTC/USD", "SOL/USD"] * 3
+            self.batches = [
+                [
+                    Trade(product_id, 0.1, 100.0, i)
+                    for i, product_id in enumerate(product_ids)
+                ]
+            ]
+
+    partitions = product_partitions(["BTC/USD", "ETH/USD", "SOL/USD"], 3)
+    assert partitions == {"BTC-USD": 0, "ETH-USD": 1, "SOL-USD": 2}
+
+    batches = Queue()
+    reader = TradeReader(MultiProductSource(), batches)
+    producer = FakeProducer(buffer_size=100)
+    reader.start()
+    produce_batches(
+        producer, "trades", batches, DeliveryReport(), partitions=partitions
+    )
+    reader.join()
+
+    assert producer.partitions == [1, 0, 2] * 3
+
+
+def test_reader_errors_stop_the_pipeline():
+    class BrokenSource(FakeSource):
+        def get_trades(self):
+            raise ConnectionError("boom")
+
+    batches = Queue(maxsize=2)
+    reader = TradeReader(BrokenSource(n_batches=1, batch_size=1), batches)
+    report = DeliveryReport()
+
+    reader.start()
+    produce_batches(FakeProducer(buffer_size=5), "trades", batches, report)
+    reader.join()
+
+    assert isinstance(reader.error, ConnectionError)
+    assert report.n_produced == 0
+
+
+def test_checkpoints_are_saved_only_after_delivery(tmp_path):
+    class CheckpointedSource(FakeSource):
+        def __init__(self, n_batches: int, batch_size: int):
+            super().__init__(n_batches, batch_size)
+            self.next_ms = 0
+
+        def get_trades(self) -> list[Trade]:
+            trades = super().get_trades()
+            self.next_ms = trades[-1].timestamp_ms + 1
+            return trades
+
+        def checkpoint(self) -> dict:
+            return {"BTC/USD": {"from_ms": 0, "next_ms": self.next_ms}}
+
+    store = CheckpointStore(str(tmp_path / "checkpoint.json"))
+    checkpoints = CheckpointTracker(store)
+    batches = Queue()
+    reader = TradeReader(CheckpointedSource(n_batches=3, batch_size=4), batches)
+    # the producer never has to poll while producing, so nothing is delivered yet
+    producer = FakeProducer(buffer_size=100)
+
+    reader.start()
+    produce_batches(
+        producer, "trades", batches, DeliveryReport(), checkpoints=checkpoints
+    )
+    reader.join()
+
+    assert store.load() == {}
+
+    producer.poll()
+    checkpoints.commit()
+
+    assert store.load() == {"BTC/USD": {"from_ms": 0, "next_ms": 12}}
+
+
+def test_checkpoints_stop_at_the_first_undelivered_batch(tmp_path):
+    store = CheckpointStore(str(tmp_path / "checkpoint.json"))
+    checkpoints = CheckpointTracker(store)
+
+    first = checkpoints.add({"BTC/USD": {"from_ms": 0, "next_ms": 10}}, n_messages=1)
+    second = checkpoints.add({"BTC/USD": {"from_ms": 0, "next_ms": 20}}, n_messages=2)
+    third = checkpoints.add({"BTC/USD": {"from_ms": 0, "next_ms": 30}}, n_messages=1)
+    first.on_delivery(None, None)
+    third.on_delivery(None, None)
+    second.on_delivery(None, None)
+    checkpoints.commit()
+
+    # the second batch still has a message in flight
+    assert store.load()["BTC/USD"]["next_ms"] == 10
+
+    second.on_delivery(KafkaError(KafkaError._MSG_TIMED_OUT), None)
+    checkpoints.commit()
+
+    assert store.load()["BTC/USD"]["next_ms"] == 10
+
+
+class FakeAdminClient:
+    """
+    An AdminClient with a single topic, "trades", of `n_partitions` partitions.
+    """
+
+    def __init__(self, n_partitions: int) -> None:
+        self.n_partitions = n_partitions
+
+    def __call__(self, config: dict) -> "FakeAdminClient":
+        return self
+
+    def list_topics(self, topic_name: str, timeout: float) -> SimpleNamespace:
+        partitions = dict.fromkeys(range(self.n_partitions))
+        return SimpleNamespace(
+            topics={topic_name: SimpleNamespace(partitions=partitions)}
+        )
+
+    def create_partitions(self, new_partitions: list) -> dict:
+        self.n_partitions = new_partitions[0].new_total_count
+        return {new_partitions[0].topic: SimpleNamespace(result=lambda: None)}
+
+
+@pytest.mark.parametrize("add_partitions", [False, True])
+def test_partitions_are_only_added_on_request(monkeypatch, add_partitions):
+    admin = FakeAdminClient(n_partitions=1)
+    monkeypatch.setattr(src.main, "AdminClient", admin)
+
+    n_partitions = src.main.ensure_num_partitions(
+        "localhost:9092", "trades", 3, add_partitions=add_partitions
+    )
+
+    assert n_partitions == admin.n_partitions == (3 if add_partitions else 1)
+    # the products share the partitions the topic has
+    assert set(
+        product_partitions(["BTC/USD", "ETH/USD", "SOL/USD"], n_partitions).values()
+    ) == set(range(n_partitions))
+
+
+def test_topics_with_more_partitions_are_left_alone(monkeypatch):
+    admin = FakeAdminClient(n_partitions=4)
+    monkeypatch.setattr(src.main, "AdminClient", admin)
+
+    assert src.main.ensure_num_partitions("localhost:9092", "trades", 3, True) == 4
+    assert admin.n_partitions == 4
+
+
+def test_products_already_in_the_topic_keep_their_partition():
+    current = {"BTC-USD": 0, "ETH-USD": 1, "SOL-USD": 2}
+
+    # a product inserted at the top of the config, and the others reordered
+    partitions = product_partitions(
+        ["XRP/USD", "SOL/USD", "BTC/USD", "ETH/USD"], 4, current
+    )
+
+    assert partitions == {"XRP-USD": 3, "SOL-USD": 2, "BTC-USD": 0, "ETH-USD": 1}
+
+
+def test_new_products_go_to_the_partitions_with_the_fewest_products():
+    partitions = product_partitions(
+        ["BTC/USD", "ETH/USD", "SOL/USD", "XRP/USD"], 2, {"ETH-USD": 0}
+    )
+
+    assert partitions == {"BTC-USD": 1, "ETH-USD": 0, "SOL-USD": 0, "XRP-USD": 1}
+
+
+class FakeMessage:
+    def __init__(self, key: bytes) -> None:
+        self._key = key
+
+    def error(self) -> None:
+        return None
+
+    def key(self) -> bytes:
+        return self._key
+
+
+class FakeConsumer:
+    """
+    A Consumer of a topic whose partitions end with a message of the given keys,
+    or are empty for None.
+    """
+
+    def __init__(self, last_keys: list) -> None:
+        self.last_keys = last_keys
+        self.closed = False
+
+    def __call__(self, config: dict) -> "FakeConsumer":
+        return self
+
+    def get_watermark_offsets(self, partition, timeout: float) -> tuple:
+        return 0, 0 if self.last_keys[partition.partition] is None else 10
+
+    def assign(self, partitions: list) -> None:
+        assert partitions[0].offset == 9
+        self.assigned = partitions[0].partition
+
+    def poll(self, timeout: float) -> FakeMessage:
+        return FakeMessage(self.last_keys[self.assigned])
+
+    def close(self) -> None:
+        self.closed = True
+
+
+def test_current_partitions_come_from_the_last_message_of_each_partition(
+    monkeypatch,
+):
+    consumer = FakeConsumer([b"ETH-USD", None, b"BTC-USD"])
+    monkeypatch.setattr(src.main, "Consumer", consumer)
+
+    current = src.main.current_product_partitions("localhost:9092", "trades", 3)
+
+    assert current == {"ETH-USD": 0, "BTC-USD": 2}
+    assert consumer.closed
@@ -0,0 +1,92 @@
+import pytest
+from quixstreams.models import Topic
+
+from src.trade_codec import decode_trade, encode_trade
+from src.trade_data_source.trade import Trade, TradeBatch
+from src.trade_serializer import serialize_trade_batch
+
+
+def test_serialize_trade_batch_matches_the_json_serializer():
+    trades = [
+        Trade(product_id="BTC/USD", quantity=0.1, price=100.0, timestamp_ms=1),
+        Trade(product_id="ETH/EUR", quantity=1e-7, price=2345.67, timestamp_ms=2),
+        Trade(product_id="BTC/USD", quantity=3.0, price=1e20, timestamp_ms=3),
+        Trade(product_id="BTC/USD", quantity=1e-6, price=1e16, timestamp_ms=4),
+        Trade(
+            product_id="ETH/EUR",
+            quantity=3.5303794225422716e-6,
+            price=1e15,
+            timestamp_ms=5,
+        ),
+        Trade(product_id="ETH/EUR", quantity=1e-5, price=0.0, timestamp_ms=6),
+    ]
+    topic = Topic(name="trades", value_serializer="json")
+
+    keys, values = serialize_trade_batch(TradeBatch.from_trades(trades))
+
+    expected = [
+        topic.serialize(
+            key=trade.product_id.replace("/", "-"), value=trade.model_dump()
+        )
+        for trade in trades
+    ]
+    assert keys == [message.key for message in expected]
+    assert values == [message.value for message in expected]
+
+
+@pytest.mark.parametrize("price", [float("nan"), float("inf")])
+def test_serialize_trade_batch_rejects_values_json_cant_hold(price):
+    trades = [Trade(product_id="BTC/USD", quantity=0.1, price=price, timestamp_ms=1)]
+
+    with pytest.raises(ValueError):
+        serialize_trade_batch(TradeBatch.from_trades(trades))
+
+
+def test_serialize_trade_batch_rejects_product_ids_that_need_escaping():
+    trades = [Trade(product_id='BTC"USD', quantity=0.1, price=100.0, timestamp_ms=1)]
+
+    with pytest.raises(ValueError):
+        serialize_trade_batch(TradeBatch.from_trades(trades))
+
+
+def test_serialize_trade_batch_matches_the_binary_codec():
+    trades = [
+        Trade(product_id="BTC/USD", quantity=0.1, price=100.0, timestamp_ms=1),
+        Trade(product_id="ETH/EUR", quantity=1e-7, price=2345.67, timestamp_ms=2),
+        Trade(product_id="BTC/USD", quantity=3.0, price=1e20, timestamp_ms=3),
+        Trade(product_id="XBTC/USD", quantity=4.0, price=5.0, timestamp_ms=4),
+    ]
+
+    keys, values = serialize_trade_batch(TradeBatch.from_trades(trades), "binary")
+
+    assert keys == ["BTC-USD", "ETH-EUR", "BTC-USD", "XBTC-USD"]
+    assert values == [encode_trade(trade.model_dump()) for trade in trades]
+    assert [decode_trade(value) for value in values] == [
+        trade.model_dump() for trade in trades
+    ]
+
+
+def test_serialize_trade_batch_packs_the_trades_of_each_product(monkeypatch):
+    monkeypatch.setattr("src.trade_serializer.MAX_TRADES_PER_MESSAGE", 2)
+    trades = [
+        Trade(product_id="BTC/USD", quantity=0.1, price=100.0, timestamp_ms=1),
+        Trade(product_id="ETH/EUR", quantity=0.2, price=200.0, timestamp_ms=2),
+        Trade(product_id="BTC/USD", quantity=0.3, price=300.0, timestamp_ms=3),
+        Trade(product_id="BTC/USD", quantity=0.4, price=400.0, timestamp_ms=4),
+    ]
+
+    keys, values = serialize_trade_batch(TradeBatch.from_trades(trades), "batch")
+    batches = [decode_trade(value) for value in values]
+
+    assert keys == ["BTC-USD", "BTC-USD", "ETH-EUR"]
+    assert [batch["product_id"] for batch in batches] == [
+        "BTC/USD",
+        "BTC/USD",
+        "ETH/EUR",
+    ]
+    assert [batch["timestamps_ms"].tolist() for batch in batches] == [[1, 3], [4], [2]]
+    assert [batch["prices"].tolist() for batch in batches] == [
+        [100.0, 300.0],
+        [400.0],
+        [200.0],
+    ]
@@ -0,0 +1,101 @@
+"""
+Compares the cost per trade of the window state of the streaming pipeline: the
+reducer, plus the serialization the state store does on every trade to write the
+candle and read it back (without RocksDB itself), for the old dict state and the
+compact list state.
+
+Usage:
+    poetry run python -m benchmarks.bench_candle_state --n-trades 1000000
+"""
+
+import argparse
+import random
+import time
+from typing import Callable, List
+
+from quixstreams.utils.json import dumps, loads
+
+from src.main import init_ohlcv_candle, update_ohlcv_candle
+
+
+def init_dict_candle(trade: dict) -> dict:
+    return {
+        "open": trade["price"],
+        "high": trade["price"],
+        "low": trade["price"],
+        "close": trade["price"],
+        "volume": trade["quantity"],
+        "product_id": trade["product_id"],
+    }
+
+
+def update_dict_candle(candle: dict, trade: dict) -> dict:
+    candle["high"] = max(candle["high"], trade["price"])
+    candle["low"] = min(candle["low"], trade["price"])
+    candle["close"] = trade["price"]
+    candle["volume"] += trade["quantity"]
+    candle["product_id"] = trade["product_id"]
+    return candle
+
+
+def run(
+    trades: List[dict],
+    trades_per_window: int,
+    initializer: Callable,
+    reducer: Callable,
+    serialize: bool,
+) -> float:
+    """
+    Aggregates the trades, reading the candle from the state and writing it back
+    for each trade like the window does when `serialize` is True, and returns the
+    time it took.
+    """
+    start = time.perf_counter()
+    state = None
+    for i, trade in enumerate(trades):
+        if i % trades_per_window == 0:
+            candle = initializer(trade)
+        else:
+            candle = reducer(loads(state) if serialize else candle, trade)
+        if serialize:
+            state = dumps(candle)
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n-trades", type=int, default=1_000_000)
+    parser.add_argument("--trades-per-window", type=int, default=100)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    trades = [
+        {
+            "product_id": "BTC/USD",
+            "price": rng.uniform(60_000, 70_000),
+            "quantity": rng.uniform(0.0001, 2.0),
+            "timestamp_ms": i,
+        }
+        for i in range(args.n_trades)
+    ]
+
+    states = [
+        ("dict", init_dict_candle, update_dict_candle),
+        ("list", init_ohlcv_candle, update_ohlcv_candle),
+    ]
+    print(f"{args.n_trades} trades, {args.trades_per_window} trades per window")
+    for name, initializer, reducer in states:
+        state_bytes = len(dumps(initializer(trades[0])))
+        for serialize in (False, True):
+            elapsed = run(
+                trades, args.trades_per_window, initializer, reducer, serialize
+            )
+            label = f"{name} {'reducer + state' if serialize else 'reducer'}"
+            print(
+                f"{label:>20}: {elapsed / args.n_trades * 1e9:6.0f} ns/trade"
+                f" ({state_bytes} bytes of state)"
+            )
+
+
+if __name__ == "__main__":
+    main()
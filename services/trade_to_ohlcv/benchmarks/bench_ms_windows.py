@@ -0,0 +1,151 @@
+"""
+Measures the streaming path with 100ms candles for several pairs: the per-record
+steps of the first resolution in the low-latency mode (`LiveCandles` with the gap
+filling and the heartbeats of every window, then the indicators and the JSON of
+each closed candle), with the state serialized on every record like the state
+store does (without Kafka and RocksDB). Also the vectorized engine of the
+backfills on the same trades.
+
+With 100ms windows most windows have at most one trade, so the cost is dominated
+by the closed candles and the heartbeats, not by the trades. The real-time factor
+is how many times faster than the market the job keeps up.
+
+Usage:
+    poetry run python -m benchmarks.bench_ms_windows --n-products 8 --window-ms 100
+"""
+
+import argparse
+import time
+from typing import List
+
+import numpy as np
+import pyarrow as pa
+from quixstreams.context import set_message_context
+from quixstreams.models import MessageContext
+from quixstreams.utils.json import dumps, loads
+
+from src.live_candles import LiveCandles
+from src.main import (
+    add_technical_indicators,
+    init_ohlcv_candle,
+    to_ohlcv_candle,
+    update_ohlcv_candle,
+    window_name,
+)
+from src.ohlcv_engine import OHLCVEngine
+
+
+class JsonState:
+    """
+    The state of one product, serialized on every write like the state store does.
+    """
+
+    def __init__(self) -> None:
+        self._values = {}
+
+    def get(self, key: str, default=None):
+        return loads(self._values[key]) if key in self._values else default
+
+    def set(self, key: str, value) -> None:
+        self._values[key] = dumps(value)
+
+
+def make_records(
+    n_products: int, trades_per_sec: float, n_seconds: int, window_ms: int
+) -> List[dict]:
+    """
+    Returns the trades of the products, Poisson arrivals at `trades_per_sec` each,
+    merged with a heartbeat of each product at the end of every window, in time
+    order.
+    """
+    rng = np.random.default_rng(42)
+    records = []
+    for i in range(n_products):
+        product_id = f"P{i}/USD"
+        n_trades = rng.poisson(trades_per_sec * n_seconds)
+        timestamps_ms = np.sort(rng.integers(0, n_seconds * 1000, n_trades))
+        prices = 50_000 + np.cumsum(rng.normal(0, 5, n_trades))
+        quantities = rng.uniform(0.0001, 2.0, n_trades)
+        records += [
+            {
+                "product_id": product_id,
+                "price": float(price),
+                "quantity": float(quantity),
+                "timestamp_ms": int(timestamp_ms),
+            }
+            for timestamp_ms, price, quantity in zip(timestamps_ms, prices, quantities)
+        ]
+        records += [
+            {"product_id": product_id, "timestamp_ms": end_ms, "heartbeat": True}
+            for end_ms in range(window_ms, n_seconds * 1000, window_ms)
+        ]
+    # the heartbeats of a window end come after its trades
+    records.sort(key=lambda record: record["timestamp_ms"])
+    return records
+
+
+def run_streaming(records: List[dict], window_ms: int) -> int:
+    """
+    Runs the records through the stateful steps, and returns the number of candles.
+    """
+    live_candles = LiveCandles(
+        window_ms=window_ms,
+        initializer=init_ohlcv_candle,
+        reducer=update_ohlcv_candle,
+        to_candle=to_ohlcv_candle,
+        fill_gaps=True,
+    )
+    state_key = f"indicators_{window_name(window_ms)}"
+    states = {}
+    n_candles = 0
+    for record in records:
+        state = states.setdefault(record["product_id"], JsonState())
+        for candle in live_candles(record, state):
+            candle = add_technical_indicators(candle, state, state_key)
+            dumps(candle)
+            n_candles += 1
+    return n_candles
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n-products", type=int, default=8)
+    parser.add_argument("--trades-per-sec", type=float, default=20.0)
+    parser.add_argument("--n-seconds", type=int, default=300)
+    parser.add_argument("--window-ms", type=int, default=100)
+    args = parser.parse_args()
+
+    records = make_records(
+        args.n_products, args.trades_per_sec, args.n_seconds, args.window_ms
+    )
+    trades = [record for record in records if "heartbeat" not in record]
+    # `LiveCandles` reads the input partition of each trade
+    set_message_context(MessageContext("trades", 0, 0, 0))
+
+    start = time.perf_counter()
+    n_candles = run_streaming(records, args.window_ms)
+    streaming_sec = time.perf_counter() - start
+
+    start = time.perf_counter()
+    engine = OHLCVEngine(args.window_ms)
+    table = pa.Table.from_pylist(trades)
+    n_engine_candles = engine.add(table).num_rows + engine.flush().num_rows
+    engine_sec = time.perf_counter() - start
+
+    print(
+        f"{args.n_products} products, {len(trades)} trades and {n_candles} candles "
+        f"of {window_name(args.window_ms)} in {args.n_seconds}s of market"
+    )
+    print(
+        f"streaming: {streaming_sec:.2f}s, {n_candles / streaming_sec:,.0f} "
+        f"candles/sec, {streaming_sec / n_candles * 1e6:.1f} us/candle, "
+        f"{args.n_seconds / streaming_sec:.1f}x real time"
+    )
+    print(
+        f"   engine: {engine_sec:.3f}s for the {n_engine_candles} candles with "
+        f"trades, {len(trades) / engine_sec:,.0f} trades/sec"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Compares the vectorized OHLCV engine with the reducer of the streaming pipeline
+applied trade by trade (without Kafka and RocksDB, so the streaming path is even
+slower than this in practice).
+
+Usage:
+    poetry run python -m benchmarks.bench_ohlcv_engine --n-trades 5000000
+"""
+
+import argparse
+import time
+
+import numpy as np
+import pyarrow as pa
+
+from src.main import init_ohlcv_candle, update_ohlcv_candle
+from src.ohlcv_engine import OHLCVEngine
+
+
+def make_trades(n_trades: int, n_products: int, n_days: int) -> pa.Table:
+    rng = np.random.default_rng(42)
+    timestamps_ms = np.sort(rng.integers(0, n_days * 24 * 3600 * 1000, n_trades))
+    return pa.table(
+        {
+            "product_id": pa.array(
+                [f"P{i}/USD" for i in rng.integers(0, n_products, n_trades)]
+            ),
+            "quantity": rng.uniform(0.0001, 2.0, n_trades),
+            "price": rng.uniform(40_000, 70_000, n_trades),
+            "timestamp_ms": timestamps_ms,
+        }
+    )
+
+
+def reduce_trade_by_trade(trades: list[dict], window_ms: int) -> int:
+    windows = {}
+    for trade in trades:
+        key = (trade["product_id"], trade["timestamp_ms"] // window_ms)
+        if key in windows:
+            windows[key] = update_ohlcv_candle(windows[key], trade)
+        else:
+            windows[key] = init_ohlcv_candle(trade)
+    return len(windows)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n-trades", type=int, default=2_000_000)
+    parser.add_argument("--n-products", type=int, default=4)
+    parser.add_argument("--window-seconds", type=int, default=60)
+    parser.add_argument("--batch-size", type=int, default=1_000_000)
+    # the trades are spread over this many days, so fewer days means more trades
+    # per window
+    parser.add_argument("--n-days", type=int, default=30)
+    args = parser.parse_args()
+
+    window_ms = args.window_seconds * 1000
+    table = make_trades(args.n_trades, args.n_products, args.n_days)
+
+    start = time.perf_counter()
+    engine = OHLCVEngine(window_ms)
+    n_candles = sum(
+        engine.add(batch).num_rows
+        for batch in table.to_batches(max_chunksize=args.batch_size)
+    )
+    n_candles += engine.flush().num_rows
+    engine_sec = time.perf_counter() - start
+
+    trades = table.to_pylist()
+    start = time.perf_counter()
+    n_windows = reduce_trade_by_trade(trades, window_ms)
+    reducer_sec = time.perf_counter() - start
+
+    print(f"{args.n_trades} trades, {n_candles} candles of {args.window_seconds}s")
+    for name, elapsed in [("engine", engine_sec), ("reducer", reducer_sec)]:
+        print(f"{name:>8}: {elapsed:.2f}s ({args.n_trades / elapsed:,.0f} trades/sec)")
+    assert n_windows == n_candles
+
+
+if __name__ == "__main__":
+    main()
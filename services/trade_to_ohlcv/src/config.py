@@ -1,3 +1,4 @@
+from pydantic import model_validator
 from pydantic_settings import BaseSettings
 
 
@@ -8,7 +9,53 @@ class Config(BaseSettings):
     kafka_input_topic: str
     kafka_output_topic: str
     kafka_consumer_group: str
-    ohlcv_window_seconds: int
+    # the size of the windows, either in milliseconds (e.g. 250 or 90000) or in
+    # seconds
+    ohlcv_window_ms: int | None = None
+    ohlcv_window_seconds: int | None = None
+    # coarser candles rolled up from the ones of the window above, each saved in its
+    # own topic, e.g. [300, 3600] and ["ohlcv_5m", "ohlcv_1h"], with the windows in
+    # milliseconds or in seconds
+    ohlcv_rollup_window_ms: list[int] = []
+    ohlcv_rollup_window_seconds: list[int] = []
+    kafka_rollup_output_topics: list[str] = []
+    # format of the messages in the input trades topic, "json", "binary" or "batch"
+    trade_wire_format: str = "json"
+    # whether to add the technical indicators of the price predictor to the candles.
+    # The feature group and the feature view created without them don't have their
+    # columns: turning this on needs a new FEATURE_GROUP_VERSION in
+    # topic_to_feature_store and a new FEATURE_VIEW_VERSION in price_predictor
+    ohlcv_indicators: bool = False
+    # low-latency mode: the topic of the candles in progress, tagged as provisional,
+    # and the minimum time between two of them for a product
+    kafka_provisional_output_topic: str | None = None
+    ohlcv_provisional_interval_ms: int = 1000
+    # low-latency mode: close the windows on the wall clock, this long after their
+    # end, instead of waiting for the next trade
+    ohlcv_close_grace_ms: int | None = None
+    # emit forward-filled candles with no volume for the windows without trades,
+    # at most this many in a row. This closes the windows on the wall clock, after
+    # ohlcv_close_grace_ms or 2s
+    ohlcv_fill_gaps: bool = False
+    ohlcv_max_gap_windows: int = 1440
+    # number of worker processes, each processing its share of the partitions of
+    # the input topic, 0 for one per partition (at most one per core)
+    ohlcv_num_workers: int = 1
+
+    @model_validator(mode="after")
+    def windows_in_ms(self) -> "Config":
+        """
+        Fills the windows in milliseconds from the ones in seconds.
+        """
+        if self.ohlcv_window_ms is None:
+            if self.ohlcv_window_seconds is None:
+                raise ValueError("Set OHLCV_WINDOW_MS or OHLCV_WINDOW_SECONDS")
+            self.ohlcv_window_ms = self.ohlcv_window_seconds * 1000
+        if not self.ohlcv_rollup_window_ms:
+            self.ohlcv_rollup_window_ms = [
+                seconds * 1000 for seconds in self.ohlcv_rollup_window_seconds
+            ]
+        return self
 
 
 config = Config()
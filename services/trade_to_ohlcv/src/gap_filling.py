@@ -0,0 +1,55 @@
+"""
+Candles of the windows without trades.
+
+A window without trades has no candle, but the price predictor reads a dense grid
+of candles from the online store, and a missing one makes it fail or skews its
+indicators. So, when a product's next trade or heartbeat shows that windows were
+skipped, `LiveCandles` emits a forward-filled candle for each of them: open, high,
+low and close at the last close, and no volume.
+"""
+
+from typing import List
+
+# How many empty windows in a row we fill at most. A product that stays silent for
+# longer than that (e.g. a halted market) gets only the last ones.
+DEFAULT_MAX_GAP_WINDOWS = 1440
+
+
+def empty_window_candles(
+    product_id: str,
+    close: float,
+    after_end_ms: int,
+    before_end_ms: int,
+    window_ms: int,
+    max_gap_windows: int = DEFAULT_MAX_GAP_WINDOWS,
+) -> List[dict]:
+    """
+    Returns the forward-filled candles of the windows that end strictly between
+    `after_end_ms` and `before_end_ms`, or only the last `max_gap_windows` of them.
+
+    Args:
+        product_id: The product ID.
+        close: The close of the last candle, before the gap.
+        after_end_ms: The end of the last candle.
+        before_end_ms: The end of the next candle.
+        window_ms: The size of the windows, in milliseconds.
+        max_gap_windows: The maximum number of candles to return.
+
+    Returns:
+        list[dict]: The candles, in time order.
+    """
+    first_end_ms = max(
+        after_end_ms + window_ms, before_end_ms - max_gap_windows * window_ms
+    )
+    return [
+        {
+            "product_id": product_id,
+            "timestamp_ms": end_ms,
+            "open": close,
+            "high": close,
+            "low": close,
+            "close": close,
+            "volume": 0.0,
+        }
+        for end_ms in range(first_end_ms, before_end_ms, window_ms)
+    ]
@@ -0,0 +1,436 @@
+"""
+Technical indicators updated one candle at a time.
+
+They give the same values as the talib functions `add_technical_indicators` of the
+price predictor calls, run over all the candles of the product so far. Each
+indicator keeps the few running sums and the short windows of values talib keeps
+in its loops and follows the same arithmetic, so updating them costs a handful of
+operations per candle instead of re-running talib over the last N candles. The
+values agree with talib up to the last bits of rounding, which depend on how the
+C library was compiled anyway.
+
+Note that some indicators never forget their first candle (EMA, RSI, MACD, OBV,
+ATR, ADOSC), so talib run over only the last N candles gives slightly different
+values than talib run over the full history, which is what the model is trained
+on and what these indicators match.
+"""
+
+from math import sqrt
+from typing import List, Optional
+
+# The columns `add_technical_indicators` adds, in the same order
+INDICATOR_COLUMNS = [
+    "SMA_7",
+    "SMA_14",
+    "SMA_28",
+    "EMA_7",
+    "EMA_14",
+    "EMA_28",
+    "RSI_14",
+    "MACD",
+    "MACD_Signal",
+    "BB_Upper",
+    "BB_Middle",
+    "BB_Lower",
+    "Stoch_K",
+    "Stoch_D",
+    "OBV",
+    "ATR",
+    "CCI",
+    "CMF",
+]
+
+
+def _is_zero(value: float) -> bool:
+    # TA_IS_ZERO
+    return -0.00000001 < value < 0.00000001
+
+
+class SMA:
+    """
+    talib.SMA, i.e. a running total of the last `period` values.
+    """
+
+    def __init__(self, period: int) -> None:
+        self.period = period
+        self.values: List[float] = []
+        self.total = 0.0
+
+    def update(self, value: float) -> Optional[float]:
+        self.values.append(value)
+        self.total += value
+        if len(self.values) < self.period:
+            return None
+
+        sma = self.total / self.period
+        self.total -= self.values.pop(0)
+        return sma
+
+
+class EMA:
+    """
+    talib.EMA, seeded with the average of the first `period` values.
+    """
+
+    def __init__(self, period: int) -> None:
+        self.period = period
+        self.n_values = 0
+        self.total = 0.0
+        self.value: Optional[float] = None
+
+    def update(self, value: float) -> Optional[float]:
+        if self.value is None:
+            self.n_values += 1
+            self.total += value
+            if self.n_values == self.period:
+                self.value = self.total / self.period
+        else:
+            self.value = ((value - self.value) * (2.0 / (self.period + 1))) + self.value
+        return self.value
+
+
+class RSI:
+    """
+    talib.RSI, with Wilder's smoothing of the average gains and losses.
+    """
+
+    def __init__(self, period: int) -> None:
+        self.period = period
+        self.n_changes = 0
+        self.prev_close: Optional[float] = None
+        self.gain = 0.0
+        self.loss = 0.0
+
+    def update(self, close: float) -> Optional[float]:
+        if self.prev_close is None:
+            self.prev_close = close
+            return None
+
+        change = close - self.prev_close
+        self.prev_close = close
+        self.n_changes += 1
+        if self.n_changes > self.period:
+            self.loss *= self.period - 1
+            self.gain *= self.period - 1
+        if change < 0:
+            self.loss -= change
+        else:
+            self.gain += change
+        if self.n_changes < self.period:
+            return None
+
+        self.loss /= self.period
+        self.gain /= self.period
+        total = self.gain + self.loss
+        return 100.0 * (self.gain / total) if not _is_zero(total) else 0.0
+
+
+class MACD:
+    """
+    talib.MACD. Unlike a standalone EMA, talib seeds the fast EMA with the average
+    of the `fast_period` closes that end where the slow EMA starts, and returns
+    nothing until the signal line starts.
+    """
+
+    def __init__(
+        self, fast_period: int = 12, slow_period: int = 26, signal_period: int = 9
+    ) -> None:
+        self.slow_period = slow_period
+        self.n_closes = 0
+        self.fast = EMA(fast_period)
+        self.slow = EMA(slow_period)
+        self.signal = EMA(signal_period)
+
+    def update(self, close: float) -> tuple:
+        self.n_closes += 1
+        slow = self.slow.update(close)
+        if self.n_closes <= self.slow_period - self.fast.period:
+            return None, None
+
+        fast = self.fast.update(close)
+        if slow is None:
+            return None, None
+
+        macd = fast - slow
+        signal = self.signal.update(macd)
+        if signal is None:
+            return None, None
+        return macd, signal
+
+
+class BollingerBands:
+    """
+    talib.BBANDS with a simple moving average, from the running totals of the
+    values and of their squares.
+    """
+
+    def __init__(self, period: int = 20, n_std: float = 2.0) -> None:
+        self.period = period
+        self.n_std = n_std
+        self.values: List[float] = []
+        self.total = 0.0
+        self.total_squares = 0.0
+
+    def update(self, value: float) -> tuple:
+        self.values.append(value)
+        self.total += value
+        self.total_squares += value * value
+        if len(self.values) < self.period:
+            return None, None, None
+
+        middle = self.total / self.period
+        variance = self.total_squares / self.period
+        oldest = self.values.pop(0)
+        self.total -= oldest
+        self.total_squares -= oldest * oldest
+        variance -= middle * middle
+        std = sqrt(variance) if not variance < 0.00000001 else 0.0
+
+        deviation = std * self.n_std
+        return middle + deviation, middle, middle - deviation
+
+
+class Stochastic:
+    """
+    talib.STOCH, with simple moving averages for the slow %K and %D.
+    """
+
+    def __init__(
+        self, fastk_period: int = 14, slowk_period: int = 3, slowd_period: int = 3
+    ) -> None:
+        self.fastk_period = fastk_period
+        self.highs: List[float] = []
+        self.lows: List[float] = []
+        self.slowk = SMA(slowk_period)
+        self.slowd = SMA(slowd_period)
+
+    def update(self, high: float, low: float, close: float) -> tuple:
+        self.highs.append(high)
+        self.lows.append(low)
+        if len(self.highs) < self.fastk_period:
+            return None, None
+
+        highest = max(self.highs)
+        lowest = min(self.lows)
+        del self.highs[0], self.lows[0]
+        diff = (highest - lowest) / 100.0
+        fastk = (close - lowest) / diff if diff != 0.0 else 0.0
+
+        slowk = self.slowk.update(fastk)
+        if slowk is None:
+            return None, None
+        slowd = self.slowd.update(slowk)
+        if slowd is None:
+            return None, None
+        return slowk, slowd
+
+
+class OBV:
+    """
+    talib.OBV, starting from the volume of the first candle.
+    """
+
+    def __init__(self) -> None:
+        self.value: Optional[float] = None
+        self.prev_close: Optional[float] = None
+
+    def update(self, close: float, volume: float) -> float:
+        if self.value is None:
+            self.value = volume
+        elif close > self.prev_close:
+            self.value += volume
+        elif close < self.prev_close:
+            self.value -= volume
+        self.prev_close = close
+        return self.value
+
+
+class ATR:
+    """
+    talib.ATR: the average of the first `period` true ranges, and then Wilder's
+    smoothing of them.
+    """
+
+    def __init__(self, period: int = 14) -> None:
+        self.period = period
+        self.prev_close: Optional[float] = None
+        self.n_ranges = 0
+        self.total = 0.0
+        self.value: Optional[float] = None
+
+    def update(self, high: float, low: float, close: float) -> Optional[float]:
+        prev_close = self.prev_close
+        self.prev_close = close
+        if prev_close is None:
+            return None
+
+        true_range = max(high - low, abs(prev_close - high), abs(low - prev_close))
+        if self.value is None:
+            self.n_ranges += 1
+            self.total += true_range
+            if self.n_ranges == self.period:
+                self.value = self.total / self.period
+        else:
+            self.value *= self.period - 1
+            self.value += true_range
+            self.value /= self.period
+        return self.value
+
+
+class CCI:
+    """
+    talib.CCI. talib keeps the typical prices in a circular buffer and sums them
+    in the order of the buffer, not in time order, so we do the same.
+    """
+
+    def __init__(self, period: int = 14) -> None:
+        self.period = period
+        self.buffer: List[float] = []
+        self.position = 0
+
+    def update(self, high: float, low: float, close: float) -> Optional[float]:
+        typical_price = (high + low + close) / 3
+        if len(self.buffer) < self.period:
+            self.buffer.append(typical_price)
+        else:
+            self.buffer[self.position] = typical_price
+        self.position = (self.position + 1) % self.period
+        if len(self.buffer) < self.period:
+            return None
+
+        average = 0.0
+        for value in self.buffer:
+            average += value
+        average /= self.period
+        mean_deviation = 0.0
+        for value in self.buffer:
+            mean_deviation += abs(value - average)
+
+        deviation = typical_price - average
+        if deviation != 0.0 and mean_deviation != 0.0:
+            return deviation / (0.015 * (mean_deviation / self.period))
+        return 0.0
+
+
+class ADOSC:
+    """
+    talib.ADOSC, the Chaikin oscillator: the difference between a fast and a slow
+    EMA of the accumulation/distribution line, both seeded with its first value.
+    """
+
+    def __init__(self, fast_period: int = 3, slow_period: int = 10) -> None:
+        self.fast_period = fast_period
+        self.slow_period = slow_period
+        self.n_candles = 0
+        self.ad = 0.0
+        self.fast = 0.0
+        self.slow = 0.0
+
+    def update(
+        self, high: float, low: float, close: float, volume: float
+    ) -> Optional[float]:
+        high_low = high - low
+        if high_low > 0.0:
+            self.ad += (((close - low) - (high - close)) / high_low) * volume
+
+        self.n_candles += 1
+        if self.n_candles == 1:
+            self.fast = self.slow = self.ad
+        else:
+            fast_k = 2.0 / (self.fast_period + 1)
+            slow_k = 2.0 / (self.slow_period + 1)
+            self.fast = (fast_k * self.ad) + ((1.0 - fast_k) * self.fast)
+            self.slow = (slow_k * self.ad) + ((1.0 - slow_k) * self.slow)
+        if self.n_candles < self.slow_period:
+            return None
+        return self.fast - self.slow
+
+
+class TechnicalIndicators:
+    """
+    All the indicators of `add_technical_indicators`, for one product.
+
+    The state is made of plain numbers and lists, so it goes through the JSON
+    serialization of the state store with `to_dict` and `from_dict`.
+    """
+
+    def __init__(self) -> None:
+        self.sma_7 = SMA(7)
+        self.sma_14 = SMA(14)
+        self.sma_28 = SMA(28)
+        self.ema_7 = EMA(7)
+        self.ema_14 = EMA(14)
+        self.ema_28 = EMA(28)
+        self.rsi = RSI(14)
+        self.macd = MACD(12, 26, 9)
+        self.bbands = BollingerBands(20, 2.0)
+        self.stoch = Stochastic(14, 3, 3)
+        self.obv = OBV()
+        self.atr = ATR(14)
+        self.cci = CCI(14)
+        self.adosc = ADOSC(3, 10)
+
+    def update(self, candle: dict) -> dict:
+        """
+        Updates the indicators with the next candle of the product.
+
+        Args:
+            candle: The candle, with its 'high', 'low', 'close' and 'volume'.
+
+        Returns:
+            dict: The value of each indicator, None while it is warming up.
+        """
+        high = candle["high"]
+        low = candle["low"]
+        close = candle["close"]
+        volume = candle["volume"]
+
+        macd, macd_signal = self.macd.update(close)
+        bb_upper, bb_middle, bb_lower = self.bbands.update(close)
+        stoch_k, stoch_d = self.stoch.update(high, low, close)
+        return {
+            "SMA_7": self.sma_7.update(close),
+            "SMA_14": self.sma_14.update(close),
+            "SMA_28": self.sma_28.update(close),
+            "EMA_7": self.ema_7.update(close),
+            "EMA_14": self.ema_14.update(close),
+            "EMA_28": self.ema_28.update(close),
+            "RSI_14": self.rsi.update(close),
+            "MACD": macd,
+            "MACD_Signal": macd_signal,
+            "BB_Upper": bb_upper,
+            "BB_Middle": bb_middle,
+            "BB_Lower": bb_lower,
+            "Stoch_K": stoch_k,
+            "Stoch_D": stoch_d,
+            "OBV": self.obv.update(close, volume),
+            "ATR": self.atr.update(high, low, close),
+            "CCI": self.cci.update(high, low, close),
+            "CMF": self.adosc.update(high, low, close, volume),
+        }
+
+    def to_dict(self) -> dict:
+        return {name: _to_dict(indicator) for name, indicator in vars(self).items()}
+
+    @classmethod
+    def from_dict(cls, state: dict) -> "TechnicalIndicators":
+        indicators = cls()
+        for name, indicator in vars(indicators).items():
+            _update_from_dict(indicator, state[name])
+        return indicators
+
+
+def _to_dict(indicator: object) -> dict:
+    return {
+        name: _to_dict(value) if hasattr(value, "__dict__") else value
+        for name, value in vars(indicator).items()
+    }
+
+
+def _update_from_dict(indicator: object, state: dict) -> None:
+    for name, value in state.items():
+        if isinstance(value, dict):
+            # one of the indicators the indicator is made of
+            _update_from_dict(getattr(indicator, name), value)
+        else:
+            setattr(indicator, name, value)
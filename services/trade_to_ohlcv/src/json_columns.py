@@ -0,0 +1,76 @@
+"""
+Writes whole Arrow columns as JSON text, for the serializers that build the JSON
+messages of a batch column by column instead of one dict at a time.
+
+The text must be the same, byte for byte, as the "json" serializer of quixstreams
+(orjson) writes, so the consumers can't tell the messages apart.
+
+This file is the same in trade_producer and trade_to_ohlcv, keep them in sync.
+"""
+
+import re
+from typing import List, Union
+
+import pyarrow as pa
+import pyarrow.compute as pc
+from quixstreams.utils.json import dumps
+
+
+def float_to_json(column: Union[pa.Array, pa.ChunkedArray]) -> pa.Array:
+    """
+    Formats a float column as JSON numbers, written like orjson writes them.
+
+    Arrow uses the same shortest digits that round-trip, but it writes whole
+    numbers without a decimal point (100.0 -> "100"), so we add the ".0" back for
+    the consumers to still see floats. It also switches to the exponent notation at
+    other magnitudes than orjson (1e-6 -> "0.000001", 1e15 -> "1e+15"), so the few
+    values far from 1 are formatted with orjson itself.
+
+    Args:
+        column (Union[pa.Array, pa.ChunkedArray]): The float column.
+
+    Returns:
+        pa.Array: The JSON numbers, as strings.
+
+    Raises:
+        ValueError: If the column has NaN or infinite values, which JSON can't hold.
+    """
+    if isinstance(column, pa.ChunkedArray):
+        column = column.combine_chunks()
+    if not pc.all(pc.is_finite(column)).as_py():
+        raise ValueError("Float values must be finite to be written as JSON")
+
+    text = pc.cast(column, pa.string())
+    is_whole_number = pc.invert(pc.match_substring_regex(text, r"[.eE]"))
+    text = pc.if_else(
+        is_whole_number, pc.binary_join_element_wise(text, ".0", ""), text
+    )
+
+    magnitude = pc.abs(column)
+    is_far_from_one = pc.or_(
+        pc.and_(pc.less(magnitude, 1e-4), pc.not_equal(magnitude, 0.0)),
+        pc.greater_equal(magnitude, 1e15),
+    )
+    if not pc.any(is_far_from_one).as_py():
+        return text
+    far_from_one = pc.filter(column, is_far_from_one).to_pylist()
+    return pc.replace_with_mask(
+        text,
+        is_far_from_one,
+        pa.array([dumps(value).decode() for value in far_from_one], pa.string()),
+    )
+
+
+def check_product_ids(product_ids: List[str]) -> None:
+    """
+    The product IDs are written into the JSON as they are, so they must not contain
+    characters that need escaping. Kraken product IDs never do, e.g. "BTC/USD".
+
+    Raises:
+        ValueError: If a product ID contains a quote, a backslash or a control
+            character.
+    """
+    if any(re.search(r'["\\\x00-\x1f]', product_id) for product_id in product_ids):
+        raise ValueError(
+            "Product IDs must not contain quotes, backslashes or control characters"
+        )
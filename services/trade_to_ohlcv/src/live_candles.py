@@ -0,0 +1,276 @@
+"""
+Low-latency candles.
+
+With `.final()`, the candle of a window is only handed out when a later trade of
+the same partition arrives, which on a quiet pair can be long after the end of the
+window. In the low-latency mode the first resolution is aggregated by `LiveCandles`
+instead of a tumbling window, which
+
+- also sends the candle in progress, tagged as provisional, to a separate topic,
+  no more often than every `provisional_interval_ms` for each product, and
+- closes the windows on the wall clock: a `Heartbeats` thread sends a heartbeat of
+  each product to the input topic every second (or every window, if they are
+  shorter), and a heartbeat closes the windows that ended `close_grace_ms` before
+  it.
+
+With `fill_gaps`, it also emits the forward-filled candles of the empty windows
+(see src/gap_filling.py) as soon as a trade or a heartbeat passes them, so quiet
+products still get a candle per window on time. Filling the gaps always goes
+through here, with the heartbeats: without them, a product that goes quiet would
+not get the candles of its trailing windows until its next trade.
+
+quixstreams windows can't do either (a dataframe can't be branched into two
+topics, and windows only close on the timestamps of their own records), so the
+provisional candles go through their own producer, and the heartbeats through the
+input topic, to the partition the trades of their product come from: an
+application reads a single topic, so they can't have a topic of their own. Each
+heartbeat names the consumer group that sent it, and every consumer of the trades
+drops the heartbeats it did not send before they reach a window (see
+`is_trade_or_own_heartbeat`).
+"""
+
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from loguru import logger
+from quixstreams import State, message_context
+from quixstreams.kafka import Producer
+from quixstreams.utils.json import dumps
+
+from src.gap_filling import DEFAULT_MAX_GAP_WINDOWS, empty_window_candles
+
+# How often the heartbeats are sent, at most
+HEARTBEAT_INTERVAL_SECONDS = 1.0
+
+# How long after their end the heartbeats close the windows when we fill the gaps,
+# unless a grace period is given: enough for the last trades of a window to reach
+# Kafka
+DEFAULT_CLOSE_GRACE_MS = 2_000
+
+
+def product_key(product_id: str) -> str:
+    """
+    Returns the message key of a product, the same one the trade producer uses.
+    """
+    return product_id.replace("/", "-")
+
+
+def is_heartbeat(value: dict) -> bool:
+    return value.get("heartbeat", False)
+
+
+def is_trade_or_own_heartbeat(value: dict, consumer_group: Optional[str]) -> bool:
+    """
+    Returns whether a record of the input topic goes on to the candles: the trades
+    always do, the heartbeats only if `consumer_group` sent them, so the heartbeats
+    of another job never close its windows or move their expiry forward.
+
+    Args:
+        value: The record.
+        consumer_group: The consumer group of the job, or None if it sends no
+            heartbeats, to drop all of them.
+
+    Returns:
+        bool: False for the heartbeats to drop.
+    """
+    if not is_heartbeat(value):
+        return True
+    return consumer_group is not None and value.get("consumer_group") == consumer_group
+
+
+class LiveCandles:
+    """
+    A stateful step that aggregates the trades (or the partial candles) of each
+    product into the candles of a tumbling window, keeping only the window in
+    progress in the state, like `.final()` with no grace period.
+
+    It returns the candles of the windows it closes, and produces the provisional
+    candles itself.
+    """
+
+    def __init__(
+        self,
+        window_ms: int,
+        initializer: Callable,
+        reducer: Callable,
+        to_candle: Callable,
+        producer: Optional[Producer] = None,
+        provisional_topic: Optional[str] = None,
+        provisional_interval_ms: int = 1000,
+        fill_gaps: bool = False,
+        max_gap_windows: int = DEFAULT_MAX_GAP_WINDOWS,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        """
+        Args:
+            window_ms: The size of the windows, in milliseconds.
+            initializer: Returns the candle of a window from its first record.
+            reducer: Updates the candle of a window with its next record.
+            to_candle: Turns (product ID, window end, candle) into the output
+                candle.
+            producer: The producer of the provisional candles.
+            provisional_topic: The topic of the provisional candles, None to not
+                send them.
+            provisional_interval_ms: The minimum time between two provisional
+                candles of a product, in milliseconds of wall clock.
+            fill_gaps: Whether to emit candles for the windows without trades.
+            max_gap_windows: How many empty windows in a row we fill at most.
+            clock: Returns the wall-clock time in seconds.
+        """
+        self.window_ms = window_ms
+        self.initializer = initializer
+        self.reducer = reducer
+        self.to_candle = to_candle
+        self.producer = producer
+        self.provisional_topic = provisional_topic
+        self.provisional_interval_ms = provisional_interval_ms
+        self.fill_gaps = fill_gaps
+        self.max_gap_windows = max_gap_windows
+        self.clock = clock
+        # the products we have seen and the input partition of each, for the
+        # heartbeats: the trade producer picks the partitions of the products, so
+        # hashing the key could send a heartbeat to another partition
+        self.partitions: Dict[str, int] = {}
+
+    def __call__(self, value: dict, state: State) -> List[dict]:
+        """
+        Updates the window in progress of the product with a trade, a partial
+        candle or a heartbeat.
+
+        Args:
+            value: The record, with its 'product_id' and 'timestamp_ms'.
+            state: The state of the product.
+
+        Returns:
+            list[dict]: The candles of the windows this record closed.
+        """
+        product_id = value["product_id"]
+        timestamp_ms = value["timestamp_ms"]
+        # a single state value, read and written once per record:
+        # [start of the window in progress or None, its candle, end of the last
+        # closed window, wall-clock time of the last provisional candle, close of
+        # the last closed window]
+        live = state.get("live") or [None, None, 0, 0, None]
+        start_ms, candle, closed_until_ms, provisional_sent_ms, last_close = live
+
+        closed = []
+        if start_ms is not None and start_ms + self.window_ms <= timestamp_ms:
+            closed_until_ms = start_ms + self.window_ms
+            closed.append(self.to_candle(product_id, closed_until_ms, candle))
+            last_close = closed[-1]["close"]
+            start_ms = candle = None
+
+        if self.fill_gaps and start_ms is None and last_close is not None:
+            # the windows between the last closed one and the one of this record
+            window_end_ms = timestamp_ms - timestamp_ms % self.window_ms
+            gap = empty_window_candles(
+                product_id,
+                last_close,
+                closed_until_ms,
+                window_end_ms + self.window_ms,
+                self.window_ms,
+                self.max_gap_windows,
+            )
+            if gap:
+                closed.extend(gap)
+                closed_until_ms = window_end_ms
+
+        if is_heartbeat(value):
+            if closed:
+                state.set(
+                    "live",
+                    [None, None, closed_until_ms, provisional_sent_ms, last_close],
+                )
+            return closed
+
+        self.partitions[product_id] = message_context().partition
+        if timestamp_ms < closed_until_ms or (
+            start_ms is not None and timestamp_ms < start_ms
+        ):
+            # its window is closed, or older than the one in progress
+            logger.debug(f"Dropping a late record of {product_id}: {value}")
+            return closed
+
+        if start_ms is None:
+            start_ms = timestamp_ms - timestamp_ms % self.window_ms
+            candle = self.initializer(value)
+        else:
+            candle = self.reducer(candle, value)
+
+        if self.provisional_topic is not None:
+            now_ms = int(self.clock() * 1000)
+            if now_ms - provisional_sent_ms >= self.provisional_interval_ms:
+                self._send_provisional(product_id, start_ms, candle)
+                provisional_sent_ms = now_ms
+
+        state.set(
+            "live",
+            [start_ms, candle, closed_until_ms, provisional_sent_ms, last_close],
+        )
+        return closed
+
+    def _send_provisional(self, product_id: str, start_ms: int, candle: list) -> None:
+        provisional = self.to_candle(product_id, start_ms + self.window_ms, candle)
+        provisional["provisional"] = True
+        self.producer.produce(
+            topic=self.provisional_topic,
+            key=product_key(product_id),
+            value=dumps(provisional),
+            timestamp=start_ms,
+        )
+
+
+class Heartbeats(threading.Thread):
+    """
+    Sends a heartbeat of each product `LiveCandles` has seen to the input topic
+    every `interval_seconds`, timestamped `close_grace_ms` in the past, so the
+    windows of the quiet products are closed on the wall clock instead of by their
+    next trade. The heartbeats are tagged with `consumer_group`, the only one that
+    reads them.
+
+    The grace period leaves time to the trades of the end of a window to reach
+    Kafka before the window is closed.
+    """
+
+    def __init__(
+        self,
+        live_candles: LiveCandles,
+        producer: Producer,
+        input_topic: str,
+        consumer_group: str,
+        close_grace_ms: int,
+        interval_seconds: float = HEARTBEAT_INTERVAL_SECONDS,
+    ) -> None:
+        super().__init__(daemon=True)
+        self.live_candles = live_candles
+        self.producer = producer
+        self.input_topic = input_topic
+        self.consumer_group = consumer_group
+        self.close_grace_ms = close_grace_ms
+        self.interval_seconds = interval_seconds
+        self._stop_event = threading.Event()
+
+    def run(self) -> None:
+        while not self._stop_event.wait(self.interval_seconds):
+            self.send_heartbeats(int(time.time() * 1000) - self.close_grace_ms)
+
+    def send_heartbeats(self, timestamp_ms: int) -> None:
+        for product_id, partition in list(self.live_candles.partitions.items()):
+            self.producer.produce(
+                topic=self.input_topic,
+                key=product_key(product_id),
+                partition=partition,
+                value=dumps(
+                    {
+                        "product_id": product_id,
+                        "timestamp_ms": timestamp_ms,
+                        "heartbeat": True,
+                        "consumer_group": self.consumer_group,
+                    }
+                ),
+                timestamp=timestamp_ms,
+            )
+
+    def stop(self) -> None:
+        self._stop_event.set()
@@ -1,37 +1,242 @@
-from datetime import timedelta
-from typing import Any, List, Optional, Tuple
+from functools import partial
+from typing import Any, List, Optional, Tuple, Union
 
+import numpy as np
 from loguru import logger
-from quixstreams import Application
+from quixstreams import Application, State
 
+from src.gap_filling import DEFAULT_MAX_GAP_WINDOWS
+from src.indicators import TechnicalIndicators
+from src.live_candles import (
+    DEFAULT_CLOSE_GRACE_MS,
+    HEARTBEAT_INTERVAL_SECONDS,
+    Heartbeats,
+    LiveCandles,
+    is_heartbeat,
+    is_trade_or_own_heartbeat,
+)
+from src.trade_codec import TradeDeserializer
 
-def init_ohlcv_candle(trade: dict) -> dict:
+# The state of a window is a fixed-layout list [open, high, low, close, volume],
+# instead of a dict, because the state store reads and writes it on every trade:
+# the JSON of 5 floats is 40% shorter than the one of the dict, and about 3 times
+# faster to read and write (see benchmarks/bench_candle_state.py). The product ID
+# is not stored at all, it comes from the message key when the window is closed.
+OPEN, HIGH, LOW, CLOSE, VOLUME = range(5)
+
+
+def from_legacy_candle(candle: Union[list, dict]) -> list:
+    """
+    Returns the list state of a window from the dict state of the previous
+    versions, e.g. {"open": 1.0, "high": 2.0, ..., "product_id": "BTC/USD"}, so
+    the windows still open in the state store when we deploy keep going.
+    """
+    if isinstance(candle, dict):
+        return [
+            candle["open"],
+            candle["high"],
+            candle["low"],
+            candle["close"],
+            candle["volume"],
+        ]
+    return candle
+
+
+def init_ohlcv_candle(trade: dict) -> list:
     """
     Returns the initial OHLCV candle when the first trade in that window is received.
     """
-    return {
-        "open": trade["price"],
-        "high": trade["price"],
-        "low": trade["price"],
-        "close": trade["price"],
-        "volume": trade["quantity"],
-        "product_id": trade["product_id"],
-    }
+    price = trade["price"]
+    return [price, price, price, price, trade["quantity"]]
 
 
-def update_ohlcv_candle(candle: dict, trade: dict) -> dict:
+def update_ohlcv_candle(candle: list, trade: dict) -> list:
     """
     Updates the OHLCV candle with the latest trade data.
     """
-    candle["high"] = max(candle["high"], trade["price"])
-    candle["low"] = min(candle["low"], trade["price"])
-    candle["close"] = trade["price"]
-    candle["volume"] += trade["quantity"]
-    candle["product_id"] = trade["product_id"]
+    candle = from_legacy_candle(candle)
+    price = trade["price"]
+    if price > candle[HIGH]:
+        candle[HIGH] = price
+    elif price < candle[LOW]:
+        candle[LOW] = price
+    candle[CLOSE] = price
+    candle[VOLUME] += trade["quantity"]
+
+    return candle
+
+
+def trades_to_window_candles(trades: dict, window_ms: int) -> list[dict]:
+    """
+    Pre-aggregates the trades of one message into one partial candle per window,
+    so a batch of trades goes through the stateful window once per window instead
+    of once per trade.
+
+    The message is either a batch of trades of one product (see
+    `src.trade_codec.decode_trade_batch`) or a single trade. Each partial candle
+    has the timestamp of its first trade, which is inside its window.
+
+    Args:
+        trades: The decoded message.
+        window_ms: The size of the windows, in milliseconds.
+
+    Returns:
+        list[dict]: The partial candles, in time order.
+    """
+    if is_heartbeat(trades):
+        # the low-latency mode closes the windows with them
+        return [trades]
+
+    if "n_trades" not in trades:
+        # a single trade
+        price = trades["price"]
+        return [
+            {
+                "open": price,
+                "high": price,
+                "low": price,
+                "close": price,
+                "volume": trades["quantity"],
+                "product_id": trades["product_id"],
+                "timestamp_ms": trades["timestamp_ms"],
+            }
+        ]
+
+    timestamps_ms = trades["timestamps_ms"]
+    prices = trades["prices"]
+    quantities = trades["quantities"]
+    if len(timestamps_ms) == 0:
+        return []
+
+    if np.any(np.diff(timestamps_ms) < 0):
+        order = np.argsort(timestamps_ms, kind="stable")
+        timestamps_ms = timestamps_ms[order]
+        prices = prices[order]
+        quantities = quantities[order]
+
+    # the trades are sorted, so each window is a run of consecutive trades
+    windows = timestamps_ms // window_ms
+    starts = np.flatnonzero(np.diff(windows, prepend=windows[0] - 1))
+    ends = np.append(starts[1:], len(windows)) - 1
+
+    # cumsum adds the quantities one by one, like update_ohlcv_candle does, while
+    # np.add.reduceat uses pairwise sums that round differently
+    volumes = [
+        float(quantities[start : end + 1].cumsum()[-1])
+        for start, end in zip(starts.tolist(), ends.tolist())
+    ]
+
+    return [
+        {
+            "open": open_,
+            "high": high,
+            "low": low,
+            "close": close,
+            "volume": volume,
+            "product_id": trades["product_id"],
+            "timestamp_ms": timestamp_ms,
+        }
+        for open_, high, low, close, volume, timestamp_ms in zip(
+            prices[starts].tolist(),
+            np.maximum.reduceat(prices, starts).tolist(),
+            np.minimum.reduceat(prices, starts).tolist(),
+            prices[ends].tolist(),
+            volumes,
+            timestamps_ms[starts].tolist(),
+        )
+    ]
+
+
+def init_ohlcv_candle_from_partial(candle: dict) -> list:
+    """
+    Returns the initial OHLCV candle when the first partial candle in that window
+    is received.
+    """
+    return [
+        candle["open"],
+        candle["high"],
+        candle["low"],
+        candle["close"],
+        candle["volume"],
+    ]
+
+
+def merge_ohlcv_candles(candle: list, partial: dict) -> list:
+    """
+    Updates the OHLCV candle with a later partial candle of the same window.
+    """
+    candle = from_legacy_candle(candle)
+    if partial["high"] > candle[HIGH]:
+        candle[HIGH] = partial["high"]
+    if partial["low"] < candle[LOW]:
+        candle[LOW] = partial["low"]
+    candle[CLOSE] = partial["close"]
+    candle[VOLUME] += partial["volume"]
 
     return candle
 
 
+def product_id_from_key(key: Union[bytes, str]) -> str:
+    """
+    Returns the product ID of a message key. The trade producer keys the trades
+    with the product ID, with "/" replaced by "-", e.g. b"BTC-USD".
+    """
+    if isinstance(key, bytes):
+        key = key.decode()
+    return key.replace("-", "/")
+
+
+def window_to_ohlcv_candle(
+    window: dict, key: Union[bytes, str], timestamp: int, headers: Any
+) -> dict:
+    """
+    Turns a closed window into the OHLCV candle we save in the output topic,
+    timestamped with the end of the window.
+    """
+    return to_ohlcv_candle(product_id_from_key(key), window["end"], window["value"])
+
+
+def to_ohlcv_candle(product_id: str, end_ms: int, candle: Union[list, dict]) -> dict:
+    """
+    Returns the OHLCV candle we save in the output topic from the state of its
+    window, timestamped with the end of the window.
+    """
+    candle = from_legacy_candle(candle)
+    return {
+        "product_id": product_id,
+        "timestamp_ms": end_ms,
+        "open": candle[OPEN],
+        "high": candle[HIGH],
+        "low": candle[LOW],
+        "close": candle[CLOSE],
+        "volume": candle[VOLUME],
+    }
+
+
+def window_name(window_ms: int) -> str:
+    """
+    Returns a short name of a window size, e.g. "60s" or "250ms".
+    """
+    return f"{window_ms // 1000}s" if window_ms % 1000 == 0 else f"{window_ms}ms"
+
+
+def check_rollups(ohlcv_window_ms: int, rollups: List[Tuple[int, str]]) -> None:
+    """
+    Checks that each roll-up window is a multiple of the window before it, so every
+    finer candle falls in exactly one coarser window.
+    """
+    if ohlcv_window_ms <= 0:
+        raise ValueError("The window must be at least 1ms")
+    window_ms = ohlcv_window_ms
+    for rollup_window_ms, _ in rollups:
+        if rollup_window_ms <= window_ms or rollup_window_ms % window_ms != 0:
+            raise ValueError(
+                f"The roll-up window of {window_name(rollup_window_ms)} must be a "
+                f"multiple of the window of {window_name(window_ms)} before it"
+            )
+        window_ms = rollup_window_ms
+
+
 def custom_ts_extractor(
     value: Any,
     headers: Optional[List[Tuple[str, bytes]]],
@@ -45,78 +250,281 @@ def custom_ts_extractor(
     return value["timestamp_ms"]
 
 
+def add_technical_indicators(candle: dict, state: State, state_key: str) -> dict:
+    """
+    Adds the technical indicators of the product to its next candle, so the price
+    predictor reads them instead of recomputing them over the last candles.
+
+    Args:
+        candle: The OHLCV candle.
+        state: The state of the message key, i.e. of the product.
+        state_key: Where the indicators are kept in the state, one per resolution.
+
+    Returns:
+        dict: The candle, with the indicators as extra columns.
+    """
+    indicators_state = state.get(state_key)
+    indicators = (
+        TechnicalIndicators.from_dict(indicators_state)
+        if indicators_state is not None
+        else TechnicalIndicators()
+    )
+    candle.update(indicators.update(candle))
+    state.set(state_key, indicators.to_dict())
+    return candle
+
+
 def transform_trade_to_ohlcv(
     kafka_broker_address: str,
     kafka_input_topic: str,
     kafka_output_topic: str,
     kafka_consumer_group_id: str,
-    ohlcv_window_seconds: int,
+    ohlcv_window_ms: int,
+    trade_wire_format: str = "json",
+    rollups: Optional[List[Tuple[int, str]]] = None,
+    with_indicators: bool = False,
+    kafka_provisional_output_topic: Optional[str] = None,
+    provisional_interval_ms: int = 1000,
+    close_grace_ms: Optional[int] = None,
+    fill_gaps: bool = False,
+    max_gap_windows: int = DEFAULT_MAX_GAP_WINDOWS,
+    state_dir: str = "state",
 ):
     """
     Reads trades from the input Kafka topic, aggregates them into OHLCV data and saves
     them in the output Kafka topic.
 
+    Coarser candles (e.g. 5m and 1h on top of 1m) are rolled up from the finished
+    candles of the resolution below, instead of from the trades, so a single job
+    reads and deserializes the trades once for all the resolutions, and each
+    coarser window only sees a handful of candles. Their open, high, low and close
+    are the ones of a direct aggregation of the trades; their volume is a sum of
+    partial sums, so its last bits can differ.
+
     Args:
         kafka_broker_address: The address of the Kafka broker.
         kafka_input_topic: The name of the Kafka topic to read the trades.
         kafka_output_topic: The name of the Kafka topic to save the OHLCV data.
         kafka_consumer_group_id: The ID of the Kafka consumer group.
+        ohlcv_window_ms: The size of the OHLCV windows, in milliseconds. The
+            windows are aligned on multiples of their size since the epoch, so
+            they don't have to divide a minute (e.g. 250ms, 7s or 90s).
+        trade_wire_format: The format of the trades in the input topic: "json",
+            the compact "binary" format of `src.trade_codec`, or "batch", with
+            batches of trades in each message. The binary deserializer reads all
+            the formats, so the consumers can be switched before the producers.
+        rollups: The coarser resolutions, as (window in milliseconds, output topic)
+            pairs, from the finest to the coarsest. Each window must be a multiple
+            of the one before it.
+        with_indicators: Whether to add the technical indicators of the price
+            predictor to each candle, updated from the candles of the product
+            seen so far.
+        kafka_provisional_output_topic: The Kafka topic where we also send the
+            candle in progress of the first resolution, tagged as provisional.
+        provisional_interval_ms: The minimum time between two provisional candles
+            of a product, in milliseconds.
+        close_grace_ms: If set, the windows of the first resolution are closed on
+            the wall clock, this many milliseconds after their end, instead of by
+            the next trade of the partition.
+        fill_gaps: Whether to emit forward-filled candles with no volume for the
+            windows without trades of each product, so the output topics hold a
+            dense series. The coarser resolutions are rolled up from a dense
+            series, so they are dense too. The windows of a quiet product are
+            only known to be empty once the wall clock passes them, so this
+            closes the windows on the wall clock, after `close_grace_ms` or
+            DEFAULT_CLOSE_GRACE_MS.
+        max_gap_windows: How many empty windows in a row we fill at most.
+        state_dir: The directory of the state stores of the windows.
 
     Returns:
         None
     """
     # Create an Application instance with Kafka config
     app = Application(
-        broker_address=kafka_broker_address, consumer_group=kafka_consumer_group_id
+        broker_address=kafka_broker_address,
+        consumer_group=kafka_consumer_group_id,
+        state_dir=state_dir,
     )
 
     input_topic = app.topic(
         name=kafka_input_topic,
-        value_deserializer="json",
+        value_deserializer=(
+            TradeDeserializer() if trade_wire_format != "json" else "json"
+        ),
         timestamp_extractor=custom_ts_extractor,
     )
-    output_topic = app.topic(name=kafka_output_topic, value_serializer="json")
+    rollups = rollups or []
+    check_rollups(ohlcv_window_ms, rollups)
+    resolutions = [(ohlcv_window_ms, kafka_output_topic), *rollups]
+    output_topics = {
+        topic_name: app.topic(name=topic_name, value_serializer="json")
+        for _, topic_name in resolutions
+    }
 
     # Create a Quixstream dataframe
     sdf = app.dataframe(input_topic)
 
     # sdf.update(logger.debug)
 
-    # Create the 1-min candles
-    sdf = (
-        sdf.tumbling_window(duration_ms=timedelta(seconds=ohlcv_window_seconds)).reduce(
-            initializer=init_ohlcv_candle, reducer=update_ohlcv_candle
+    if fill_gaps and close_grace_ms is None:
+        # the heartbeats fill the trailing windows of the products that go quiet
+        close_grace_ms = DEFAULT_CLOSE_GRACE_MS
+        logger.info(
+            f"Filling the gaps, so closing the windows {close_grace_ms}ms after "
+            "their end on the wall clock"
         )
-        # .current()
-        .final()
+
+    # The low-latency mode aggregates the first resolution with LiveCandles instead
+    # of a tumbling window (see src/live_candles.py)
+    low_latency = (
+        kafka_provisional_output_topic is not None or close_grace_ms is not None
     )
+    # The heartbeats share the input topic with the trades, so we drop the ones we
+    # don't send ourselves, i.e. all of them outside of the low-latency mode, before
+    # they reach a window
+    sdf = sdf.filter(
+        partial(
+            is_trade_or_own_heartbeat,
+            consumer_group=(
+                kafka_consumer_group_id if close_grace_ms is not None else None
+            ),
+        )
+    )
+
+    if trade_wire_format == "batch":
+        # Turn each batch of trades into a few partial candles, one per window,
+        # each with the timestamp of its window
+        sdf = sdf.apply(
+            lambda trades: trades_to_window_candles(trades, ohlcv_window_ms),
+            expand=True,
+        )
+        sdf = sdf.set_timestamp(
+            lambda candle, key, timestamp, headers: candle["timestamp_ms"]
+        )
+        initializer, reducer = init_ohlcv_candle_from_partial, merge_ohlcv_candles
+    else:
+        initializer, reducer = init_ohlcv_candle, update_ohlcv_candle
+
+    live_candles = None
+    if low_latency:
+        provisional_topic = None
+        if kafka_provisional_output_topic is not None:
+            provisional_topic = app.topic(
+                name=kafka_provisional_output_topic, value_serializer="json"
+            ).name
+        # for the provisional candles and the heartbeats, created once all the
+        # topics are declared because it creates them
+        producer = app.get_producer()
+        live_candles = LiveCandles(
+            window_ms=ohlcv_window_ms,
+            initializer=initializer,
+            reducer=reducer,
+            to_candle=to_ohlcv_candle,
+            producer=producer,
+            provisional_topic=provisional_topic,
+            provisional_interval_ms=provisional_interval_ms,
+            fill_gaps=fill_gaps,
+            max_gap_windows=max_gap_windows,
+        )
+
+    for i, (window_ms, topic_name) in enumerate(resolutions):
+        if i == 0 and live_candles is not None:
+            # the candles of the closed windows, timestamped with their start like
+            # `final` does
+            sdf = sdf.apply(live_candles, stateful=True, expand=True)
+            sdf = sdf.set_timestamp(
+                lambda candle, key, timestamp, headers: candle["timestamp_ms"]
+                - ohlcv_window_ms
+            )
+        else:
+            # Create the candles of this resolution. `final` hands out each window
+            # once it is closed, timestamped with its start, so the closed candles
+            # go straight into the windows of the next resolution.
+            sdf = (
+                sdf.tumbling_window(duration_ms=window_ms)
+                .reduce(initializer=initializer, reducer=reducer)
+                # .current()
+                .final()
+            )
+            sdf = sdf.apply(window_to_ohlcv_candle, metadata=True)
 
-    sdf.update(logger.debug)
+        if with_indicators:
+            sdf = sdf.apply(
+                partial(
+                    add_technical_indicators,
+                    state_key=f"indicators_{window_name(window_ms)}",
+                ),
+                stateful=True,
+            )
+        sdf.update(logger.debug)
 
-    sdf["open"] = sdf["value"]["open"]
-    sdf["high"] = sdf["value"]["high"]
-    sdf["low"] = sdf["value"]["low"]
-    sdf["close"] = sdf["value"]["close"]
-    sdf["volume"] = sdf["value"]["volume"]
-    sdf["product_id"] = sdf["value"]["product_id"]
-    sdf["timestamp_ms"] = sdf["end"]
+        # Push the OHLCV data to the output Kafka topic of this resolution
+        sdf = sdf.to_topic(output_topics[topic_name])
 
-    # Keep only the necessary columns
-    sdf = sdf[["product_id", "timestamp_ms", "open", "high", "low", "close", "volume"]]
+        # the next resolution is rolled up from these candles
+        initializer, reducer = init_ohlcv_candle_from_partial, merge_ohlcv_candles
 
-    # Push the OHLCV data to the output Kafka topic
-    sdf = sdf.to_topic(output_topic)
+    if not low_latency:
+        app.run(sdf)
+        return
 
-    app.run(sdf)
+    with producer:
+        heartbeats = None
+        if close_grace_ms is not None:
+            heartbeats = Heartbeats(
+                live_candles=live_candles,
+                producer=producer,
+                input_topic=input_topic.name,
+                consumer_group=kafka_consumer_group_id,
+                close_grace_ms=close_grace_ms,
+                # sub-second windows are closed at the pace of their size
+                interval_seconds=min(
+                    HEARTBEAT_INTERVAL_SECONDS, ohlcv_window_ms / 1000
+                ),
+            )
+            heartbeats.start()
+        try:
+            app.run(sdf)
+        finally:
+            if heartbeats is not None:
+                heartbeats.stop()
 
 
 if __name__ == "__main__":
     from src.config import config
 
-    transform_trade_to_ohlcv(
+    if len(config.ohlcv_rollup_window_ms) != len(config.kafka_rollup_output_topics):
+        raise ValueError("Each roll-up window needs its own output topic")
+
+    kwargs = dict(
         kafka_broker_address=config.kafka_broker_address,
         kafka_input_topic=config.kafka_input_topic,
         kafka_output_topic=config.kafka_output_topic,
         kafka_consumer_group_id=config.kafka_consumer_group,
-        ohlcv_window_seconds=config.ohlcv_window_seconds,
+        ohlcv_window_ms=config.ohlcv_window_ms,
+        trade_wire_format=config.trade_wire_format,
+        rollups=list(
+            zip(config.ohlcv_rollup_window_ms, config.kafka_rollup_output_topics)
+        ),
+        with_indicators=config.ohlcv_indicators,
+        kafka_provisional_output_topic=config.kafka_provisional_output_topic,
+        provisional_interval_ms=config.ohlcv_provisional_interval_ms,
+        close_grace_ms=config.ohlcv_close_grace_ms,
+        fill_gaps=config.ohlcv_fill_gaps,
+        max_gap_windows=config.ohlcv_max_gap_windows,
     )
+
+    num_workers = config.ohlcv_num_workers
+    if num_workers != 1:
+        from src.worker_pool import num_topic_partitions, num_workers_for, run_workers
+
+        num_workers = num_workers_for(
+            num_workers,
+            num_topic_partitions(config.kafka_broker_address, config.kafka_input_topic),
+        )
+        logger.info(f"Running {num_workers} workers")
+
+    if num_workers == 1:
+        transform_trade_to_ohlcv(**kwargs)
+    else:
+        run_workers(num_workers, **kwargs)
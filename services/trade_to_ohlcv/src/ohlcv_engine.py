@@ -0,0 +1,418 @@
+"""
+A vectorized OHLCV engine for historical backfills, without Kafka.
+
+It computes the same candles as the streaming pipeline of `src.main`, but a whole
+batch of trades at a time with numpy, instead of one trade at a time through the
+stateful window and its RocksDB state.
+
+Usage:
+    poetry run python -m src.ohlcv_engine --input ../trade_producer/cache \\
+        --window-seconds 60 --output-parquet ohlcv.parquet
+
+or `--window-ms 250` for windows that are not whole seconds.
+"""
+
+import argparse
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from loguru import logger
+
+from src.json_columns import check_product_ids, float_to_json
+
+# The columns of the trades, as saved by the trade producer
+TRADE_SCHEMA = pa.schema(
+    [
+        ("product_id", pa.string()),
+        ("quantity", pa.float64()),
+        ("price", pa.float64()),
+        ("timestamp_ms", pa.int64()),
+    ]
+)
+
+# The columns of the candles, like the messages of the output topic
+CANDLE_SCHEMA = pa.schema(
+    [
+        ("product_id", pa.string()),
+        ("timestamp_ms", pa.int64()),
+        ("open", pa.float64()),
+        ("high", pa.float64()),
+        ("low", pa.float64()),
+        ("close", pa.float64()),
+        ("volume", pa.float64()),
+    ]
+)
+
+FILE_FORMATS = {".parquet": "parquet", ".arrow": "arrow", ".feather": "arrow"}
+
+
+class _OpenCandle:
+    """
+    The last window of a product, which the next trades can still update, and the
+    highest timestamp seen so far for that product.
+    """
+
+    __slots__ = ("window", "open", "high", "low", "close", "volume", "latest_ms")
+
+    def __init__(self) -> None:
+        self.window: Optional[int] = None
+        self.latest_ms = 0
+
+
+class OHLCVEngine:
+    """
+    Aggregates batches of trades into OHLCV candles, product by product.
+
+    The candles match the ones of the streaming pipeline exactly, as long as each
+    product has a partition of its own:
+
+    - the trades are taken in the order they come, like the messages of a
+      partition, and a trade is dropped if its window already closed, i.e. if it
+      ends before the highest timestamp seen so far. This is what quixstreams
+      does with a grace period of 0.
+    - open, high, low and close come from the first, highest, lowest and last
+      trade of each window, in that order.
+    - the volume adds the quantities one by one, in the same order as
+      `update_ohlcv_candle`, so it is the same float, bit by bit.
+
+    Every candle is timestamped with the end of its window. Unlike the streaming
+    pipeline, which only emits a window once a later trade closes it, `flush`
+    returns the last window of each product too.
+    """
+
+    def __init__(self, window_ms: int) -> None:
+        if window_ms <= 0:
+            raise ValueError("window_ms must be positive")
+        self.window_ms = window_ms
+        self._open_candles: Dict[str, _OpenCandle] = {}
+
+    def add(self, trades: pa.Table | pa.RecordBatch) -> pa.Table:
+        """
+        Adds a batch of trades, with the columns of TRADE_SCHEMA, in the order they
+        happened for each product.
+
+        Returns:
+            pa.Table: The candles closed by these trades.
+        """
+        if trades.num_rows == 0:
+            return CANDLE_SCHEMA.empty_table()
+
+        product_ids = pa.chunked_array(
+            [trades.column("product_id")], type=pa.string()
+        ).combine_chunks()
+        encoded = product_ids.dictionary_encode()
+        codes = encoded.indices.to_numpy(zero_copy_only=False)
+        timestamps_ms = _to_numpy(trades.column("timestamp_ms"), np.int64)
+        prices = _to_numpy(trades.column("price"), np.float64)
+        quantities = _to_numpy(trades.column("quantity"), np.float64)
+
+        single_product = len(encoded.dictionary) == 1
+        tables = []
+        for code, product_id in enumerate(encoded.dictionary.to_pylist()):
+            # a stable selection keeps the order of the trades of each product
+            rows = slice(None) if single_product else np.flatnonzero(codes == code)
+            columns = self._add_product(
+                product_id, timestamps_ms[rows], prices[rows], quantities[rows]
+            )
+            if columns is not None:
+                tables.append(_to_table(product_id, *columns, window_ms=self.window_ms))
+        return _concat(tables)
+
+    def flush(self) -> pa.Table:
+        """
+        Returns the last, still open, candle of each product, and forgets them.
+        """
+        tables = []
+        for product_id, candle in self._open_candles.items():
+            if candle.window is None:
+                continue
+            tables.append(
+                _to_table(
+                    product_id,
+                    np.array([candle.window], dtype=np.int64),
+                    *(
+                        np.array([value], dtype=np.float64)
+                        for value in (
+                            candle.open,
+                            candle.high,
+                            candle.low,
+                            candle.close,
+                            candle.volume,
+                        )
+                    ),
+                    window_ms=self.window_ms,
+                )
+            )
+        self._open_candles = {}
+        return _concat(tables)
+
+    def _add_product(
+        self,
+        product_id: str,
+        timestamps_ms: np.ndarray,
+        prices: np.ndarray,
+        quantities: np.ndarray,
+    ) -> Optional[Tuple[np.ndarray, ...]]:
+        """
+        Adds the trades of one product, and returns the columns of the candles they
+        closed (window, open, high, low, close, volume), if any.
+        """
+        candle = self._open_candles.setdefault(product_id, _OpenCandle())
+        window_ms = self.window_ms
+
+        # The highest timestamp before each trade. A trade whose window ends at or
+        # before it is late, and dropped. The late trades never raise the highest
+        # timestamp, so we can take it over all the trades.
+        latest_ms = np.maximum.accumulate(timestamps_ms)
+        latest_before_ms = np.empty_like(latest_ms)
+        latest_before_ms[0] = candle.latest_ms
+        np.maximum(latest_ms[:-1], candle.latest_ms, out=latest_before_ms[1:])
+        candle.latest_ms = max(candle.latest_ms, int(latest_ms[-1]))
+
+        windows = timestamps_ms - timestamps_ms % window_ms
+        on_time = windows + window_ms > latest_before_ms
+        if not on_time.all():
+            windows = windows[on_time]
+            prices = prices[on_time]
+            quantities = quantities[on_time]
+        if len(windows) == 0:
+            return None
+
+        # Without the late trades, the windows never go back in time, so each one is
+        # a run of consecutive trades
+        starts = np.flatnonzero(np.diff(windows, prepend=windows[0] - 1))
+        ends = np.append(starts[1:], len(windows))
+        opens = prices[starts]
+        highs = np.maximum.reduceat(prices, starts)
+        lows = np.minimum.reduceat(prices, starts)
+        closes = prices[ends - 1]
+        initial_volumes = np.zeros(len(starts))
+
+        # the first run can continue the open candle of the previous batch
+        if candle.window == windows[0]:
+            opens[0] = candle.open
+            highs[0] = max(highs[0], candle.high)
+            lows[0] = min(lows[0], candle.low)
+            initial_volumes[0] = candle.volume
+        volumes = _sequential_sums(quantities, starts, ends - starts, initial_volumes)
+
+        closed = None
+        if candle.window is not None and candle.window != windows[0]:
+            closed = (
+                np.array([candle.window], dtype=np.int64),
+                np.array([candle.open]),
+                np.array([candle.high]),
+                np.array([candle.low]),
+                np.array([candle.close]),
+                np.array([candle.volume]),
+            )
+
+        # the last run stays open, the next trades can still update it
+        candle.window = int(windows[starts[-1]])
+        candle.open = float(opens[-1])
+        candle.high = float(highs[-1])
+        candle.low = float(lows[-1])
+        candle.close = float(closes[-1])
+        candle.volume = float(volumes[-1])
+
+        columns = (windows[starts[:-1]], opens[:-1], highs[:-1], lows[:-1])
+        columns = (*columns, closes[:-1], volumes[:-1])
+        if closed is not None:
+            columns = tuple(
+                np.concatenate([before, after])
+                for before, after in zip(closed, columns)
+            )
+        if len(columns[0]) == 0:
+            return None
+        return columns
+
+
+def compute_ohlcv_candles(trades: pa.Table, window_ms: int) -> pa.Table:
+    """
+    Returns all the candles of the given trades, including the last window of each
+    product.
+    """
+    engine = OHLCVEngine(window_ms)
+    return _sort(_concat([engine.add(trades), engine.flush()]))
+
+
+def read_trade_batches(
+    path: str, batch_size: int = 1_000_000
+) -> Iterator[pa.RecordBatch]:
+    """
+    Reads the trades of the parquet and Arrow files at `path` (a file, or a
+    directory like the trade cache of the trade producer), in the order of the
+    files, which for the cache is day by day.
+    """
+    root = Path(path)
+    files = [root] if root.is_file() else sorted(root.rglob("*"))
+
+    for file in files:
+        file_format = FILE_FORMATS.get(file.suffix)
+        if file_format is None:
+            continue
+        dataset = ds.dataset(str(file), schema=TRADE_SCHEMA, format=file_format)
+        yield from dataset.to_batches(batch_size=batch_size)
+
+
+def write_candles_to_parquet(candles: pa.Table, path: str) -> None:
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    pq.write_table(candles, path)
+
+
+def produce_candles(
+    candles: pa.Table,
+    kafka_broker_address: str,
+    kafka_topic: str,
+    producer_extra_config: Optional[dict] = None,
+) -> None:
+    """
+    Saves the candles in the output topic, with the same keys and values as the
+    streaming pipeline. The producer batches and compresses the messages, since
+    they are all sent at once.
+    """
+    from quixstreams import Application
+
+    app = Application(
+        broker_address=kafka_broker_address,
+        producer_extra_config=producer_extra_config
+        or {"linger.ms": 50, "batch.size": 1_000_000, "compression.type": "lz4"},
+    )
+    keys, values = serialize_candles(candles)
+
+    with app.get_producer() as producer:
+        for key, value in zip(keys, values):
+            producer.produce(topic=kafka_topic, value=value, key=key)
+    logger.info(f"Produced {candles.num_rows} candles to {kafka_topic}")
+
+
+def serialize_candles(candles: pa.Table) -> Tuple[List[str], List[bytes]]:
+    """
+    Serializes the candles into Kafka message keys and values, working on whole
+    columns at a time instead of creating a dict per candle.
+
+    The values are the same JSON documents the "json" serializer of the streaming
+    pipeline produces, e.g.
+    {"product_id":"BTC/USD","timestamp_ms":60000,"open":100.0,...}.
+
+    Args:
+        candles (pa.Table): The candles, with the columns of CANDLE_SCHEMA.
+
+    Returns:
+        Tuple[List[str], List[bytes]]: The message keys (the product IDs, with "/"
+            replaced by "-") and the message values.
+    """
+    product_ids = candles.column("product_id")
+    check_product_ids(pc.unique(product_ids).to_pylist())
+
+    parts = ['{"product_id":"', product_ids, '","timestamp_ms":']
+    parts.append(pc.cast(candles.column("timestamp_ms"), pa.string()))
+    for name in ["open", "high", "low", "close", "volume"]:
+        parts += [f',"{name}":', float_to_json(candles.column(name))]
+    values = pc.binary_join_element_wise(*parts, "}", "")
+
+    keys = pc.replace_substring(product_ids, "/", "-")
+    return keys.to_pylist(), pc.cast(values, pa.binary()).to_pylist()
+
+
+def _sequential_sums(
+    values: np.ndarray, starts: np.ndarray, lengths: np.ndarray, initial: np.ndarray
+) -> np.ndarray:
+    """
+    Returns the sum of each run of values, added one by one from `initial`, so it
+    rounds exactly like a Python loop would (np.add.reduceat and np.sum use pairwise
+    sums, which round differently).
+    """
+    if len(starts) == 0:
+        return initial
+
+    if len(starts) <= int(lengths.max()):
+        # a few long runs: cumsum is sequential
+        return np.array(
+            [
+                np.cumsum(np.append(value, values[start : start + length]))[-1]
+                for start, length, value in zip(
+                    starts.tolist(), lengths.tolist(), initial.tolist()
+                )
+            ]
+        )
+
+    # many short runs: add the k-th value of every run that has one, for each k.
+    # The runs that have one get fewer as k grows, so this touches each value once
+    sums = initial.copy()
+    active = np.arange(len(starts))
+    for k in range(int(lengths.max())):
+        if k > 0:
+            active = active[lengths[active] > k]
+        sums[active] += values[starts[active] + k]
+    return sums
+
+
+def _to_numpy(column: pa.ChunkedArray | pa.Array, dtype: type) -> np.ndarray:
+    if isinstance(column, pa.ChunkedArray):
+        column = column.combine_chunks()
+    return column.to_numpy(zero_copy_only=False).astype(dtype, copy=False)
+
+
+def _to_table(
+    product_id: str,
+    windows: np.ndarray,
+    opens: np.ndarray,
+    highs: np.ndarray,
+    lows: np.ndarray,
+    closes: np.ndarray,
+    volumes: np.ndarray,
+    window_ms: int,
+) -> pa.Table:
+    return pa.table(
+        [
+            pa.repeat(pa.scalar(product_id, pa.string()), len(windows)),
+            pa.array(windows + window_ms, pa.int64()),
+            pa.array(opens, pa.float64()),
+            pa.array(highs, pa.float64()),
+            pa.array(lows, pa.float64()),
+            pa.array(closes, pa.float64()),
+            pa.array(volumes, pa.float64()),
+        ],
+        schema=CANDLE_SCHEMA,
+    )
+
+
+def _concat(tables: List[pa.Table]) -> pa.Table:
+    if not tables:
+        return CANDLE_SCHEMA.empty_table()
+    return pa.concat_tables(tables)
+
+
+def _sort(candles: pa.Table) -> pa.Table:
+    return candles.sort_by([("product_id", "ascending"), ("timestamp_ms", "ascending")])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--input", required=True, help="A parquet/Arrow file or dir")
+    window = parser.add_mutually_exclusive_group(required=True)
+    window.add_argument("--window-seconds", type=int)
+    window.add_argument("--window-ms", type=int)
+    parser.add_argument("--output-parquet", help="Where to write the candles")
+    parser.add_argument("--kafka-broker-address", help="To produce the candles")
+    parser.add_argument("--kafka-topic", help="The output topic of the candles")
+    args = parser.parse_args()
+
+    if args.output_parquet is None and args.kafka_topic is None:
+        parser.error("Pass --output-parquet, --kafka-topic or both")
+
+    engine = OHLCVEngine(args.window_ms or args.window_seconds * 1000)
+    tables = [engine.add(batch) for batch in read_trade_batches(args.input)]
+    candles = _sort(_concat([*tables, engine.flush()]))
+    logger.info(f"Computed {candles.num_rows} candles from {args.input}")
+
+    if args.output_parquet is not None:
+        write_candles_to_parquet(candles, args.output_parquet)
+    if args.kafka_topic is not None:
+        produce_candles(candles, args.kafka_broker_address, args.kafka_topic)
@@ -0,0 +1,201 @@
+"""
+Compact binary encoding of the messages in the trades topic.
+
+JSON repeats the key names in every message, and turns every float into text and
+back. With this encoding a trade is a fixed-layout struct followed by its product
+ID, e.g. 33 bytes for a BTC/USD trade instead of about 90 bytes of JSON.
+
+Layout of version 1 (little-endian, no padding):
+
+    version       uint8     always 1
+    timestamp_ms  int64
+    price         float64
+    quantity      float64
+    product_len   uint8     length of the product ID in bytes
+    product_id    bytes     UTF-8
+
+Version 2 is an envelope that carries a batch of trades of one product in a
+single message, column by column, so a backfill sends a few Kafka messages per
+REST page instead of one per trade:
+
+    version       uint8     always 2
+    n_trades      uint32
+    product_len   uint8     length of the product ID in bytes
+    product_id    bytes     UTF-8
+    timestamp_ms  int64[n_trades]
+    price         float64[n_trades]
+    quantity      float64[n_trades]
+
+The first byte is the version, so we can change the layout later and still read
+the old messages. A JSON message starts with "{", so the deserializer can read all
+the formats side by side while the producers are switched from one to the other.
+
+This file is the same in trade_producer and trade_to_ohlcv, keep them in sync.
+"""
+
+import struct
+
+import numpy as np
+from quixstreams.models.serializers import (
+    Deserializer,
+    SerializationContext,
+    Serializer,
+)
+from quixstreams.utils.json import loads as json_loads
+
+# The wire formats of the trades topic
+WIRE_FORMATS = ("json", "binary", "batch")
+
+WIRE_FORMAT_VERSION = 1
+HEADER = struct.Struct("<BqddB")
+
+BATCH_WIRE_FORMAT_VERSION = 2
+BATCH_HEADER = struct.Struct("<BIB")
+
+_JSON_START = ord("{")
+
+
+def encode_trade(trade: dict) -> bytes:
+    """
+    Encodes a trade, as a dict with the fields of a Trade, into a binary message.
+
+    Args:
+        trade (dict): The trade, e.g. {"product_id": "BTC/USD", "quantity": 0.1,
+            "price": 100.0, "timestamp_ms": 1}
+
+    Returns:
+        bytes: The binary message.
+    """
+    product_id = trade["product_id"].encode()
+    if len(product_id) > 255:
+        raise ValueError(f"Product ID is too long: {trade['product_id']}")
+
+    return (
+        HEADER.pack(
+            WIRE_FORMAT_VERSION,
+            trade["timestamp_ms"],
+            trade["price"],
+            trade["quantity"],
+            len(product_id),
+        )
+        + product_id
+    )
+
+
+def encode_trade_batch(
+    product_id: str,
+    timestamp_ms: np.ndarray,
+    price: np.ndarray,
+    quantity: np.ndarray,
+) -> bytes:
+    """
+    Encodes a batch of trades of one product into a single binary message.
+
+    Args:
+        product_id (str): The product ID of all the trades.
+        timestamp_ms (np.ndarray): The timestamps of the trades, in milliseconds.
+        price (np.ndarray): The prices of the trades.
+        quantity (np.ndarray): The quantities of the trades.
+
+    Returns:
+        bytes: The binary message.
+    """
+    product_bytes = product_id.encode()
+    if len(product_bytes) > 255:
+        raise ValueError(f"Product ID is too long: {product_id}")
+
+    return b"".join(
+        [
+            BATCH_HEADER.pack(
+                BATCH_WIRE_FORMAT_VERSION, len(timestamp_ms), len(product_bytes)
+            ),
+            product_bytes,
+            np.asarray(timestamp_ms, dtype="<i8").tobytes(),
+            np.asarray(price, dtype="<f8").tobytes(),
+            np.asarray(quantity, dtype="<f8").tobytes(),
+        ]
+    )
+
+
+def decode_trade(value: bytes) -> dict:
+    """
+    Decodes a message of the trades topic, in any of the wire formats.
+
+    Args:
+        value (bytes): The message value.
+
+    Returns:
+        dict: The trade, with the same fields the JSON message has. For a batch of
+            trades, see `decode_trade_batch`.
+    """
+    version = value[0]
+
+    if version == WIRE_FORMAT_VERSION:
+        _, timestamp_ms, price, quantity, product_len = HEADER.unpack_from(value)
+        product_id = value[HEADER.size : HEADER.size + product_len].decode()
+        return {
+            "product_id": product_id,
+            "quantity": quantity,
+            "price": price,
+            "timestamp_ms": timestamp_ms,
+        }
+
+    if version == BATCH_WIRE_FORMAT_VERSION:
+        return decode_trade_batch(value)
+
+    if version == _JSON_START:
+        return json_loads(value)
+
+    raise ValueError(f"Unknown trade wire format version: {version}")
+
+
+def decode_trade_batch(value: bytes) -> dict:
+    """
+    Decodes a batch of trades of one product, without copying its columns.
+
+    Args:
+        value (bytes): The message value.
+
+    Returns:
+        dict: The product ID, the number of trades, the columns of the trades as
+            numpy arrays, and the timestamp of the first trade, e.g.
+            {"product_id": "BTC/USD", "n_trades": 2, "timestamps_ms": array([1, 2]),
+            "prices": array([...]), "quantities": array([...]), "timestamp_ms": 1}
+    """
+    _, n_trades, product_len = BATCH_HEADER.unpack_from(value)
+    offset = BATCH_HEADER.size + product_len
+    product_id = value[BATCH_HEADER.size : offset].decode()
+
+    timestamps_ms = np.frombuffer(value, dtype="<i8", count=n_trades, offset=offset)
+    offset += timestamps_ms.nbytes
+    prices = np.frombuffer(value, dtype="<f8", count=n_trades, offset=offset)
+    offset += prices.nbytes
+    quantities = np.frombuffer(value, dtype="<f8", count=n_trades, offset=offset)
+
+    return {
+        "product_id": product_id,
+        "n_trades": n_trades,
+        "timestamps_ms": timestamps_ms,
+        "prices": prices,
+        "quantities": quantities,
+        # the timestamp of the message, for the timestamp extractor
+        "timestamp_ms": int(timestamps_ms[0]) if n_trades > 0 else 0,
+    }
+
+
+class TradeSerializer(Serializer):
+    """
+    Quix Streams serializer of trades in the binary format.
+    """
+
+    def __call__(self, value: dict, ctx: SerializationContext) -> bytes:
+        return encode_trade(value)
+
+
+class TradeDeserializer(Deserializer):
+    """
+    Quix Streams deserializer of trades, in any of the wire formats.
+    """
+
+    def __call__(self, value: bytes, ctx: SerializationContext) -> dict:
+        return decode_trade(value)
@@ -0,0 +1,103 @@
+"""
+Partition-parallel workers.
+
+A quixstreams `Application` processes its messages on a single thread, so a single
+trade_to_ohlcv process uses one core whatever the number of products. The trade
+producer gives each product its own partition of the trades topic, and the state
+of the windows is kept per partition, so the partitions can be processed by
+independent processes: we start a pool of workers, each one a whole
+`transform_trade_to_ohlcv` in the same consumer group, and Kafka assigns each of
+them its share of the partitions.
+
+Each worker has its own state directory, so a partition that moves to another
+worker is restored from its changelog topic instead of competing for the RocksDB
+lock of the one it left.
+"""
+
+import multiprocessing
+import multiprocessing.connection
+import os
+from typing import List
+
+from confluent_kafka.admin import AdminClient
+from loguru import logger
+
+
+def num_topic_partitions(kafka_broker_address: str, topic_name: str) -> int:
+    """
+    Returns the number of partitions of a topic, which must exist.
+    """
+    admin = AdminClient({"bootstrap.servers": kafka_broker_address})
+    topic = admin.list_topics(topic_name, timeout=10).topics[topic_name]
+    return len(topic.partitions)
+
+
+def num_workers_for(num_workers: int, num_partitions: int) -> int:
+    """
+    Returns the number of worker processes to start.
+
+    Args:
+        num_workers: The requested number of workers, 0 for one per partition.
+        num_partitions: The number of partitions of the input topic.
+
+    Returns:
+        int: The number of workers, at most one per partition, since the others
+            would get no partition, and at most one per core.
+    """
+    if num_workers == 0:
+        num_workers = num_partitions
+    return max(1, min(num_workers, num_partitions, os.cpu_count() or 1))
+
+
+def _run_worker(worker_id: int, state_dir: str, kwargs: dict) -> None:
+    # imported here, in the worker process, since src.main starts the pool
+    from src.main import transform_trade_to_ohlcv
+
+    logger.info(f"Starting worker {worker_id}")
+    transform_trade_to_ohlcv(
+        **kwargs, state_dir=os.path.join(state_dir, f"worker-{worker_id}")
+    )
+
+
+def run_workers(num_workers: int, state_dir: str = "state", **kwargs) -> None:
+    """
+    Runs `transform_trade_to_ohlcv` in `num_workers` processes, and stops them all
+    if one of them exits.
+
+    Args:
+        num_workers: The number of worker processes.
+        state_dir: The directory of the state stores, with one subdirectory per
+            worker.
+        kwargs: The arguments of `transform_trade_to_ohlcv`, the same for all the
+            workers.
+
+    Returns:
+        None
+    """
+    # spawn, not fork: the workers must not inherit the threads and the sockets
+    # of librdkafka
+    context = multiprocessing.get_context("spawn")
+    workers: List[multiprocessing.Process] = [
+        context.Process(
+            target=_run_worker,
+            args=(worker_id, state_dir, kwargs),
+            name=f"trade_to_ohlcv-{worker_id}",
+        )
+        for worker_id in range(num_workers)
+    ]
+    for worker in workers:
+        worker.start()
+
+    try:
+        # the workers only exit on errors, or when they are stopped
+        multiprocessing.connection.wait([worker.sentinel for worker in workers])
+        failed = [worker.name for worker in workers if worker.exitcode]
+    finally:
+        for worker in workers:
+            if worker.is_alive():
+                worker.terminate()
+        for worker in workers:
+            worker.join()
+
+    if failed:
+        raise RuntimeError(f"Workers {failed} failed")
@@ -0,0 +1,64 @@
+import contextvars
+from typing import Iterable, List
+
+from quixstreams import Application
+from quixstreams.context import set_message_context
+from quixstreams.models import MessageContext
+
+import src.main
+
+
+def run_pipeline(
+    monkeypatch, records: Iterable[dict], state_dir: str, **kwargs
+) -> List[dict]:
+    """
+    Runs the records through the dataframe of `transform_trade_to_ohlcv`, with
+    real state stores but without Kafka, as the messages of a single partition
+    of the "trades" topic, and returns the candles of its last resolution.
+
+    Args:
+        monkeypatch: The pytest fixture.
+        records: The decoded messages of the input topic.
+        state_dir: Where to keep the state stores.
+        kwargs: The other arguments of `transform_trade_to_ohlcv`.
+
+    Returns:
+        list[dict]: The candles, in order.
+    """
+    applications = []
+
+    class LocalApplication(Application):
+        def __init__(self, **kwargs):
+            super().__init__(**kwargs, use_changelog_topics=False)
+
+        def run(self, dataframe):
+            applications.append((self, dataframe))
+
+        def setup_topics(self):
+            pass
+
+    monkeypatch.setattr(src.main, "Application", LocalApplication)
+    src.main.transform_trade_to_ohlcv(
+        kafka_broker_address="localhost:9092",
+        kafka_input_topic="trades",
+        kafka_output_topic="ohlcv",
+        kafka_consumer_group_id="trade_to_ohlcv",
+        state_dir=state_dir,
+        **kwargs,
+    )
+    [(app, sdf)] = applications
+
+    app._state_manager.on_partition_assign(
+        topic="trades", partition=0, committed_offset=-1001
+    )
+    app._processing_context.init_checkpoint()
+    outputs = []
+    process = sdf.compose(
+        sink=lambda value, key, timestamp, headers: outputs.append(value)
+    )["trades"]
+    for offset, record in enumerate(records):
+        context = contextvars.copy_context()
+        context.run(set_message_context, MessageContext("trades", 0, offset, 0))
+        key = record["product_id"].replace("/", "-").encode()
+        context.run(process, record, key, record["timestamp_ms"], None)
+    return outputs
@@ -0,0 +1,26 @@
+from quixstreams.context import set_message_context
+from quixstreams.models import MessageContext
+from quixstreams.utils.json import dumps, loads
+
+
+class DictState:
+    """
+    The state of one message key, serialized like the state store does.
+    """
+
+    def __init__(self) -> None:
+        self._values = {}
+
+    def get(self, key: str, default=None):
+        return loads(self._values[key]) if key in self._values else default
+
+    def set(self, key: str, value) -> None:
+        self._values[key] = dumps(value)
+
+
+def set_input_partition(partition: int, topic: str = "trades") -> None:
+    """
+    Sets the message context of the record being processed, like the application
+    does for each message, for the steps that read its partition.
+    """
+    set_message_context(MessageContext(topic, partition, 0, 0))
@@ -0,0 +1,134 @@
+from src.gap_filling import empty_window_candles
+from src.live_candles import LiveCandles
+from src.main import init_ohlcv_candle, to_ohlcv_candle, update_ohlcv_candle
+from tests.pipeline import run_pipeline
+from tests.state import DictState, set_input_partition
+
+WINDOW_MS = 60_000
+
+
+def candle(
+    end_ms: int, close: float, volume: float = 1.0, product_id: str = "BTC/USD"
+) -> dict:
+    return {
+        "product_id": product_id,
+        "timestamp_ms": end_ms,
+        "open": close,
+        "high": close,
+        "low": close,
+        "close": close,
+        "volume": volume,
+    }
+
+
+def test_empty_windows_get_forward_filled_candles():
+    live_candles = LiveCandles(
+        window_ms=WINDOW_MS,
+        initializer=init_ohlcv_candle,
+        reducer=update_ohlcv_candle,
+        to_candle=to_ohlcv_candle,
+        fill_gaps=True,
+    )
+    state = DictState()
+    set_input_partition(0)
+    trade = {"product_id": "BTC/USD", "quantity": 1.0}
+
+    candles = []
+    for timestamp_ms, price in [(1_000, 10.0), (181_000, 12.0), (241_000, 13.0)]:
+        candles += live_candles(
+            {**trade, "price": price, "timestamp_ms": timestamp_ms}, state
+        )
+
+    assert candles == [
+        candle(60_000, 10.0),
+        candle(120_000, 10.0, volume=0.0),
+        candle(180_000, 10.0, volume=0.0),
+        candle(240_000, 12.0),
+    ]
+
+
+def test_long_gaps_are_filled_up_to_max_gap_windows():
+    candles = empty_window_candles(
+        "BTC/USD", 10.0, 0, 100 * WINDOW_MS, WINDOW_MS, max_gap_windows=3
+    )
+
+    assert [c["timestamp_ms"] for c in candles] == [
+        97 * WINDOW_MS,
+        98 * WINDOW_MS,
+        99 * WINDOW_MS,
+    ]
+
+
+def test_heartbeats_fill_the_windows_of_quiet_products():
+    live_candles = LiveCandles(
+        window_ms=WINDOW_MS,
+        initializer=init_ohlcv_candle,
+        reducer=update_ohlcv_candle,
+        to_candle=to_ohlcv_candle,
+        fill_gaps=True,
+    )
+    state = DictState()
+    set_input_partition(0)
+    trade = {"product_id": "BTC/USD", "price": 10.0, "quantity": 1.0}
+    heartbeat = {"product_id": "BTC/USD", "heartbeat": True}
+
+    live_candles({**trade, "timestamp_ms": 1_000}, state)
+    candles = []
+    for timestamp_ms in [60_500, 150_000, 181_000]:
+        candles += live_candles({**heartbeat, "timestamp_ms": timestamp_ms}, state)
+    candles += live_candles({**trade, "price": 11.0, "timestamp_ms": 250_000}, state)
+    candles += live_candles({**heartbeat, "timestamp_ms": 300_000}, state)
+
+    assert candles == [
+        candle(60_000, 10.0),
+        candle(120_000, 10.0, volume=0.0),
+        candle(180_000, 10.0, volume=0.0),
+        candle(240_000, 10.0, volume=0.0),
+        candle(300_000, 11.0),
+    ]
+
+
+def test_a_quiet_product_is_filled_while_another_one_trades(monkeypatch, tmp_path):
+    def trade(product_id: str, timestamp_ms: int, price: float) -> dict:
+        return {
+            "product_id": product_id,
+            "price": price,
+            "quantity": 1.0,
+            "timestamp_ms": timestamp_ms,
+        }
+
+    # BTC/USD goes quiet after its first trade, ETH/USD keeps trading, and the
+    # heartbeats of BTC/USD are all we get of it
+    records = [trade("BTC/USD", 1_000, 10.0)]
+    for timestamp_ms in [61_000, 121_000, 181_000, 241_000]:
+        records.append(trade("ETH/USD", timestamp_ms, 20.0))
+        records.append(
+            {
+                "product_id": "BTC/USD",
+                "timestamp_ms": timestamp_ms - 1_000,
+                "heartbeat": True,
+                "consumer_group": "trade_to_ohlcv",
+            }
+        )
+
+    # the default mode, without a grace period or provisional candles
+    candles = run_pipeline(
+        monkeypatch,
+        records,
+        str(tmp_path),
+        ohlcv_window_ms=WINDOW_MS,
+        fill_gaps=True,
+    )
+
+    btc_candles = [c for c in candles if c["product_id"] == "BTC/USD"]
+    assert btc_candles == [
+        candle(60_000, 10.0),
+        candle(120_000, 10.0, volume=0.0),
+        candle(180_000, 10.0, volume=0.0),
+        candle(240_000, 10.0, volume=0.0),
+    ]
+    assert [c["timestamp_ms"] for c in candles if c["product_id"] == "ETH/USD"] == [
+        120_000,
+        180_000,
+        240_000,
+    ]
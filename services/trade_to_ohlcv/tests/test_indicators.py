@@ -0,0 +1,116 @@
+import random
+
+import numpy as np
+import pytest
+from quixstreams.utils.json import dumps, loads
+
+from src.indicators import INDICATOR_COLUMNS, TechnicalIndicators
+from src.main import add_technical_indicators
+from tests.state import DictState
+
+
+def random_candles(n_candles: int, seed: int = 42) -> list[dict]:
+    """
+    A random walk of 1m candles, with a few flat ones like the ones of quiet
+    minutes with a single trade.
+    """
+    rng = random.Random(seed)
+    candles = []
+    close = 60_000.0
+    for i in range(n_candles):
+        open_ = close
+        close = open_ + rng.gauss(0, 30)
+        high = max(open_, close) + abs(rng.gauss(0, 10))
+        low = min(open_, close) - abs(rng.gauss(0, 10))
+        if i % 50 == 0:
+            open_ = high = low = close
+        candles.append(
+            {
+                "product_id": "BTC/USD",
+                "timestamp_ms": (i + 1) * 60_000,
+                "open": open_,
+                "high": high,
+                "low": low,
+                "close": close,
+                "volume": rng.uniform(0, 5),
+            }
+        )
+    return candles
+
+
+def talib_indicators(candles: list[dict]) -> dict:
+    """
+    The indicators the way `add_technical_indicators` of the price predictor
+    computes them.
+    """
+    talib = pytest.importorskip("talib")
+    high, low, close, volume = (
+        np.array([candle[column] for candle in candles])
+        for column in ["high", "low", "close", "volume"]
+    )
+    macd, macd_signal, _ = talib.MACD(
+        close, fastperiod=12, slowperiod=26, signalperiod=9
+    )
+    bb_upper, bb_middle, bb_lower = talib.BBANDS(
+        close, timeperiod=20, nbdevup=2, nbdevdn=2
+    )
+    stoch_k, stoch_d = talib.STOCH(
+        high,
+        low,
+        close,
+        fastk_period=14,
+        slowk_period=3,
+        slowk_matype=0,
+        slowd_period=3,
+        slowd_matype=0,
+    )
+    return {
+        "SMA_7": talib.SMA(close, timeperiod=7),
+        "SMA_14": talib.SMA(close, timeperiod=14),
+        "SMA_28": talib.SMA(close, timeperiod=28),
+        "EMA_7": talib.EMA(close, timeperiod=7),
+        "EMA_14": talib.EMA(close, timeperiod=14),
+        "EMA_28": talib.EMA(close, timeperiod=28),
+        "RSI_14": talib.RSI(close, timeperiod=14),
+        "MACD": macd,
+        "MACD_Signal": macd_signal,
+        "BB_Upper": bb_upper,
+        "BB_Middle": bb_middle,
+        "BB_Lower": bb_lower,
+        "Stoch_K": stoch_k,
+        "Stoch_D": stoch_d,
+        "OBV": talib.OBV(close, volume),
+        "ATR": talib.ATR(high, low, close, timeperiod=14),
+        "CCI": talib.CCI(high, low, close, timeperiod=14),
+        "CMF": talib.ADOSC(high, low, close, volume, fastperiod=3, slowperiod=10),
+    }
+
+
+def test_indicators_match_talib():
+    candles = random_candles(1_000)
+    expected = talib_indicators(candles)
+
+    state = DictState()
+    enriched = [
+        add_technical_indicators(dict(candle), state, "indicators_60s")
+        for candle in candles
+    ]
+
+    for column in INDICATOR_COLUMNS:
+        values = np.array([candle[column] for candle in enriched], dtype=float)
+        # None while warming up, where talib returns NaN
+        np.testing.assert_array_equal(np.isnan(values), np.isnan(expected[column]))
+        # talib builds differ in the last bits of some divisions
+        np.testing.assert_allclose(values, expected[column], rtol=1e-9)
+
+
+def test_indicators_state_goes_through_json():
+    candles = random_candles(100)
+    indicators = TechnicalIndicators()
+    for candle in candles[:60]:
+        indicators.update(candle)
+
+    restored = TechnicalIndicators.from_dict(loads(dumps(indicators.to_dict())))
+
+    for candle in candles[60:]:
+        assert restored.update(candle) == indicators.update(candle)
@@ -0,0 +1,193 @@
+import pytest
+from quixstreams.utils.json import loads
+
+from src.live_candles import Heartbeats, LiveCandles
+from src.main import init_ohlcv_candle, to_ohlcv_candle, update_ohlcv_candle
+from tests.pipeline import run_pipeline
+from tests.state import DictState, set_input_partition
+
+WINDOW_MS = 60_000
+
+
+class RecordingProducer:
+    def __init__(self) -> None:
+        self.messages = []
+
+    def produce(self, **kwargs) -> None:
+        self.messages.append(kwargs)
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 1_000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def trade(timestamp_ms: int, price: float, quantity: float = 1.0) -> dict:
+    return {
+        "product_id": "BTC/USD",
+        "price": price,
+        "quantity": quantity,
+        "timestamp_ms": timestamp_ms,
+    }
+
+
+def heartbeat(timestamp_ms: int) -> dict:
+    return {"product_id": "BTC/USD", "timestamp_ms": timestamp_ms, "heartbeat": True}
+
+
+def live_candles(**kwargs) -> LiveCandles:
+    set_input_partition(0)
+    return LiveCandles(
+        window_ms=WINDOW_MS,
+        initializer=init_ohlcv_candle,
+        reducer=update_ohlcv_candle,
+        to_candle=to_ohlcv_candle,
+        **kwargs,
+    )
+
+
+def test_windows_are_closed_by_the_next_window_like_final():
+    candles = live_candles()
+    state = DictState()
+
+    closed = []
+    for record in [
+        trade(1_000, 10.0),
+        trade(30_000, 12.0),
+        trade(59_999, 9.0, 2.0),
+        trade(61_000, 11.0),
+        # late, its window is closed
+        trade(50_000, 100.0),
+        trade(125_000, 13.0),
+    ]:
+        closed += candles(record, state)
+
+    assert closed == [
+        {
+            "product_id": "BTC/USD",
+            "timestamp_ms": 60_000,
+            "open": 10.0,
+            "high": 12.0,
+            "low": 9.0,
+            "close": 9.0,
+            "volume": 4.0,
+        },
+        {
+            "product_id": "BTC/USD",
+            "timestamp_ms": 120_000,
+            "open": 11.0,
+            "high": 11.0,
+            "low": 11.0,
+            "close": 11.0,
+            "volume": 1.0,
+        },
+    ]
+
+
+def test_heartbeats_close_the_windows_without_a_trade():
+    candles = live_candles()
+    state = DictState()
+    candles(trade(1_000, 10.0), state)
+
+    assert candles(heartbeat(59_000), state) == []
+    [closed] = candles(heartbeat(60_500), state)
+    assert closed["timestamp_ms"] == 60_000
+    assert candles(heartbeat(61_500), state) == []
+
+    # a trade of the closed window that arrives after the heartbeat is dropped
+    assert candles(trade(59_000, 10.0), state) == []
+    assert candles(heartbeat(120_000), state) == []
+
+
+def test_provisional_candles_are_throttled():
+    producer = RecordingProducer()
+    clock = FakeClock()
+    candles = live_candles(
+        producer=producer,
+        provisional_topic="ohlcv_live",
+        provisional_interval_ms=1_000,
+        clock=clock,
+    )
+    state = DictState()
+
+    for i, price in enumerate([10.0, 11.0, 12.0, 13.0, 14.0]):
+        clock.now += 0.4
+        candles(trade(1_000 + i, price), state)
+
+    # sent at 0.4s, 1.6s: the others are less than 1s after the last one
+    provisional = [loads(message["value"]) for message in producer.messages]
+    assert [candle["close"] for candle in provisional] == [10.0, 13.0]
+    assert all(candle["provisional"] for candle in provisional)
+    assert all(candle["timestamp_ms"] == WINDOW_MS for candle in provisional)
+    assert {message["topic"] for message in producer.messages} == {"ohlcv_live"}
+    assert {message["key"] for message in producer.messages} == {"BTC-USD"}
+
+
+def test_heartbeats_go_to_the_partition_of_their_product():
+    candles = live_candles()
+    state = DictState()
+    for partition, product_id in enumerate(["ETH/USD", "BTC/USD"]):
+        set_input_partition(partition)
+        candles({**trade(1_000, 10.0), "product_id": product_id}, state)
+    producer = RecordingProducer()
+
+    Heartbeats(
+        candles, producer, "trades", consumer_group="ohlcv", close_grace_ms=0
+    ).send_heartbeats(5_000)
+
+    sent = heartbeat(5_000) | {"consumer_group": "ohlcv"}
+    assert [
+        (message["key"], message["partition"], loads(message["value"]))
+        for message in producer.messages
+    ] == [
+        ("ETH-USD", 0, sent | {"product_id": "ETH/USD"}),
+        ("BTC-USD", 1, sent),
+    ]
+
+
+@pytest.mark.parametrize("trade_wire_format", ["json", "batch"])
+def test_heartbeats_are_dropped_outside_of_the_low_latency_mode(
+    monkeypatch, tmp_path, trade_wire_format
+):
+    records = [
+        trade(1_000, 10.0),
+        heartbeat(70_000) | {"consumer_group": "trade_to_ohlcv"},
+        trade(61_000, 11.0),
+        trade(121_000, 12.0),
+    ]
+
+    candles = run_pipeline(
+        monkeypatch,
+        records,
+        str(tmp_path),
+        ohlcv_window_ms=WINDOW_MS,
+        trade_wire_format=trade_wire_format,
+    )
+
+    # the heartbeat neither failed nor closed the second window before its trade
+    assert [(c["timestamp_ms"], c["close"]) for c in candles] == [
+        (60_000, 10.0),
+        (120_000, 11.0),
+    ]
+
+
+def test_heartbeats_of_other_consumer_groups_are_dropped(monkeypatch, tmp_path):
+    records = [
+        trade(1_000, 10.0),
+        heartbeat(200_000) | {"consumer_group": "another_job"},
+        trade(30_000, 11.0),
+        heartbeat(60_500) | {"consumer_group": "trade_to_ohlcv"},
+    ]
+
+    candles = run_pipeline(
+        monkeypatch,
+        records,
+        str(tmp_path),
+        ohlcv_window_ms=WINDOW_MS,
+        close_grace_ms=500,
+    )
+
+    assert [(c["timestamp_ms"], c["close"]) for c in candles] == [(60_000, 11.0)]
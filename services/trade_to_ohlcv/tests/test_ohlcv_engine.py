@@ -0,0 +1,188 @@
+import random
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+from quixstreams.models import Topic
+
+from src.main import init_ohlcv_candle, update_ohlcv_candle, window_to_ohlcv_candle
+from src.ohlcv_engine import (
+    TRADE_SCHEMA,
+    OHLCVEngine,
+    compute_ohlcv_candles,
+    read_trade_batches,
+    serialize_candles,
+)
+
+WINDOW_MS = 60_000
+
+# A day of trades of the trade cache, written by the `TradeCache` of the trade
+# producer. test_trade_cache.py of the trade producer checks its schema too.
+TRADE_CACHE_FIXTURE = Path(__file__).parent / "data" / "trade_cache"
+
+
+def streaming_candles(trades: list[dict], window_ms: int) -> list[dict]:
+    """
+    Aggregates the trades one by one with the reducer of the streaming pipeline,
+    dropping the late trades like a quixstreams tumbling window with no grace
+    period, with one partition per product.
+    """
+    windows = {}
+    latest_ms = {}
+    for trade in trades:
+        product_id = trade["product_id"]
+        start = trade["timestamp_ms"] - trade["timestamp_ms"] % window_ms
+        if start + window_ms <= latest_ms.get(product_id, 0):
+            continue
+        latest_ms[product_id] = max(latest_ms.get(product_id, 0), trade["timestamp_ms"])
+
+        key = (product_id, start)
+        if key in windows:
+            windows[key] = update_ohlcv_candle(windows[key], trade)
+        else:
+            windows[key] = init_ohlcv_candle(trade)
+
+    return [
+        window_to_ohlcv_candle(
+            {"start": start, "end": start + window_ms, "value": candle},
+            product_id.replace("/", "-").encode(),
+            start,
+            None,
+        )
+        for (product_id, start), candle in sorted(windows.items())
+    ]
+
+
+def random_trades(n_trades: int, seed: int = 42) -> list[dict]:
+    """
+    Trades of two products, mostly in time order, with a few late ones.
+    """
+    rng = random.Random(seed)
+    trades = []
+    timestamps_ms = {"BTC/USD": 0, "ETH/USD": 0}
+    for _ in range(n_trades):
+        product_id = rng.choice(list(timestamps_ms))
+        timestamps_ms[product_id] += rng.randrange(0, 5_000)
+        timestamp_ms = timestamps_ms[product_id]
+        if rng.random() < 0.05:
+            timestamp_ms = max(timestamp_ms - rng.randrange(0, 120_000), 0)
+        trades.append(
+            {
+                "product_id": product_id,
+                "price": rng.uniform(100, 200),
+                "quantity": rng.uniform(0.0001, 3),
+                "timestamp_ms": timestamp_ms,
+            }
+        )
+    return trades
+
+
+def to_table(trades: list[dict]) -> pa.Table:
+    return pa.Table.from_pylist(
+        trades,
+        schema=pa.schema(
+            [
+                ("product_id", pa.string()),
+                ("quantity", pa.float64()),
+                ("price", pa.float64()),
+                ("timestamp_ms", pa.int64()),
+            ]
+        ),
+    )
+
+
+def candles_as_dicts(candles: pa.Table) -> list[dict]:
+    return sorted(
+        candles.to_pylist(), key=lambda c: (c["product_id"], c["timestamp_ms"])
+    )
+
+
+@pytest.mark.parametrize("window_ms", [1_000, WINDOW_MS, 3_600_000])
+def test_engine_matches_the_streaming_reducer_exactly(window_ms):
+    trades = random_trades(20_000)
+
+    candles = compute_ohlcv_candles(to_table(trades), window_ms)
+
+    assert candles_as_dicts(candles) == streaming_candles(trades, window_ms)
+
+
+def test_engine_carries_the_open_windows_over_batches():
+    trades = random_trades(5_000, seed=7)
+    rng = random.Random(7)
+    cuts = sorted(rng.sample(range(1, len(trades)), 20))
+
+    engine = OHLCVEngine(WINDOW_MS)
+    tables = [
+        engine.add(to_table(trades[start:end]))
+        for start, end in zip([0, *cuts], [*cuts, len(trades)])
+    ]
+    tables.append(engine.flush())
+
+    assert candles_as_dicts(pa.concat_tables(tables)) == streaming_candles(
+        trades, WINDOW_MS
+    )
+
+
+def test_read_trade_batches_reads_the_parquet_files_in_order(tmp_path):
+    trades = random_trades(1_000)
+    for day, (start, end) in enumerate([(0, 400), (400, 1_000)]):
+        directory = tmp_path / "BTC-USD"
+        directory.mkdir(exist_ok=True)
+        pq.write_table(
+            to_table(trades[start:end]), directory / f"2024-10-0{day + 1}.parquet"
+        )
+    (tmp_path / "BTC-USD" / "index.json").write_text("[]")
+
+    engine = OHLCVEngine(WINDOW_MS)
+    tables = [engine.add(batch) for batch in read_trade_batches(str(tmp_path))]
+    tables.append(engine.flush())
+
+    assert candles_as_dicts(pa.concat_tables(tables)) == streaming_candles(
+        trades, WINDOW_MS
+    )
+
+
+def test_read_trade_batches_reads_the_cache_of_the_trade_producer():
+    (file,) = TRADE_CACHE_FIXTURE.rglob("*.parquet")
+    assert pq.read_schema(file).remove_metadata() == TRADE_SCHEMA
+
+    candles = compute_ohlcv_candles(
+        pa.Table.from_batches(read_trade_batches(str(TRADE_CACHE_FIXTURE))), WINDOW_MS
+    )
+
+    assert candles.column("timestamp_ms").to_pylist() == [
+        1727740860000,
+        1727740920000,
+        1727740980000,
+    ]
+    assert candles.column("volume").to_pylist() == [1.35, 0.5, 0.05]
+
+
+def test_serialize_candles_matches_the_json_serializer():
+    candles = compute_ohlcv_candles(to_table(random_trades(2_000)), WINDOW_MS)
+    # whole numbers, and numbers that Arrow and orjson format differently
+    opens = [100.0, 1e-05, 1e20, 1e-6, 3.5303794225422716e-6, 1e15, 1e16, 0.0]
+    candles = candles.set_column(
+        2, "open", pa.array(opens + [0.1] * (candles.num_rows - len(opens)))
+    )
+    topic = Topic(name="ohlcv", value_serializer="json")
+
+    keys, values = serialize_candles(candles)
+
+    messages = [
+        topic.serialize(key=candle["product_id"].replace("/", "-"), value=candle)
+        for candle in candles.to_pylist()
+    ]
+    assert keys == [message.key for message in messages]
+    assert values == [message.value for message in messages]
+
+
+def test_serialize_candles_rejects_values_json_cant_hold():
+    candles = compute_ohlcv_candles(to_table(random_trades(10)), WINDOW_MS)
+    candles = candles.set_column(
+        6, "volume", pa.array([float("nan")] * candles.num_rows)
+    )
+
+    with pytest.raises(ValueError):
+        serialize_candles(candles)
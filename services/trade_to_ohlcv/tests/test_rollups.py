@@ -0,0 +1,93 @@
+import random
+
+import pytest
+
+from src.main import (
+    check_rollups,
+    init_ohlcv_candle,
+    init_ohlcv_candle_from_partial,
+    merge_ohlcv_candles,
+    update_ohlcv_candle,
+    window_to_ohlcv_candle,
+)
+
+
+def aggregate(records: list[dict], window_ms: int, initializer, reducer) -> list:
+    """
+    Aggregates the records into closed windows, like the tumbling windows of the
+    pipeline do, and returns them as (window start, candle) pairs.
+    """
+    windows = {}
+    for record in records:
+        start = record["timestamp_ms"] - record["timestamp_ms"] % window_ms
+        if start in windows:
+            windows[start] = reducer(windows[start], record)
+        else:
+            windows[start] = initializer(record)
+    return [
+        (
+            start,
+            window_to_ohlcv_candle(
+                {"start": start, "end": start + window_ms, "value": candle},
+                b"BTC-USD",
+                start,
+                None,
+            ),
+        )
+        for start, candle in sorted(windows.items())
+    ]
+
+
+def test_rolled_up_candles_match_the_candles_of_the_trades():
+    rng = random.Random(42)
+    trades = [
+        {
+            "product_id": "BTC/USD",
+            "price": rng.uniform(60_000, 61_000),
+            "quantity": rng.uniform(0.001, 1),
+            "timestamp_ms": timestamp_ms,
+        }
+        for timestamp_ms in sorted(rng.randrange(0, 3_600_000) for _ in range(5000))
+    ]
+
+    direct = aggregate(trades, 300_000, init_ohlcv_candle, update_ohlcv_candle)
+
+    # 1s candles, rolled up into 1m and then 5m candles, each one timestamped with
+    # the start of its window like `final` does
+    candles = trades
+    initializer, reducer = init_ohlcv_candle, update_ohlcv_candle
+    for window_ms in [1_000, 60_000, 300_000]:
+        windows = aggregate(candles, window_ms, initializer, reducer)
+        candles = [{**candle, "timestamp_ms": start} for start, candle in windows]
+        initializer, reducer = init_ohlcv_candle_from_partial, merge_ohlcv_candles
+
+    assert len(windows) == len(direct) == 12
+    for (_, rolled_up), (_, candle) in zip(windows, direct):
+        volume = rolled_up.pop("volume")
+        assert volume == pytest.approx(candle.pop("volume"), rel=1e-12)
+        assert rolled_up == candle
+
+
+@pytest.mark.parametrize(
+    "rollups",
+    [
+        [(60_000, "ohlcv_1m")],
+        [(300_000, "ohlcv_5m"), (450_000, "ohlcv_7m30s")],
+        [(300_000, "a"), (300_000, "b")],
+    ],
+)
+def test_rollups_must_be_multiples_of_the_window_before(rollups):
+    with pytest.raises(ValueError):
+        check_rollups(60_000, rollups)
+
+
+def test_rollups_accept_increasing_multiples():
+    check_rollups(
+        1_000, [(60_000, "ohlcv_1m"), (300_000, "ohlcv_5m"), (3_600_000, "ohlcv_1h")]
+    )
+
+
+def test_windows_can_be_shorter_than_a_second_and_not_divide_a_minute():
+    check_rollups(250, [(1_000, "ohlcv_1s"), (7_000, "ohlcv_7s"), (91_000, "ohlcv")])
+    with pytest.raises(ValueError):
+        check_rollups(250, [(900, "ohlcv_900ms")])
@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+from src.trade_codec import (
+    TradeDeserializer,
+    decode_trade,
+    encode_trade,
+    encode_trade_batch,
+)
+
+
+def test_decode_trade_reads_what_encode_trade_writes():
+    trade = {
+        "product_id": "BTC/USD",
+        "quantity": 0.12345678,
+        "price": 65432.1,
+        "timestamp_ms": 1727740800123,
+    }
+
+    value = encode_trade(trade)
+
+    assert len(value) == 26 + len("BTC/USD")
+    assert decode_trade(value) == trade
+
+
+def test_trade_deserializer_reads_json_messages_too():
+    value = b'{"product_id":"BTC/USD","quantity":0.1,"price":100.0,"timestamp_ms":1}'
+
+    trade = TradeDeserializer()(value, ctx=None)
+
+    assert trade == {
+        "product_id": "BTC/USD",
+        "quantity": 0.1,
+        "price": 100.0,
+        "timestamp_ms": 1,
+    }
+
+
+def test_decode_trade_rejects_unknown_versions():
+    trade = {
+        "product_id": "BTC/USD",
+        "quantity": 0.1,
+        "price": 100.0,
+        "timestamp_ms": 1,
+    }
+    value = b"\x09" + encode_trade(trade)[1:]
+
+    with pytest.raises(ValueError):
+        decode_trade(value)
+
+
+def test_decode_trade_reads_batches_of_trades():
+    timestamps_ms = np.array([1, 2, 3])
+    prices = np.array([100.0, 101.5, 99.0])
+    quantities = np.array([0.1, 0.2, 0.3])
+
+    value = encode_trade_batch("BTC/USD", timestamps_ms, prices, quantities)
+    trades = TradeDeserializer()(value, ctx=None)
+
+    assert len(value) == 6 + len("BTC/USD") + 3 * 24
+    assert trades["product_id"] == "BTC/USD"
+    assert trades["n_trades"] == 3
+    assert trades["timestamp_ms"] == 1
+    assert trades["timestamps_ms"].tolist() == [1, 2, 3]
+    assert trades["prices"].tolist() == [100.0, 101.5, 99.0]
+    assert trades["quantities"].tolist() == [0.1, 0.2, 0.3]
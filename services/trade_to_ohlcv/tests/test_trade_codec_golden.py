@@ -0,0 +1,67 @@
+"""
+The bytes of each version of the wire format, pinned.
+
+src/trade_codec.py is copied in trade_producer and trade_to_ohlcv, and this test is
+the same in both, so a change of the layout on one side only fails the tests.
+"""
+
+import numpy as np
+
+from src.trade_codec import (
+    decode_trade,
+    decode_trade_batch,
+    encode_trade,
+    encode_trade_batch,
+)
+
+TRADE = {
+    "product_id": "BTC/USD",
+    "quantity": 0.5,
+    "price": 60000.25,
+    "timestamp_ms": 1727740800123,
+}
+TRADE_V1 = bytes.fromhex(
+    "01"  # version
+    "7b6c604592010000"  # timestamp_ms
+    "00000000084ced40"  # price
+    "000000000000e03f"  # quantity
+    "07"  # product_len
+    "4254432f555344"  # product_id
+)
+
+BATCH = {
+    "product_id": "ETH/USD",
+    "timestamps_ms": [1727740800123, 1727740800456],
+    "prices": [2500.5, 2501.0],
+    "quantities": [1.5, 0.25],
+}
+BATCH_V2 = bytes.fromhex(
+    "02"  # version
+    "02000000"  # n_trades
+    "07"  # product_len
+    "4554482f555344"  # product_id
+    "7b6c604592010000c86d604592010000"  # timestamp_ms
+    "000000000089a34000000000008aa340"  # price
+    "000000000000f83f000000000000d03f"  # quantity
+)
+
+
+def test_v1_layout():
+    assert encode_trade(TRADE) == TRADE_V1
+    assert decode_trade(TRADE_V1) == TRADE
+
+
+def test_v2_layout():
+    value = encode_trade_batch(
+        BATCH["product_id"],
+        np.array(BATCH["timestamps_ms"]),
+        np.array(BATCH["prices"]),
+        np.array(BATCH["quantities"]),
+    )
+    assert value == BATCH_V2
+
+    batch = decode_trade_batch(BATCH_V2)
+    assert batch["product_id"] == BATCH["product_id"]
+    assert batch["n_trades"] == 2
+    for column in ["timestamps_ms", "prices", "quantities"]:
+        assert list(batch[column]) == BATCH[column]
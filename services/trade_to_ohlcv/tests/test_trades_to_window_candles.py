@@ -0,0 +1,112 @@
+import random
+
+import numpy as np
+import pytest
+
+from src.main import (
+    init_ohlcv_candle,
+    init_ohlcv_candle_from_partial,
+    merge_ohlcv_candles,
+    trades_to_window_candles,
+    update_ohlcv_candle,
+)
+
+WINDOW_MS = 60_000
+
+
+def candles_trade_by_trade(trades: list[dict]) -> dict:
+    candles = {}
+    for trade in trades:
+        window = trade["timestamp_ms"] // WINDOW_MS
+        if window in candles:
+            candles[window] = update_ohlcv_candle(candles[window], trade)
+        else:
+            candles[window] = init_ohlcv_candle(trade)
+    return candles
+
+
+def candles_from_batches(batches: list[dict]) -> dict:
+    candles = {}
+    for batch in batches:
+        for partial in trades_to_window_candles(batch, WINDOW_MS):
+            window = partial["timestamp_ms"] // WINDOW_MS
+            if window in candles:
+                candles[window] = merge_ohlcv_candles(candles[window], partial)
+            else:
+                candles[window] = init_ohlcv_candle_from_partial(partial)
+    return candles
+
+
+def to_batch(trades: list[dict]) -> dict:
+    return {
+        "product_id": "BTC/USD",
+        "n_trades": len(trades),
+        "timestamps_ms": np.array([trade["timestamp_ms"] for trade in trades]),
+        "prices": np.array([trade["price"] for trade in trades]),
+        "quantities": np.array([trade["quantity"] for trade in trades]),
+        "timestamp_ms": trades[0]["timestamp_ms"],
+    }
+
+
+def test_batches_give_the_same_candles_as_single_trades():
+    random.seed(42)
+    timestamp_ms = 1727740800000
+    trades = []
+    for _ in range(1000):
+        timestamp_ms += random.randint(0, 2_000)
+        trades.append(
+            {
+                "product_id": "BTC/USD",
+                "quantity": random.uniform(0.0001, 2.0),
+                "price": random.uniform(60_000, 70_000),
+                "timestamp_ms": timestamp_ms,
+            }
+        )
+
+    expected = candles_trade_by_trade(trades)
+
+    # within a batch, the volumes are added in the same order
+    assert candles_from_batches([to_batch(trades)]) == expected
+
+    # the batch boundaries don't line up with the windows, so some windows add up
+    # the volumes of two batches
+    batches = [to_batch(trades[i : i + 300]) for i in range(0, 1000, 300)]
+    candles = candles_from_batches(batches)
+    assert candles.keys() == expected.keys()
+    for window, candle in candles.items():
+        assert candle == pytest.approx(expected[window])
+
+
+def test_single_trades_become_one_partial_candle():
+    trade = {
+        "product_id": "BTC/USD",
+        "quantity": 0.5,
+        "price": 100.0,
+        "timestamp_ms": 7,
+    }
+
+    assert trades_to_window_candles(trade, WINDOW_MS) == [
+        {
+            "open": 100.0,
+            "high": 100.0,
+            "low": 100.0,
+            "close": 100.0,
+            "volume": 0.5,
+            "product_id": "BTC/USD",
+            "timestamp_ms": 7,
+        }
+    ]
+
+
+def test_unsorted_batches_are_sorted_first():
+    batch = to_batch(
+        [
+            {"product_id": "BTC/USD", "quantity": 1.0, "price": 3.0, "timestamp_ms": 3},
+            {"product_id": "BTC/USD", "quantity": 1.0, "price": 1.0, "timestamp_ms": 1},
+            {"product_id": "BTC/USD", "quantity": 1.0, "price": 2.0, "timestamp_ms": 2},
+        ]
+    )
+
+    [candle] = trades_to_window_candles(batch, WINDOW_MS)
+
+    assert (candle["open"], candle["close"], candle["timestamp_ms"]) == (1.0, 3.0, 1)
@@ -1,60 +1,108 @@
 import pytest
-from src.main import update_ohlcv_candle
+from src.main import (
+    CLOSE,
+    HIGH,
+    LOW,
+    VOLUME,
+    init_ohlcv_candle,
+    merge_ohlcv_candles,
+    product_id_from_key,
+    update_ohlcv_candle,
+    window_to_ohlcv_candle,
+)
 
 
 def test_update_ohlcv_candle_higher_price():
-    candle = {
-        "open": 100,
-        "high": 110,
-        "low": 90,
-        "close": 105,
-        "volume": 10,
-        "product_id": "BTC-USD",
-    }
+    candle = [100, 110, 90, 105, 10]
     trade = {"price": 115, "quantity": 5, "product_id": "BTC-USD"}
 
     updated_candle = update_ohlcv_candle(candle, trade)
 
-    assert updated_candle["high"] == 115
-    assert updated_candle["close"] == 115
-    assert updated_candle["volume"] == 15
-    assert updated_candle["product_id"] == "BTC-USD"
+    assert updated_candle[HIGH] == 115
+    assert updated_candle[CLOSE] == 115
+    assert updated_candle[VOLUME] == 15
 
 
 def test_update_ohlcv_candle_lower_price():
-    candle = {
+    candle = [100, 110, 90, 105, 10]
+    trade = {"price": 85, "quantity": 3, "product_id": "BTC-USD"}
+
+    updated_candle = update_ohlcv_candle(candle, trade)
+
+    assert updated_candle[LOW] == 85
+    assert updated_candle[CLOSE] == 85
+    assert updated_candle[VOLUME] == 13
+
+
+def test_update_ohlcv_candle_same_price():
+    candle = [100, 110, 90, 105, 10]
+    trade = {"price": 105, "quantity": 2, "product_id": "BTC-USD"}
+
+    updated_candle = update_ohlcv_candle(candle, trade)
+
+    assert updated_candle[HIGH] == 110
+    assert updated_candle[LOW] == 90
+    assert updated_candle[CLOSE] == 105
+    assert updated_candle[VOLUME] == 12
+
+
+@pytest.mark.parametrize("key", [b"BTC-USD", "BTC-USD"])
+def test_product_id_comes_from_the_message_key(key):
+    assert product_id_from_key(key) == "BTC/USD"
+
+
+def test_window_to_ohlcv_candle():
+    candle = init_ohlcv_candle({"price": 100, "quantity": 1, "product_id": "BTC/USD"})
+    candle = update_ohlcv_candle(candle, {"price": 120, "quantity": 2})
+    candle = update_ohlcv_candle(candle, {"price": 90, "quantity": 3})
+    window = {"start": 0, "end": 60_000, "value": candle}
+
+    assert window_to_ohlcv_candle(window, b"BTC-USD", 0, None) == {
+        "product_id": "BTC/USD",
+        "timestamp_ms": 60_000,
+        "open": 100,
+        "high": 120,
+        "low": 90,
+        "close": 90,
+        "volume": 6,
+    }
+
+
+def legacy_candle() -> dict:
+    # the dict state of a window, as written before the list state
+    return {
         "open": 100,
         "high": 110,
         "low": 90,
         "close": 105,
         "volume": 10,
-        "product_id": "BTC-USD",
+        "product_id": "BTC/USD",
     }
-    trade = {"price": 85, "quantity": 3, "product_id": "BTC-USD"}
 
-    updated_candle = update_ohlcv_candle(candle, trade)
 
-    assert updated_candle["low"] == 85
-    assert updated_candle["close"] == 85
-    assert updated_candle["volume"] == 13
-    assert updated_candle["product_id"] == "BTC-USD"
+def test_windows_with_a_legacy_dict_state_keep_going():
+    candle = update_ohlcv_candle(
+        legacy_candle(), {"price": 115, "quantity": 5, "product_id": "BTC/USD"}
+    )
 
+    assert candle == [100, 115, 90, 115, 15]
 
-def test_update_ohlcv_candle_same_price():
-    candle = {
+
+def test_rolled_up_windows_with_a_legacy_dict_state_keep_going():
+    partial = {"open": 104, "high": 107, "low": 80, "close": 106, "volume": 2}
+
+    assert merge_ohlcv_candles(legacy_candle(), partial) == [100, 110, 80, 106, 12]
+
+
+def test_legacy_windows_are_closed_like_the_others():
+    window = {"start": 0, "end": 60_000, "value": legacy_candle()}
+
+    assert window_to_ohlcv_candle(window, b"BTC-USD", 0, None) == {
+        "product_id": "BTC/USD",
+        "timestamp_ms": 60_000,
         "open": 100,
         "high": 110,
         "low": 90,
         "close": 105,
         "volume": 10,
-        "product_id": "BTC-USD",
     }
-    trade = {"price": 105, "quantity": 2, "product_id": "BTC-USD"}
-
-    updated_candle = update_ohlcv_candle(candle, trade)
-
-    assert updated_candle["high"] == 110
-    assert updated_candle["low"] == 90
-    assert updated_candle["close"] == 105
-    assert updated_candle["volume"] == 12
-    assert updated_candle["product_id"] == "BTC-USD"
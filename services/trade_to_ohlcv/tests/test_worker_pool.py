@@ -0,0 +1,24 @@
+import os
+
+from src.worker_pool import num_workers_for
+
+
+def test_one_worker_per_partition_by_default(monkeypatch):
+    monkeypatch.setattr(os, "cpu_count", lambda: 8)
+
+    assert num_workers_for(0, 1) == 1
+    assert num_workers_for(0, 3) == 3
+    assert num_workers_for(0, 1_000) == 8
+
+
+def test_workers_without_a_partition_are_not_started(monkeypatch):
+    monkeypatch.setattr(os, "cpu_count", lambda: 8)
+
+    assert num_workers_for(4, 2) == 2
+    assert num_workers_for(16, 100) == 8
+
+
+def test_unknown_number_of_cores_means_one_worker(monkeypatch):
+    monkeypatch.setattr(os, "cpu_count", lambda: None)
+
+    assert num_workers_for(0, 4) == 1